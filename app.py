@@ -1,17 +1,27 @@
 from local_rag_chat.pages.chatbot import App
 from pipeline import RAGPipeline
 from local_rag_chat.logs.logging_config import logger
+from local_rag_chat.logs.metrics import metrics
+from configs import GRADIO_CONCURRENCY_LIMIT, GRADIO_QUEUE_MAX_SIZE, METRICS_HOST, METRICS_PORT
 
-logger.info("Starting the app...")
+# the page extraction workers are spawned and import this module again, as __mp_main__
+if __name__ == "__main__":
+    logger.info("Starting the app...")
 
-pipeline = RAGPipeline(
-    llm='llama3.2:1b',
-    embedding='BAAI/bge-small-en-v1.5',
-    chat_mode='condense_plus_context'
-)
+    pipeline = RAGPipeline(
+        llm='llama3.2:1b',
+        embedding='BAAI/bge-small-en-v1.5',
+        chat_mode='speculative_condense_plus_context',
+        parallel_loading=True
+    )
 
-app = App(pipeline)
-demo = app.build()
-demo.launch(server_name='0.0.0.0')
+    # no-op unless METRICS_ENABLED
+    metrics.start_server(METRICS_HOST, METRICS_PORT)
 
-logger.info("App started successfully!")
\ No newline at end of file
+    app = App(pipeline)
+    demo = app.build()
+    # handlers beyond the generation limit wait in the app's own bounded queue
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY_LIMIT, max_size=GRADIO_QUEUE_MAX_SIZE)
+    demo.launch(server_name='0.0.0.0')
+
+    logger.info("App started successfully!")
\ No newline at end of file
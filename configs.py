@@ -1 +1,51 @@
-OLLAMA_BASE_URL = "http://ollama_server:11434"
\ No newline at end of file
+import os
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama_server:11434")
+OLLAMA_CONNECT_TIMEOUT = 5
+OLLAMA_REQUEST_TIMEOUT = 180
+OLLAMA_LOAD_TIMEOUT = 600
+OLLAMA_TAGS_TTL = 60
+OLLAMA_KEEP_ALIVE = "1h"
+EMBEDDING_CACHE_DIR = "storage/embedding_cache"
+EMBEDDING_CACHE_MAX_ENTRIES = 100_000
+# "onnx" runs an int8 quantized export of the model with onnxruntime, it needs the onnx extra (poetry install --extras onnx)
+EMBEDDING_BACKEND = "huggingface"
+EMBEDDING_LAZY = True
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_NUM_THREADS = None
+EMBEDDING_ONNX_DIR = "storage/onnx"
+EMBEDDING_QUANTIZE = True
+# "int8" or "binary" keeps compressed vectors in memory and the float32 ones memory-mapped under VECTOR_STORAGE_DIR
+VECTOR_COMPRESSION = None
+VECTOR_STORAGE_DIR = "storage/vectors"
+SUMMARY_CACHE_DIR = "storage/summaries"
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 256
+ANSWER_CACHE_TTL = 3600
+SESSION_MAX_SESSIONS = 64
+SESSION_IDLE_TTL = 3600
+SESSION_MEMORY_TOKEN_LIMIT = 3900
+MAX_CONCURRENT_GENERATIONS = 2
+MAX_WAITING_GENERATIONS = 16
+GENERATION_WAIT_TIMEOUT = 30
+# cross-encoder reranking of the hybrid results, None disables it
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# candidates fetched for the reranker and chunks it passes on to the LLM
+RERANK_CANDIDATES = 10
+RERANK_TOP_N = 3
+RERANK_CUTOFF_MARGIN = 4.0
+# one index shard per document, small documents sharing a shard of at most SHARD_MAX_NODES chunks;
+# shards are spilled under SHARD_STORAGE_DIR and the least recently used are unloaded above SHARD_MEMORY_BUDGET bytes
+SHARDED_RETRIEVAL = False
+SHARD_STORAGE_DIR = "storage/shards"
+SHARD_MEMORY_BUDGET = 512 * 2**20
+SHARD_MAX_NODES = 2000
+GRADIO_CONCURRENCY_LIMIT = 32
+GRADIO_QUEUE_MAX_SIZE = 64
+# the chat UI is updated at most every STREAM_FLUSH_INTERVAL seconds or STREAM_FLUSH_TOKENS tokens
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_TOKENS = 16
+# per-stage timings and Prometheus histograms on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
\ No newline at end of file
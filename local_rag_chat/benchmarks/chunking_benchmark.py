@@ -0,0 +1,177 @@
+import argparse
+import json
+import tempfile
+import time
+import zlib
+from typing import List
+
+import fitz
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.node_parser import SemanticSplitterNodeParser
+from llama_index.core.schema import MetadataMode
+
+from local_rag_chat.benchmarks.corpus import make_corpus
+from local_rag_chat.core.loaders.simple_loader import SimpleLoader
+
+MODES = ("sentence", "semantic", "semantic-batched")
+
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    Bag of hashed words, to run the benchmark without a model. Its cost per text is
+    far below a real model's, so only the number of embedded texts is representative.
+    """
+    dim: int = 384
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode()) % self.dim] += 1.0
+        return vector.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+
+class CountingEmbedding(BaseEmbedding):
+    """
+    Count the texts and characters embedded by a model.
+    """
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _texts: int = PrivateAttr(default=0)
+    _chars: int = PrivateAttr(default=0)
+
+    def __init__(self, embed_model: BaseEmbedding, **kwargs):
+        super().__init__(model_name=embed_model.model_name, embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CountingEmbedding"
+
+    def reset(self):
+        self._texts = 0
+        self._chars = 0
+
+    def stats(self) -> dict:
+        return {"embedded_texts": self._texts, "embedded_chars": self._chars}
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._texts += len(texts)
+        self._chars += sum(len(text) for text in texts)
+        return self._embed_model.get_text_embedding_batch(texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed_model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._embed_model.aget_query_embedding(query)
+
+
+def get_embed_model(args) -> BaseEmbedding:
+    if args.embedding == "hashing":
+        return HashingEmbedding(embed_batch_size=args.batch_size)
+    from local_rag_chat.core.embeddings.embedding_manager import EmbeddingManager
+    return EmbeddingManager(
+        model=args.embedding, backend=args.embedding_backend, batch_size=args.batch_size
+    ).get_embedding()
+
+
+def split_and_embed(mode: str, documents, embed_model: CountingEmbedding) -> int:
+    """
+    Chunk the pages and embed every chunk without an embedding, as ingestion does.
+    :return: number of chunks
+    """
+    if mode == "sentence":
+        nodes = SimpleLoader().split(documents)
+    elif mode == "semantic":
+        # one parser call per page, how SimpleLoader split pages before the semantic chunker
+        parser = SemanticSplitterNodeParser(buffer_size=1, breakpoint_percentile_threshold=95, embed_model=embed_model)
+        nodes = [node for document in documents for node in parser.get_nodes_from_documents([document])]
+    else:
+        nodes = SimpleLoader(embed_model=embed_model).split(documents)
+    missing = [node for node in nodes if node.embedding is None]
+    if missing:
+        embeddings = embed_model.get_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in missing]
+        )
+        for node, embedding in zip(missing, embeddings):
+            node.embedding = embedding
+    return len(nodes)
+
+
+def time_cleaning(files: List[str], repeat: int) -> float:
+    """
+    Microseconds per page of SimpleLoader._filter_text on the raw page texts.
+    """
+    pages = []
+    for file in files:
+        with fitz.open(file) as reader:
+            pages.extend(page.get_text() for page in reader)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in pages:
+            SimpleLoader._filter_text(text)
+    return (time.perf_counter() - start) / (repeat * len(pages)) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files",
+        nargs="*",
+        default=[],
+        help="PDF files to chunk, a synthetic corpus is generated if none are given"
+    )
+    parser.add_argument("--num_docs", type=int, default=2, help="Documents of the synthetic corpus")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic document")
+    parser.add_argument(
+        "--embedding",
+        type=str,
+        default="BAAI/bge-small-en-v1.5",
+        help="Embedding model, 'hashing' runs without a model"
+    )
+    parser.add_argument("--embedding_backend", type=str, default="huggingface", help="huggingface or onnx")
+    parser.add_argument("--batch_size", type=int, default=32, help="Texts per model call")
+    parser.add_argument("--modes", nargs="*", default=list(MODES), choices=MODES, help="Chunking modes to compare")
+    parser.add_argument("--output", type=str, default=None, help="JSON file to write, stdout if not given")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = args.files or make_corpus(tmp_dir, args.num_docs, args.pages)
+        documents = SimpleLoader().load_many(files)
+        embed_model = CountingEmbedding(get_embed_model(args))
+        embed_model.get_text_embedding("warm up")
+
+        results = {"corpus": {"files": len(files), "pages": len(documents)}, "modes": {}}
+        results["clean_us_per_page"] = time_cleaning(files, repeat=5)
+        for mode in args.modes:
+            embed_model.reset()
+            start = time.perf_counter()
+            chunks = split_and_embed(mode, documents, embed_model)
+            elapsed = time.perf_counter() - start
+            results["modes"][mode] = {
+                "seconds": elapsed,
+                "pages_per_second": len(documents) / elapsed,
+                "chunks": chunks,
+                **embed_model.stats(),
+            }
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
@@ -0,0 +1,43 @@
+import os
+import random
+
+from local_rag_chat.benchmarks.loader_benchmark import make_pdf, WORDS
+
+CORPUS_FORMATS = ("pdf", "txt")
+
+
+def make_text(path: str, pages: int, seed: int = 0):
+    """Write a text file with as much random text as a PDF of that many pages."""
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for _ in range(pages * 45):
+            f.write(" ".join(rng.choices(WORDS, k=12)) + rng.choice([".", "", ","]) + "\n")
+
+
+def make_corpus(out_dir: str, num_docs: int, pages: int, fmt: str = "pdf", seed: int = 0) -> list[str]:
+    """
+    Write num_docs synthetic documents of the given number of pages and return their paths.
+    Every document has its own seed, so they are all distinct documents to the loader.
+    """
+    if fmt not in CORPUS_FORMATS:
+        raise ValueError(f"Unsupported corpus format: {fmt}, must be one of {CORPUS_FORMATS}")
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(num_docs):
+        path = os.path.join(out_dir, f"doc_{i:04d}.{fmt}")
+        if fmt == "pdf":
+            make_pdf(path, pages, seed=seed + i)
+        else:
+            make_text(path, pages, seed=seed + i)
+        paths.append(path)
+    return paths
+
+
+def make_queries(n: int, seed: int = 0) -> list[str]:
+    """Specific questions about the synthetic documents, with a summary question every fifth query."""
+    rng = random.Random(seed)
+    return [
+        "Summarize the document." if i % 5 == 4 else
+        f"What does the document say about {' '.join(rng.choices(WORDS, k=3))}?"
+        for i in range(n)
+    ]
@@ -0,0 +1,92 @@
+import argparse
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+from local_rag_chat.benchmarks.loader_benchmark import WORDS
+
+BACKENDS = {
+    "huggingface": {"backend": "huggingface"},
+    "onnx-fp32": {"backend": "onnx", "quantize": False},
+    "onnx-int8": {"backend": "onnx", "quantize": True},
+}
+
+
+def make_chunks(n: int, words: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    # every tenth chunk is a repeat, like headers and footers of a real document
+    chunks = [" ".join(rng.choices(WORDS, k=words)) for _ in range(n - n // 10)]
+    return chunks + rng.choices(chunks, k=n // 10)
+
+
+def run_backend(name: str, model: str, batch_size: int, num_threads, onnx_dir: str, texts: list[str]) -> dict:
+    """
+    Runs in a fresh process, so the startup time includes the imports of the backend.
+    """
+    start = time.perf_counter()
+    from local_rag_chat.core.embeddings.embedding_manager import EmbeddingManager
+    embed_model = EmbeddingManager(
+        model=model,
+        lazy=True,
+        batch_size=batch_size,
+        num_threads=num_threads,
+        onnx_dir=onnx_dir,
+        **BACKENDS[name]
+    ).get_embedding()
+    lazy_startup = time.perf_counter() - start
+    embed_model.get_query_embedding("warm up")
+    first_query = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts[:50]:
+        embed_model.get_query_embedding(text)
+    query_latency = (time.perf_counter() - start) / min(50, len(texts)) * 1000
+    return {
+        "lazy_startup": lazy_startup,
+        "first_query": first_query,
+        "throughput": len(texts) / elapsed,
+        "query_latency": query_latency,
+        "vectors": vectors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default="BAAI/bge-small-en-v1.5", help="Embedding model")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=list(BACKENDS),
+        choices=list(BACKENDS),
+        help="Backends to compare, the first one is the reference of the similarity column"
+    )
+    parser.add_argument("--num_chunks", type=int, default=2000, help="Number of chunks to embed")
+    parser.add_argument("--chunk_words", type=int, default=120, help="Words per chunk")
+    parser.add_argument("--batch_size", type=int, default=32, help="Embedding batch size")
+    parser.add_argument("--num_threads", type=int, default=None, help="Intra-op CPU threads")
+    parser.add_argument("--onnx_dir", type=str, default="storage/onnx", help="Directory of the ONNX exports")
+    args = parser.parse_args()
+
+    texts = make_chunks(args.num_chunks, args.chunk_words)
+    # spawn so every backend starts cold in its own interpreter
+    context = multiprocessing.get_context("spawn")
+    reference = None
+    print(f"{'backend':<12} {'startup':>9} {'1st query':>10} {'chunks/s':>9} {'query ms':>9} {'cosine':>7}")
+    for name in args.backends:
+        with context.Pool(1) as pool:
+            result = pool.apply(
+                run_backend, (name, args.model, args.batch_size, args.num_threads, args.onnx_dir, texts)
+            )
+        if reference is None:
+            reference = result["vectors"]
+        cosine = float(np.mean(np.sum(reference * result["vectors"], axis=1)))
+        print(
+            f"{name:<12} {result['lazy_startup']:>8.2f}s {result['first_query']:>9.2f}s "
+            f"{result['throughput']:>9.1f} {result['query_latency']:>9.2f} {cosine:>7.4f}"
+        )
@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import fitz
+
+from local_rag_chat.core.loaders.parallel_loader import ParallelLoader
+from local_rag_chat.core.loaders.simple_loader import SimpleLoader
+
+WORDS = (
+    "retrieval augmented generation index document chunk embedding vector query answer "
+    "model context summary section page manual system user server process memory"
+).split()
+
+
+def make_pdf(path: str, pages: int, seed: int = 0):
+    """Write a PDF of random text pages."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        lines = []
+        for _ in range(45):
+            lines.append(" ".join(rng.choices(WORDS, k=12)) + rng.choice([".", "", ","]))
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), "\n".join(lines), fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+def time_load(loader, files) -> tuple[float, int]:
+    start = time.perf_counter()
+    documents = loader.load_many(files)
+    return time.perf_counter() - start, sum(len(d.text) for d in documents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files",
+        nargs="*",
+        default=[],
+        help="PDF files to load, a synthetic PDF is generated if none are given"
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=500,
+        help="Number of pages of the synthetic PDF"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Worker processes of the parallel loader"
+    )
+    parser.add_argument(
+        "--pages_per_shard",
+        type=int,
+        default=16,
+        help="Pages extracted per worker task"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of timed runs per loader"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = args.files
+        if not files:
+            files = [os.path.join(tmp_dir, "synthetic.pdf")]
+            make_pdf(files[0], args.pages)
+        total_pages = 0
+        for file in files:
+            with fitz.open(file) as reader:
+                total_pages += reader.page_count
+
+        sequential = SimpleLoader()
+        parallel = ParallelLoader(max_workers=args.workers, pages_per_shard=args.pages_per_shard)
+        # warm up the process pool so pool start-up is not part of the timing
+        parallel.load_many(files)
+
+        results = {}
+        for name, loader in [("sequential", sequential), ("parallel", parallel)]:
+            timings = []
+            for _ in range(args.repeat):
+                elapsed, chars = time_load(loader, files)
+                timings.append(elapsed)
+            best = min(timings)
+            results[name] = best
+            print(f"{name:>10}: {best:.3f}s  {total_pages / best:8.1f} pages/s  ({chars} chars)")
+        parallel.close()
+        print(f"speedup: {results['sequential'] / results['parallel']:.2f}x with {args.workers} workers")
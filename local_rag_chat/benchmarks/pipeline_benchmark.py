@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+from local_rag_chat.benchmarks.corpus import make_corpus, make_queries, CORPUS_FORMATS
+from local_rag_chat.benchmarks.stub_ollama import StubOllamaServer
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def latency_stats(seconds: list[float]) -> dict:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def throughput_stats(seconds: float, items: int, unit: str) -> dict:
+    return {"seconds": seconds, unit: items, f"{unit}_per_second": items / seconds if seconds else 0.0}
+
+
+def run(args, files: list[str]) -> dict:
+    """
+    Time every stage of a RAGPipeline on the files, one stage after the other so
+    their times do not overlap as they do in streaming ingestion.
+    """
+    # imported here so the configs read the OLLAMA_BASE_URL set for the stub server
+    from llama_index.core.schema import MetadataMode, QueryBundle
+    from pipeline import RAGPipeline
+
+    stages = {}
+    start = time.perf_counter()
+    pipeline = RAGPipeline(
+        llm=args.llm,
+        embedding=args.embedding,
+        embedding_backend=args.embedding_backend,
+        chat_mode=args.chat_mode,
+        embedding_cache_dir=None,
+        summary_cache_dir=None
+    )
+    stages["startup"] = {"seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    documents = pipeline.loader.load_many(files)
+    stages["load"] = throughput_stats(time.perf_counter() - start, len(documents), "pages")
+
+    start = time.perf_counter()
+    nodes = pipeline.loader.split(documents)
+    stages["split"] = throughput_stats(time.perf_counter() - start, len(nodes), "chunks")
+
+    start = time.perf_counter()
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    for node, embedding in zip(nodes, pipeline.embed_model.get_text_embedding_batch(texts)):
+        node.embedding = embedding
+    stages["embed"] = throughput_stats(time.perf_counter() - start, len(nodes), "chunks")
+
+    start = time.perf_counter()
+    pipeline._add_to_retrievers(nodes)
+    stages["index"] = throughput_stats(time.perf_counter() - start, len(nodes), "chunks")
+
+    queries = make_queries(args.num_queries)
+    query_embeddings, embed_times = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_embeddings.append(pipeline.embed_model.get_query_embedding(query))
+        embed_times.append(time.perf_counter() - start)
+    stages["embed_query"] = latency_stats(embed_times)
+
+    retrieve_times = []
+    for query, embedding in zip(queries, query_embeddings):
+        start = time.perf_counter()
+        pipeline.hybrid_retriever.retrieve(QueryBundle(query, embedding=embedding))
+        retrieve_times.append(time.perf_counter() - start)
+    stages["retrieve"] = latency_stats(retrieve_times)
+
+    # the documents are indexed already, the session only acquires them
+    session_id = "benchmark"
+    pipeline.process_documents(files, session_id=session_id)
+    router = pipeline._session_engine(session_id).chat_engine_manager.retriever
+    if hasattr(router, "_selector"):
+        route_times = []
+        for query, embedding in zip(queries, query_embeddings):
+            start = time.perf_counter()
+            router._selector.select(router._metadatas, QueryBundle(query, embedding=embedding))
+            route_times.append(time.perf_counter() - start)
+        stages["route"] = latency_stats(route_times)
+
+    first_token_times, answer_times, token_rates = [], [], []
+    for query in queries:
+        # every query starts a new conversation
+        pipeline.session(session_id).memory.reset()
+        start = time.perf_counter()
+        first_token = None
+        tokens = 0
+        for _ in pipeline.stream(query, session_id=session_id).response_gen:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            tokens += 1
+        elapsed = time.perf_counter() - start
+        first_token_times.append(first_token if first_token is not None else elapsed)
+        answer_times.append(elapsed)
+        if first_token is not None and elapsed > first_token:
+            token_rates.append((tokens - 1) / (elapsed - first_token))
+    stages["ttft"] = latency_stats(first_token_times)
+    stages["answer"] = latency_stats(answer_times)
+    stages["answer"]["tokens_per_second"] = float(np.mean(token_rates)) if token_rates else 0.0
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": vars(args),
+        "corpus": {"documents": len(files), "pages": len(documents), "chunks": len(nodes)},
+        "stages": stages,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files",
+        nargs="*",
+        default=[],
+        help="Files to ingest, a synthetic corpus is generated if none are given"
+    )
+    parser.add_argument("--num_docs", type=int, default=5, help="Documents of the synthetic corpus")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic document")
+    parser.add_argument("--format", type=str, default="pdf", choices=CORPUS_FORMATS, help="Synthetic file format")
+    parser.add_argument("--num_queries", type=int, default=20, help="Number of queries")
+    parser.add_argument("--llm", type=str, default="llama3.2:1b", help="LLM served by Ollama")
+    parser.add_argument("--embedding", type=str, default="BAAI/bge-small-en-v1.5", help="Embedding model")
+    parser.add_argument("--embedding_backend", type=str, default="huggingface", help="huggingface or onnx")
+    parser.add_argument("--chat_mode", type=str, default="speculative_condense_plus_context", help="Chat mode")
+    parser.add_argument(
+        "--ollama_url",
+        type=str,
+        default=None,
+        help="Benchmark against this Ollama server instead of the local stub"
+    )
+    parser.add_argument("--ttft", type=float, default=0.2, help="Time to first token of the stub server")
+    parser.add_argument("--tokens_per_second", type=float, default=50.0, help="Streaming speed of the stub server")
+    parser.add_argument("--response_tokens", type=int, default=64, help="Tokens per answer of the stub server")
+    parser.add_argument("--output", type=str, default=None, help="JSON file to write, stdout if not given")
+    args = parser.parse_args()
+
+    stub = None
+    if args.ollama_url is None:
+        stub = StubOllamaServer(
+            ttft=args.ttft, tokens_per_second=args.tokens_per_second, response_tokens=args.response_tokens
+        ).start()
+    os.environ["OLLAMA_BASE_URL"] = args.ollama_url or stub.url
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = args.files or make_corpus(tmp_dir, args.num_docs, args.pages, fmt=args.format)
+            report = run(args, files)
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from local_rag_chat.benchmarks.loader_benchmark import make_pdf, WORDS
+from local_rag_chat.core.serving.concurrency import GenerationLimiter, ServerBusyError, iterate_tokens
+from pipeline import RAGPipeline
+
+
+def make_queries(n: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [f"What does the document say about {' '.join(rng.choices(WORDS, k=3))}?" for _ in range(n)]
+
+
+async def run_session(
+        pipeline: RAGPipeline,
+        limiter: GenerationLimiter,
+        session_id: str,
+        queries: list[str],
+        results: list
+):
+    for query in queries:
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async with limiter.slot():
+                response = await pipeline.astream(query, session_id=session_id)
+                async for _ in iterate_tokens(response):
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+        except ServerBusyError:
+            results.append(("rejected", time.perf_counter() - start, None))
+            continue
+        results.append(("ok", time.perf_counter() - start, first_token))
+
+
+async def load_test(pipeline: RAGPipeline, limiter: GenerationLimiter, sessions: int, queries_per_session: int):
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_session(pipeline, limiter, f"load-{i}", make_queries(queries_per_session, seed=i), results)
+        for i in range(sessions)
+    ])
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed: float):
+    completed = [r for r in results if r[0] == "ok"]
+    rejected = len(results) - len(completed)
+    latencies = np.asarray([r[1] for r in completed])
+    ttfts = np.asarray([r[2] for r in completed if r[2] is not None])
+    print(f"{len(completed)} completed, {rejected} rejected in {elapsed:.1f}s, {len(completed) / elapsed:.2f} req/s")
+    for name, values in [("latency", latencies), ("ttft", ttfts)]:
+        if len(values):
+            print(
+                f"{name:>8}: p50 {np.percentile(values, 50):.2f}s  "
+                f"p99 {np.percentile(values, 99):.2f}s  max {values.max():.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files",
+        nargs="*",
+        default=[],
+        help="PDF files every session uploads, a synthetic PDF is generated if none are given"
+    )
+    parser.add_argument("--llm", type=str, default="llama3.2:1b", help="LLM served by Ollama")
+    parser.add_argument("--embedding", type=str, default="BAAI/bge-small-en-v1.5", help="Embedding model")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16], help="Concurrent sessions to test")
+    parser.add_argument("--queries_per_session", type=int, default=3, help="Questions asked by each session")
+    parser.add_argument("--max_concurrent", type=int, default=2, help="Concurrent LLM generations")
+    parser.add_argument("--max_waiting", type=int, default=16, help="Requests waiting for a generation slot")
+    parser.add_argument("--wait_timeout", type=float, default=60, help="Seconds a request waits for a slot")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = args.files
+        if not files:
+            files = [os.path.join(tmp_dir, "synthetic.pdf")]
+            make_pdf(files[0], 20)
+        pipeline = RAGPipeline(
+            llm=args.llm,
+            embedding=args.embedding,
+            chat_mode="speculative_condense_plus_context",
+            max_sessions=max(args.sessions)
+        )
+        for sessions in args.sessions:
+            for i in range(sessions):
+                pipeline.process_documents(files, session_id=f"load-{i}")
+            limiter = GenerationLimiter(args.max_concurrent, args.max_waiting, args.wait_timeout)
+            # summary builds of the uploads yield to the sessions like in the app
+            pipeline.generation_limiter = pipeline.summary_retriever.limiter = limiter
+            print(f"--- {sessions} concurrent sessions, {args.max_concurrent} concurrent generations")
+            report(*asyncio.run(load_test(pipeline, limiter, sessions, args.queries_per_session)))
+            for i in range(sessions):
+                pipeline.close_session(f"load-{i}")
@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from local_rag_chat.benchmarks.loader_benchmark import WORDS
+from local_rag_chat.core.serving.concurrency import coalesce_tokens
+
+
+def make_history(turns: int, words_per_message: int, seed: int = 0) -> list[dict[str, str]]:
+    rng = random.Random(seed)
+    history = []
+    for _ in range(turns):
+        history.append({'role': 'user', 'content': " ".join(rng.choices(WORDS, k=12)) + "?"})
+        history.append({'role': 'assistant', 'content': " ".join(rng.choices(WORDS, k=words_per_message))})
+    return history
+
+
+async def token_stream(num_tokens: int, tokens_per_second: float, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(num_tokens):
+        if i and tokens_per_second:
+            await asyncio.sleep(1 / tokens_per_second)
+        yield rng.choice(WORDS) + " "
+
+
+def diff(old, new, path=()) -> list:
+    """
+    Edits turning old into new, in the way Gradio sends the updates of a streaming
+    output: appended text is sent as an append, unchanged values are not sent.
+    """
+    if old == new:
+        return []
+    if isinstance(old, str) and isinstance(new, str) and new.startswith(old):
+        return [["append", list(path), new[len(old):]]]
+    if isinstance(old, list) and isinstance(new, list) and len(new) >= len(old):
+        edits = []
+        for i, value in enumerate(new):
+            if i < len(old):
+                edits.extend(diff(old[i], value, path + (i,)))
+            else:
+                edits.append(["add", list(path + (i,)), value])
+        return edits
+    if isinstance(old, dict) and isinstance(new, dict) and old.keys() == new.keys():
+        return [edit for key in new for edit in diff(old[key], new[key], path + (key,))]
+    return [["replace", list(path), new]]
+
+
+async def answer(history: list[dict[str, str]], args, interval: float, max_tokens: int) -> dict:
+    """
+    Stream one answer the way App._get_response does, serializing every update
+    the way the server would before sending it.
+    """
+    message = {'role': 'user', 'content': "What does the document say?"}
+    text = ""
+    previous = ["", history + [message, {'role': 'assistant', 'content': "Thinking..."}], ""]
+    updates = full_bytes = diff_bytes = 0
+    cpu = time.process_time()
+    tokens = token_stream(args.tokens, args.tokens_per_second)
+    async for chunk in coalesce_tokens(tokens, interval, max_tokens):
+        text += chunk
+        output = ["", history + [message, {'role': 'assistant', 'content': text}], ""]
+        updates += 1
+        full_bytes += len(json.dumps(output).encode())
+        diff_bytes += len(json.dumps(diff(previous, output)).encode())
+        previous = output
+    return {
+        "updates": updates,
+        "cpu_ms": (time.process_time() - cpu) * 1000,
+        "full_kb": full_bytes / 1024,
+        "diff_kb": diff_bytes / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=500, help="Tokens per answer")
+    parser.add_argument("--tokens_per_second", type=float, default=200.0, help="Streaming speed of the LLM")
+    parser.add_argument("--turns", type=int, nargs="+", default=[0, 10, 50], help="Earlier turns in the conversation")
+    parser.add_argument("--words_per_message", type=int, default=150, help="Words of every earlier answer")
+    parser.add_argument("--flush_interval", type=float, default=0.05, help="Seconds between coalesced updates")
+    parser.add_argument("--flush_tokens", type=int, default=16, help="Tokens per coalesced update")
+    args = parser.parse_args()
+
+    modes = [("per token", 0.0, 1), ("coalesced", args.flush_interval, args.flush_tokens)]
+    print(f"{'turns':>6} {'mode':>10} {'updates':>8} {'cpu ms':>8} {'full KB':>9} {'diff KB':>8}")
+    for turns in args.turns:
+        history = make_history(turns, args.words_per_message)
+        for name, interval, max_tokens in modes:
+            stats = asyncio.run(answer(history, args, interval, max_tokens))
+            print(
+                f"{turns:>6} {name:>10} {stats['updates']:>8} {stats['cpu_ms']:>8.1f} "
+                f"{stats['full_kb']:>9.1f} {stats['diff_kb']:>8.1f}"
+            )
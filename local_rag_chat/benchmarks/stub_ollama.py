@@ -0,0 +1,185 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from local_rag_chat.benchmarks.loader_benchmark import WORDS
+
+
+class StubOllamaServer:
+    """
+    Local stand-in for the Ollama HTTP API, so the pipeline can be benchmarked
+    without a model. /api/generate and /api/chat answer random words after ttft
+    seconds, streamed at tokens_per_second, or a JSON selection to prompts asking
+    for JSON; /api/tags, /api/show and /api/pull behave like a server that has every model.
+    """
+    def __init__(
+            self,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            ttft: float = 0.2,
+            tokens_per_second: float = 50.0,
+            response_tokens: int = 64,
+            models: Optional[list[str]] = None,
+            seed: int = 0
+    ):
+        """
+        :param port: 0 picks a free port, see url
+        """
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.models = list(models or [])
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _tokens(self) -> list[str]:
+        return [f"{word} " for word in self._rng.choices(WORDS, k=self.response_tokens)]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, chunks):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    data = json.dumps(chunk).encode() + b"\n"
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                stub.requests += 1
+                if self.path == "/api/tags":
+                    self._json({"models": [{"name": m, "model": m} for m in stub.models]})
+                elif self.path == "/api/version":
+                    self._json({"version": "0.0.0-stub"})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                stub.requests += 1
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                model = body.get("model") or body.get("name", "")
+                stream = body.get("stream", True)
+                if self.path == "/api/pull":
+                    name = model if ":" in model else f"{model}:latest"
+                    if name not in stub.models:
+                        stub.models.append(name)
+                    updates = [{"status": "pulling manifest"}, {"status": "success"}]
+                    self._stream(updates) if stream else self._json(updates[-1])
+                elif self.path == "/api/show":
+                    self._json({"modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}})
+                elif self.path in ("/api/generate", "/api/chat"):
+                    self._generate(model, body, stream, chat=self.path == "/api/chat")
+                else:
+                    self.send_error(404)
+
+            def _generate(self, model: str, body: dict, stream: bool, chat: bool):
+                created_at = datetime.now(timezone.utc).isoformat()
+                messages = body.get("messages") or [{"content": body.get("prompt") or ""}]
+                prompt = str(messages[-1].get("content", ""))
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+                if not chat and not prompt:
+                    # a generate request without prompt only loads the model
+                    tokens = []
+                elif "json" in prompt.lower():
+                    # selector prompts ask for the choice as JSON
+                    tokens = [json.dumps([{"choice": 1, "reason": "Stub selection."}])]
+                else:
+                    tokens = stub._tokens()
+
+                def chunk(text: str, done: bool) -> dict:
+                    chunk = {"model": model, "created_at": created_at, "done": done}
+                    if chat:
+                        chunk["message"] = {"role": "assistant", "content": text}
+                    else:
+                        chunk["response"] = text
+                    if done:
+                        chunk.update(done_reason="stop", prompt_eval_count=prompt_tokens, eval_count=len(tokens))
+                    return chunk
+
+                def chunks():
+                    if tokens:
+                        time.sleep(stub.ttft)
+                    for i, token in enumerate(tokens):
+                        if i:
+                            time.sleep(1 / stub.tokens_per_second)
+                        yield chunk(token, False)
+                    yield chunk("", True)
+
+                if stream:
+                    self._stream(chunks())
+                else:
+                    *_, last = chunks()
+                    last[("message" if chat else "response")] = (
+                        {"role": "assistant", "content": "".join(tokens)} if chat else "".join(tokens)
+                    )
+                    self._json(last)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=11434, help="Port to listen on")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens_per_second", type=float, default=50.0, help="Streaming speed")
+    parser.add_argument("--response_tokens", type=int, default=64, help="Tokens per answer")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(
+        args.host, args.port, args.ttft, args.tokens_per_second, args.response_tokens
+    )
+    print(f"Stub Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,120 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from local_rag_chat.core.vector_stores.numpy_vector_store import NumpyVectorStore
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Normalized vectors drawn around random cluster centres, like chunk embeddings of a few topics."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    vectors = centres[rng.integers(clusters, size=n)] + 0.6 * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def build_store(vectors: np.ndarray, batch_size: int = 10_000, **kwargs) -> NumpyVectorStore:
+    store = NumpyVectorStore(**kwargs)
+    for start in range(0, len(vectors), batch_size):
+        store.add([
+            TextNode(id_=str(row), text="", embedding=vectors[row].tolist())
+            for row in range(start, min(start + batch_size, len(vectors)))
+        ])
+    return store
+
+
+def run_queries(store: NumpyVectorStore, queries: np.ndarray, top_k: int, **kwargs):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        result = store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k), **kwargs)
+        latencies.append(time.perf_counter() - start)
+        results.append(result.ids)
+    return results, np.asarray(latencies) * 1000
+
+
+def recall_at_k(results, ground_truth) -> float:
+    return float(np.mean([len(set(r) & set(g)) / len(g) for r, g in zip(results, ground_truth)]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--persist_dir",
+        type=str,
+        default=None,
+        help="Benchmark on the vectors of a persisted HybridRetriever instead of synthetic ones"
+    )
+    parser.add_argument("--num_vectors", type=int, default=200_000, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of the synthetic vectors")
+    parser.add_argument("--clusters", type=int, default=200, help="Number of synthetic topics")
+    parser.add_argument("--num_queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--top_k", type=int, default=10, help="k of recall@k")
+    parser.add_argument("--nlist", type=int, default=None, help="Number of IVF lists")
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8, 16, 32],
+        help="IVF nprobe values to sweep"
+    )
+    parser.add_argument(
+        "--compression",
+        nargs="*",
+        default=["int8", "binary"],
+        help="Compressed vector formats to compare with the float32 index"
+    )
+    parser.add_argument(
+        "--rescore_factor",
+        type=int,
+        default=None,
+        help="Rows rescored per result with compression, the store default if None"
+    )
+    args = parser.parse_args()
+
+    if args.persist_dir:
+        source = NumpyVectorStore.from_persist_dir(args.persist_dir)
+        vectors = np.asarray([source.get(node_id) for node_id in source.node_ids], dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.num_vectors, args.dim, args.clusters)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), size=args.num_queries)]
+    queries = queries + 0.3 * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+
+    flat = build_store(vectors)
+    ivf = build_store(vectors, index_type="ivf", nlist=args.nlist, ivf_min_vectors=0)
+    start = time.perf_counter()
+    ivf.query(VectorStoreQuery(query_embedding=queries[0].tolist(), similarity_top_k=1))
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, IVF training took {time.perf_counter() - start:.2f}s")
+
+    exact, latencies = run_queries(flat, queries, args.top_k)
+    print(f"{'index':>12} {'recall@' + str(args.top_k):>10} {'p50 ms':>8} {'p99 ms':>8} {'bytes/vec':>10}")
+    print(
+        f"{'exact':>12} {1.0:>10.3f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f} "
+        f"{flat.memory_bytes / len(vectors):>10.0f}"
+    )
+    for nprobe in args.nprobe:
+        results, latencies = run_queries(ivf, queries, args.top_k, nprobe=nprobe)
+        print(
+            f"{'ivf/' + str(nprobe):>12} {recall_at_k(results, exact):>10.3f} "
+            f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f} "
+            f"{ivf.memory_bytes / len(vectors):>10.0f}"
+        )
+    with tempfile.TemporaryDirectory() as vectors_dir:
+        for compression in args.compression:
+            # the float32 vectors are memory-mapped from vectors_dir, only the codes count as memory
+            store = build_store(
+                vectors, compression=compression, rescore_factor=args.rescore_factor, vectors_dir=vectors_dir
+            )
+            results, latencies = run_queries(store, queries, args.top_k)
+            print(
+                f"{compression:>12} {recall_at_k(results, exact):>10.3f} "
+                f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f} "
+                f"{store.memory_bytes / len(vectors):>10.0f}"
+            )
+            del store
@@ -0,0 +1,149 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Hashable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray
+    node_ids: frozenset
+    scope: Hashable
+    answer: str
+    created: float
+
+
+class SemanticAnswerCache:
+    """
+    Answers of standalone questions, returned for a later question whose embedding
+    is at least `threshold` cosine-similar, that retrieves the same nodes and that
+    is asked in the same scope, e.g. the same documents in the same versions, so a
+    change to other documents does not invalidate it. Entries expire after ttl
+    seconds and the least recently used ones are evicted beyond max_entries.
+    """
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256, ttl: Optional[float] = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _expire(self):
+        """
+        Drop expired entries. Must hold the lock.
+        """
+        if self.ttl is None:
+            return
+        now = time.monotonic()
+        stale = [key for key, entry in self._entries.items() if now - entry.created > self.ttl]
+        for key in stale:
+            del self._entries[key]
+        self.evictions += len(stale)
+
+    def lookup(self, embedding: Sequence[float], node_ids: Sequence[str], scope: Hashable) -> Optional[str]:
+        query = self._normalize(embedding)
+        node_ids = frozenset(node_ids)
+        with self._lock:
+            self._expire()
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry.node_ids == node_ids and entry.scope == scope
+            ]
+            if candidates:
+                similarities = np.stack([entry.embedding for _, entry in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def put(self, embedding: Sequence[float], node_ids: Sequence[str], scope: Hashable, answer: str):
+        entry = CachedAnswer(
+            embedding=self._normalize(embedding),
+            node_ids=frozenset(node_ids),
+            scope=scope,
+            answer=answer,
+            created=time.monotonic()
+        )
+        with self._lock:
+            self._entries[self._next_key] = entry
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class ReplayedResponse:
+    """
+    A cached answer streamed token by token, in place of a StreamingAgentChatResponse.
+    """
+    def __init__(self, response: str):
+        self.response = response
+        self.source_nodes = []
+
+    @property
+    def response_gen(self) -> Iterator[str]:
+        yield from TOKEN_PATTERN.findall(self.response)
+
+    async def async_response_gen(self) -> AsyncIterator[str]:
+        for token in self.response_gen:
+            yield token
+
+
+class RecordingResponse:
+    """
+    Wraps a streaming chat response and passes the full answer to on_complete once it is fully streamed.
+    """
+    def __init__(self, response, on_complete: Callable[[str], None]):
+        self._response = response
+        self._on_complete = on_complete
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    @property
+    def response_gen(self) -> Iterator[str]:
+        tokens: List[str] = []
+        for token in self._response.response_gen:
+            tokens.append(token)
+            yield token
+        self._on_complete("".join(tokens))
+
+    async def async_response_gen(self) -> AsyncIterator[str]:
+        tokens: List[str] = []
+        async for token in self._response.async_response_gen():
+            tokens.append(token)
+            yield token
+        self._on_complete("".join(tokens))
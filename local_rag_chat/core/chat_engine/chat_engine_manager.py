@@ -1,8 +1,53 @@
-from llama_index.core.chat_engine import SimpleChatEngine, CondensePlusContextChatEngine, CondenseQuestionChatEngine
+from typing import Sequence
+
+from llama_index.core.base.base_selector import BaseSelector, SelectorResult
+from llama_index.core.chat_engine import SimpleChatEngine, CondenseQuestionChatEngine
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.tools import RetrieverTool
 from llama_index.core.selectors import LLMSingleSelector
 from llama_index.core.retrievers import RouterRetriever
+from llama_index.core.schema import QueryBundle
+from llama_index.core.tools import ToolMetadata
+
+from local_rag_chat.core.chat_engine.prefetch_chat_engine import PrefetchCondensePlusContextChatEngine
+from local_rag_chat.core.chat_engine.speculative_chat_engine import SpeculativeCondensePlusContextChatEngine
+from local_rag_chat.core.chat_engine.embedding_selector import (
+    EmbeddingSelector,
+    SUMMARY_PROTOTYPES,
+    SPECIFIC_PROTOTYPES,
+)
+from local_rag_chat.logs.metrics import metrics
+
+ROUTER_MODES = ("llm", "embedding")
+CHAT_ENGINES = {
+    # both accept the nodes of the next message when they were already retrieved
+    "condense_plus_context": PrefetchCondensePlusContextChatEngine,
+    # retrieves on the raw question while the question is condensed
+    "speculative_condense_plus_context": SpeculativeCondensePlusContextChatEngine,
+}
+
+
+class TimedSelector(BaseSelector):
+    """
+    Records the routing decision of the wrapped selector as the "route" stage.
+    """
+    def __init__(self, selector: BaseSelector):
+        self.selector = selector
+
+    def _get_prompts(self):
+        return self.selector.get_prompts()
+
+    def _update_prompts(self, prompts):
+        self.selector.update_prompts(prompts)
+
+    def _select(self, choices: Sequence[ToolMetadata], query: QueryBundle) -> SelectorResult:
+        with metrics.span("route"):
+            return self.selector.select(choices, query)
+
+    async def _aselect(self, choices: Sequence[ToolMetadata], query: QueryBundle) -> SelectorResult:
+        with metrics.span("route"):
+            return await self.selector.aselect(choices, query)
+
 
 class ChatEngineManager:
     def __init__(
@@ -10,12 +55,44 @@ class ChatEngineManager:
             llm,
             retrievers,
             chat_mode='condense_plus_context',
-            memory_limit=3900
+            memory_limit=3900,
+            embed_model=None,
+            router_mode='embedding',
+            memory=None,
+            node_postprocessors=None
     ):
+        """
+        :param router_mode: "embedding" routes queries by similarity to example queries and only asks the LLM
+            when unsure, "llm" asks the LLM selector on every query
+        :param memory: chat memory to continue, a new buffer of memory_limit tokens if None
+        :param node_postprocessors: applied to the retrieved nodes before they are sent to the LLM, e.g. a reranker
+        """
+        if chat_mode not in CHAT_ENGINES:
+            raise ValueError(f"Unsupported chat mode: {chat_mode}")
+        if router_mode not in ROUTER_MODES:
+            raise ValueError(f"Unsupported router mode: {router_mode}")
+        if router_mode == "embedding" and embed_model is None:
+            raise ValueError("The embedding router mode requires an embed model.")
         self.retrievers = retrievers
         self.llm = llm
         self.chat_mode = chat_mode
-        self.memory = ChatMemoryBuffer(token_limit=memory_limit)
+        self.embed_model = embed_model
+        self.router_mode = router_mode
+        self.memory = memory or ChatMemoryBuffer(token_limit=memory_limit)
+        self.node_postprocessors = node_postprocessors or []
+        self.selector = None
+        self.retriever = None
+
+    def get_selector(self):
+        llm_selector = LLMSingleSelector.from_defaults(llm=self.llm)
+        if self.router_mode == "llm":
+            return llm_selector
+        # same order as the retriever tools
+        return EmbeddingSelector(
+            self.embed_model,
+            prototypes=[SUMMARY_PROTOTYPES, SPECIFIC_PROTOTYPES],
+            fallback=llm_selector
+        )
 
     def get_router_retriever(self):
         hybrid_retriever, list_retriever = self.retrievers
@@ -32,8 +109,9 @@ class ChatEngineManager:
                 "Useful when needing to retrieve specific contexts to answer questions"
             ),
         )
+        self.selector = self.get_selector()
         return RouterRetriever(
-            selector=LLMSingleSelector.from_defaults(llm=self.llm),
+            selector=TimedSelector(self.selector),
             retriever_tools=[
                 list_tool,
                 hybrid_tool,
@@ -43,12 +121,13 @@ class ChatEngineManager:
     def get_engine(self):
         # use router retriever if there are multiple retrievers
         if len(self.retrievers) > 1:
-            retriever = self.get_router_retriever()
+            self.retriever = self.get_router_retriever()
         else:
-            retriever = self.retrievers[0]
+            self.retriever = self.retrievers[0]
 
-        return CondensePlusContextChatEngine.from_defaults(
-            retriever,
+        return CHAT_ENGINES[self.chat_mode].from_defaults(
+            self.retriever,
             llm=self.llm,
-            memory=self.memory
+            memory=self.memory,
+            node_postprocessors=self.node_postprocessors
         )
\ No newline at end of file
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, List
+
+import numpy as np
+from llama_index.core.base.base_selector import BaseSelector, SelectorResult, SingleSelection
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import QueryBundle
+from llama_index.core.tools import ToolMetadata
+
+from local_rag_chat.logs.logging_config import logger
+
+SUMMARY_PROTOTYPES = [
+    "Summarize the document.",
+    "Give me a summary of this file.",
+    "What is this document about?",
+    "What are the main points of the paper?",
+    "Give an overview of the whole text.",
+    "What are the key takeaways?",
+    "Write a short abstract of the document.",
+    "TL;DR",
+]
+SPECIFIC_PROTOTYPES = [
+    "What is the value reported in the results table?",
+    "Which method does the author use for the experiment?",
+    "When was the contract signed and by whom?",
+    "What does the second section say about the configuration?",
+    "How is the parameter defined in the paper?",
+    "What is the name of the dataset used for evaluation?",
+    "Explain the error message mentioned on page 3.",
+    "What is the price listed for the product?",
+]
+
+
+class EmbeddingSelector(BaseSelector):
+    """
+    Route a query by comparing its embedding to example queries of each choice,
+    falling back to another selector (usually an LLM selector) when the best
+    choice does not beat the runner-up by at least min_margin.
+
+    The query embedding is stored on the query bundle so the selected retriever
+    does not embed the query again. Recent decisions are kept in an LRU cache.
+    """
+    def __init__(
+            self,
+            embed_model: BaseEmbedding,
+            prototypes: Sequence[Sequence[str]],
+            fallback: Optional[BaseSelector] = None,
+            min_margin: float = 0.03,
+            cache_size: int = 512
+    ):
+        """
+        :param prototypes: example queries of each choice, in the order of the choices
+        :param fallback: selector used on low-confidence queries, the best choice is taken if None
+        :param min_margin: minimum cosine similarity gap between the best and second best choice
+        """
+        self.embed_model = embed_model
+        self.prototypes = [list(examples) for examples in prototypes]
+        self.fallback = fallback
+        self.min_margin = min_margin
+        self.cache_size = cache_size
+        self._prototype_matrix: Optional[np.ndarray] = None
+        self._prototype_choice: Optional[np.ndarray] = None
+        self._cache: OrderedDict[tuple, SelectorResult] = OrderedDict()
+        self._lock = threading.Lock()
+        self.decisions = 0
+        self.cache_hits = 0
+        self.fallbacks = 0
+
+    def _get_prompts(self):
+        return {}
+
+    def _update_prompts(self, prompts):
+        pass
+
+    def _prototype_embeddings(self):
+        # embedded on first use so building the chat engine stays cheap. The examples are
+        # queries, embedded like the routed queries, e.g. with the BGE query instruction
+        if self._prototype_matrix is None:
+            texts = [text for examples in self.prototypes for text in examples]
+            matrix = np.asarray([self.embed_model.get_query_embedding(text) for text in texts], dtype=np.float32)
+            self._prototype_matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._prototype_choice = np.repeat(np.arange(len(self.prototypes)), [len(e) for e in self.prototypes])
+        return self._prototype_matrix, self._prototype_choice
+
+    def _choice_scores(self, embedding: List[float]) -> np.ndarray:
+        matrix, choice = self._prototype_embeddings()
+        query = np.asarray(embedding, dtype=np.float32)
+        similarities = matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        scores = np.full(len(self.prototypes), -np.inf)
+        np.maximum.at(scores, choice, similarities)
+        return scores
+
+    @staticmethod
+    def _cache_key(choices: Sequence[ToolMetadata], query: QueryBundle) -> tuple:
+        return " ".join(query.query_str.lower().split()), tuple(choice.description for choice in choices)
+
+    def _cached(self, key: tuple) -> Optional[SelectorResult]:
+        with self._lock:
+            self.decisions += 1
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            return result
+
+    def _remember(self, key: tuple, result: SelectorResult):
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _classify(self, choices: Sequence[ToolMetadata], query: QueryBundle) -> Optional[SelectorResult]:
+        """
+        The selection by embedding, None if it is not confident enough.
+        """
+        if len(choices) != len(self.prototypes):
+            raise ValueError(f"Got {len(choices)} choices but prototypes for {len(self.prototypes)}.")
+        scores = self._choice_scores(query.embedding)
+        ranked = np.argsort(-scores)
+        margin = scores[ranked[0]] - scores[ranked[1]] if len(ranked) > 1 else np.inf
+        logger.debug(f"Router scores {scores.round(3).tolist()} for query: {query.query_str}")
+        if margin < self.min_margin and self.fallback is not None:
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        reason = f"Closest to the examples of choice {ranked[0] + 1} (margin {margin:.3f})"
+        return SelectorResult(selections=[SingleSelection(index=int(ranked[0]), reason=reason)])
+
+    def _select(self, choices: Sequence[ToolMetadata], query: QueryBundle) -> SelectorResult:
+        key = self._cache_key(choices, query)
+        result = self._cached(key)
+        if result is not None:
+            return result
+        if query.embedding is None:
+            query.embedding = self.embed_model.get_query_embedding(query.query_str)
+        result = self._classify(choices, query) or self.fallback.select(choices, query)
+        self._remember(key, result)
+        return result
+
+    async def _aselect(self, choices: Sequence[ToolMetadata], query: QueryBundle) -> SelectorResult:
+        key = self._cache_key(choices, query)
+        result = self._cached(key)
+        if result is not None:
+            return result
+        # embedding runs on a worker thread, local models are synchronous even through the async API
+        if query.embedding is None:
+            query.embedding = await asyncio.to_thread(self.embed_model.get_query_embedding, query.query_str)
+        await asyncio.to_thread(self._prototype_embeddings)
+        result = self._classify(choices, query) or await self.fallback.aselect(choices, query)
+        self._remember(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            routed = self.decisions - self.cache_hits
+            return {
+                "decisions": self.decisions,
+                "cache_hits": self.cache_hits,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": self.fallbacks / routed if routed else 0.0,
+            }
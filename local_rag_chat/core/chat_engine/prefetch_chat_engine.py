@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from typing import List, Optional, Any
+
+from llama_index.core.chat_engine import CondensePlusContextChatEngine
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+
+class PrefetchCondensePlusContextChatEngine(CondensePlusContextChatEngine):
+    """
+    CondensePlusContextChatEngine that can be handed the nodes of its next message when
+    the caller already retrieved them, e.g. to look up the answer cache, so the question
+    is not embedded and retrieved a second time. Async chats run the postprocessors,
+    e.g. a cross-encoder, on a worker thread instead of the event loop.
+    """
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._prefetched: Optional[tuple[QueryBundle, List[NodeWithScore]]] = None
+        self._prefetch_lock = threading.Lock()
+
+    def prefetch(self, query_bundle: QueryBundle, nodes: List[NodeWithScore]):
+        """
+        Use nodes as the retrieval results of the next message if it is query_bundle's question.
+        """
+        with self._prefetch_lock:
+            self._prefetched = (query_bundle, nodes)
+
+    def _take_prefetched(self, message: str) -> Optional[tuple[QueryBundle, List[NodeWithScore]]]:
+        with self._prefetch_lock:
+            prefetched, self._prefetched = self._prefetched, None
+        if prefetched is None or prefetched[0].query_str != message:
+            return None
+        return prefetched
+
+    def _postprocess(self, nodes: List[NodeWithScore], query_bundle: QueryBundle) -> List[NodeWithScore]:
+        for postprocessor in self._node_postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+        return nodes
+
+    async def _apostprocess(self, nodes: List[NodeWithScore], query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # postprocessors are synchronous, a cross-encoder would block the event loop
+        if not self._node_postprocessors:
+            return nodes
+        return await asyncio.to_thread(self._postprocess, nodes, query_bundle)
+
+    def _get_nodes(self, message: str) -> List[NodeWithScore]:
+        prefetched = self._take_prefetched(message)
+        if prefetched is None:
+            return super()._get_nodes(message)
+        query_bundle, nodes = prefetched
+        return self._postprocess(nodes, query_bundle)
+
+    async def _aget_nodes(self, message: str) -> List[NodeWithScore]:
+        prefetched = self._take_prefetched(message)
+        if prefetched is None:
+            return await self._apostprocess(await self._retriever.aretrieve(message), QueryBundle(message))
+        query_bundle, nodes = prefetched
+        return await self._apostprocess(nodes, query_bundle)
@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Optional, Any
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from local_rag_chat.core.chat_engine.prefetch_chat_engine import PrefetchCondensePlusContextChatEngine
+from local_rag_chat.core.retrievers.fusion import fuse_results
+from local_rag_chat.logs.logging_config import logger
+from local_rag_chat.logs.metrics import metrics
+
+# shared by the engines of every session, an engine has at most one speculation in flight
+_executor = ThreadPoolExecutor(thread_name_prefix="speculative-retrieval")
+
+
+class SpeculativeCondensePlusContextChatEngine(PrefetchCondensePlusContextChatEngine):
+    """
+    Chat engine that does not wait for the condense call to start retrieving.
+
+    Without earlier user turns the question is used as is. Otherwise retrieval on
+    the raw question runs while the LLM rewrites it; if the rewrite is the same
+    question those results are used directly, else they are fused with the
+    results for the rewritten question, which get the larger weight.
+    """
+    def __init__(self, *args: Any, speculative_weight: float = 0.3, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._speculative_weight = speculative_weight
+        self._speculation: Optional[tuple[str, Future]] = None
+        self._aspeculation: Optional[tuple[str, asyncio.Task]] = None
+
+    @staticmethod
+    def _has_history(chat_history: List[ChatMessage]) -> bool:
+        return any(message.role == MessageRole.USER for message in chat_history)
+
+    @staticmethod
+    def _same_question(a: str, b: str) -> bool:
+        return " ".join(a.lower().split()) == " ".join(b.lower().split())
+
+    def _condense_question(self, chat_history: List[ChatMessage], latest_message: str) -> str:
+        self._speculation = None
+        if self._skip_condense or not self._has_history(chat_history):
+            return latest_message
+        self._speculation = (
+            latest_message,
+            _executor.submit(metrics.wrap("speculative_retrieval", self._retriever.retrieve), latest_message)
+        )
+        with metrics.span("condense"):
+            return super()._condense_question(chat_history, latest_message)
+
+    async def _acondense_question(self, chat_history: List[ChatMessage], latest_message: str) -> str:
+        self._aspeculation = None
+        if self._skip_condense or not self._has_history(chat_history):
+            return latest_message
+        task = asyncio.create_task(self._retriever.aretrieve(latest_message))
+        self._aspeculation = (latest_message, task)
+        try:
+            with metrics.span("condense"):
+                return await super()._acondense_question(chat_history, latest_message)
+        except BaseException:
+            self._aspeculation = None
+            task.cancel()
+            raise
+
+    def _merge(self, message: str, raw: List[NodeWithScore], condensed: List[NodeWithScore]) -> List[NodeWithScore]:
+        top_k = max(len(raw), len(condensed))
+        logger.debug(f"Merging {len(raw)} speculative nodes into {len(condensed)} nodes for: {message}")
+        return fuse_results(
+            [condensed, raw],
+            top_k=top_k,
+            weights=[1 - self._speculative_weight, self._speculative_weight]
+        )
+
+    def _get_nodes(self, message: str) -> List[NodeWithScore]:
+        speculation, self._speculation = self._speculation, None
+        if speculation is None:
+            return super()._get_nodes(message)
+        raw_message, future = speculation
+        if self._same_question(raw_message, message):
+            return self._postprocess(future.result(), QueryBundle(message))
+        nodes = self._retriever.retrieve(message)
+        return self._postprocess(self._merge(message, future.result(), nodes), QueryBundle(message))
+
+    async def _aget_nodes(self, message: str) -> List[NodeWithScore]:
+        speculation, self._aspeculation = self._aspeculation, None
+        if speculation is None:
+            return await super()._aget_nodes(message)
+        raw_message, task = speculation
+        if self._same_question(raw_message, message):
+            return await self._apostprocess(await task, QueryBundle(message))
+        nodes = await self._retriever.aretrieve(message)
+        return await self._apostprocess(self._merge(message, await task, nodes), QueryBundle(message))
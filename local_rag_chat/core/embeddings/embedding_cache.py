@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from local_rag_chat.logs.logging_config import logger
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk cache of text embeddings for a single embedding model.
+
+    Vectors are appended to a flat float32 file and their keys to an index file,
+    so adding entries never rewrites existing data. Once more than max_entries
+    keys are live, the least recently used ones are evicted; the files are
+    compacted when evicted rows outnumber the live ones.
+    """
+    VECTORS_FILE = "vectors.f32"
+    INDEX_FILE = "index.tsv"
+    META_FILE = "meta.json"
+
+    def __init__(self, cache_dir: str, model_name: str, max_entries: int = 100_000):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dim: Optional[int] = None
+
+        self._rows: OrderedDict[str, int] = OrderedDict()
+        self._num_rows = 0
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.cache_dir / self.VECTORS_FILE
+
+    @property
+    def _index_path(self) -> Path:
+        return self.cache_dir / self.INDEX_FILE
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.cache_dir / self.META_FILE
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not self._meta_path.exists():
+            return
+        meta = json.loads(self._meta_path.read_text())
+        if meta.get("model_name") != self.model_name:
+            logger.warning(f"Embedding cache at {self.cache_dir} belongs to another model, ignoring it.")
+            return
+        self.dim = meta["dim"]
+        if self._vectors_path.exists():
+            # drop a partially written trailing row, rows appended after it would be misaligned
+            size = self._vectors_path.stat().st_size
+            self._num_rows = size // (self.dim * 4)
+            if size != self._num_rows * self.dim * 4:
+                os.truncate(self._vectors_path, self._num_rows * self.dim * 4)
+        if self._index_path.exists():
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    key, _, row = line.rstrip("\n").partition("\t")
+                    if row.isdigit() and int(row) < self._num_rows:
+                        self._rows[key] = int(row)
+                        self._rows.move_to_end(key)
+        self._evict()
+        logger.info(f"Loaded embedding cache with {len(self._rows)} entries from {self.cache_dir}")
+
+    def _matrix(self) -> np.memmap:
+        # remap lazily, rows appended since the last mapping are not visible yet
+        if self._vectors is None or self._vectors.shape[0] < self._num_rows:
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(self._num_rows, self.dim)
+            )
+        return self._vectors
+
+    def get_many(self, texts: List[str]) -> List[Optional[Embedding]]:
+        """
+        Look up the embeddings of texts, None for the ones not in the cache.
+        """
+        with self._lock:
+            rows = []
+            for text in texts:
+                key = self.key(text)
+                row = self._rows.get(key)
+                if row is not None:
+                    self._rows.move_to_end(key)
+                rows.append(row)
+            found = [row for row in rows if row is not None]
+            self.hits += len(found)
+            self.misses += len(rows) - len(found)
+            if not found:
+                return [None] * len(texts)
+            vectors = self._matrix()
+            return [None if row is None else vectors[row].tolist() for row in rows]
+
+    def put_many(self, texts: List[str], embeddings: List[Embedding]):
+        with self._lock:
+            new_keys = []
+            new_vectors = []
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                if key in self._rows:
+                    continue
+                new_keys.append(key)
+                new_vectors.append(embedding)
+            if not new_keys:
+                return
+            matrix = np.asarray(new_vectors, dtype=np.float32)
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self._meta_path.write_text(json.dumps({"model_name": self.model_name, "dim": self.dim}))
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embedding dimension {matrix.shape[1]} does not match cache dimension {self.dim}."
+                )
+
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.writelines(f"{key}\t{self._num_rows + i}\n" for i, key in enumerate(new_keys))
+            for i, key in enumerate(new_keys):
+                self._rows[key] = self._num_rows + i
+            self._num_rows += len(new_keys)
+            self._evict()
+
+    def _evict(self):
+        while len(self._rows) > self.max_entries:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+        if self._num_rows - len(self._rows) > max(len(self._rows), 1024):
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the cache files with only the live rows, in least recently used order.
+        """
+        vectors = self._matrix()
+        keys = list(self._rows.keys())
+        live = np.asarray(vectors[[self._rows[key] for key in keys]], dtype=np.float32)
+        self._vectors = None
+
+        tmp_vectors = self._vectors_path.with_suffix(".tmp")
+        tmp_index = self._index_path.with_suffix(".tmp")
+        live.tofile(tmp_vectors)
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            f.writelines(f"{key}\t{row}\n" for row, key in enumerate(keys))
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_index, self._index_path)
+
+        self._rows = OrderedDict((key, row) for row, key in enumerate(keys))
+        self._num_rows = len(keys)
+        logger.info(f"Compacted embedding cache to {self._num_rows} entries")
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            for path in (self._vectors_path, self._index_path, self._meta_path):
+                path.unlink(missing_ok=True)
+            self._rows.clear()
+            self._num_rows = 0
+            self.dim = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model wrapper that serves text embeddings from an EmbeddingCache
+    and only calls the underlying model for texts it has not seen before.
+    Query embeddings are passed through uncached.
+    """
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed_model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._embed_model.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        embeddings = self._cache.get_many(texts)
+        missing = self._missing(texts, embeddings)
+        if missing:
+            computed = self._embed_model.get_text_embedding_batch(missing)
+            embeddings = self._fill(texts, embeddings, missing, computed)
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        embeddings = self._cache.get_many(texts)
+        missing = self._missing(texts, embeddings)
+        if missing:
+            computed = await self._embed_model.aget_text_embedding_batch(missing)
+            embeddings = self._fill(texts, embeddings, missing, computed)
+        return embeddings
+
+    @staticmethod
+    def _missing(texts: List[str], embeddings: List[Optional[Embedding]]) -> List[str]:
+        # deduplicate so repeated chunks are only embedded once
+        return list(dict.fromkeys(t for t, e in zip(texts, embeddings) if e is None))
+
+    def _fill(self, texts, embeddings, missing, computed) -> List[Embedding]:
+        self._cache.put_many(missing, computed)
+        lookup = dict(zip(missing, computed))
+        return [lookup[t] if e is None else e for t, e in zip(texts, embeddings)]
@@ -1,10 +1,76 @@
+from typing import Optional
+
+EMBEDDING_BACKENDS = ("huggingface", "onnx")
+
+
 class EmbeddingManager:
-    def __init__(self, model: str = "BAAI/bge-small-en-v1.5"):
+    def __init__(
+            self,
+            model: str = "BAAI/bge-small-en-v1.5",
+            cache_dir: Optional[str] = None,
+            cache_max_entries: int = 100_000,
+            backend: str = "huggingface",
+            lazy: bool = False,
+            batch_size: int = 32,
+            num_threads: Optional[int] = None,
+            onnx_dir: str = "storage/onnx",
+            quantize: bool = True
+    ):
+        """
+        :param backend: 'huggingface' runs the model with torch, 'onnx' with onnxruntime
+        :param lazy: load the model on its first use instead of in get_embedding
+        :param num_threads: intra-op CPU threads, the backend default if None
+        :param quantize: use int8 weights with the onnx backend
+        """
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Invalid embedding backend {backend}, must be one of {EMBEDDING_BACKENDS}")
         self.model = model
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.backend = backend
+        self.lazy = lazy
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.onnx_dir = onnx_dir
+        self.quantize = quantize
 
-    def get_embedding(self):
+    @property
+    def variant(self) -> str:
+        """
+        Name of the model as it is run, embeddings of different variants are cached apart.
+        """
+        if self.backend == "onnx" and self.model != "text-embedding-ada-002":
+            return f"{self.model}-onnx-{'int8' if self.quantize else 'fp32'}"
+        return self.model
+
+    def load_embedding(self):
         if self.model == "text-embedding-ada-002":
             from llama_index.embeddings.openai import OpenAIEmbedding
             return OpenAIEmbedding()
+        if self.backend == "onnx":
+            from local_rag_chat.core.embeddings.onnx_embedding import OnnxEmbedding
+            return OnnxEmbedding(
+                model_name=self.model,
+                onnx_dir=self.onnx_dir,
+                quantize=self.quantize,
+                embed_batch_size=self.batch_size,
+                num_threads=self.num_threads
+            )
         from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-        return HuggingFaceEmbedding(model_name=self.model)
\ No newline at end of file
+        if self.num_threads:
+            import torch
+            torch.set_num_threads(self.num_threads)
+        return HuggingFaceEmbedding(model_name=self.model, embed_batch_size=self.batch_size)
+
+    def get_embedding(self):
+        if self.lazy:
+            from local_rag_chat.core.embeddings.lazy_embedding import LazyEmbedding
+            embed_model = LazyEmbedding(self.load_embedding, model_name=self.model, embed_batch_size=self.batch_size)
+        else:
+            embed_model = self.load_embedding()
+
+        if self.cache_dir is None:
+            return embed_model
+        from local_rag_chat.core.embeddings.embedding_cache import CachedEmbedding, EmbeddingCache
+        cache = EmbeddingCache(self.cache_dir, model_name=self.variant, max_entries=self.cache_max_entries)
+        return CachedEmbedding(embed_model, cache)
@@ -0,0 +1,57 @@
+import threading
+from typing import Callable, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from local_rag_chat.logs.logging_config import logger
+
+
+class LazyEmbedding(BaseEmbedding):
+    """
+    Embedding model wrapper that only loads the underlying model on its first use,
+    so the app can start serving before the model weights are read.
+    """
+    _factory: Callable[[], BaseEmbedding] = PrivateAttr()
+    _embed_model: Optional[BaseEmbedding] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, factory: Callable[[], BaseEmbedding], model_name: str, embed_batch_size: int = 32, **kwargs):
+        super().__init__(model_name=model_name, embed_batch_size=embed_batch_size, **kwargs)
+        self._factory = factory
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LazyEmbedding"
+
+    @property
+    def loaded(self) -> bool:
+        return self._embed_model is not None
+
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        if self._embed_model is None:
+            with self._lock:
+                if self._embed_model is None:
+                    logger.info(f"Loading embedding model {self.model_name}")
+                    self._embed_model = self._factory()
+        return self._embed_model
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self.embed_model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self.embed_model.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self.embed_model.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await self.embed_model.aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self.embed_model.get_text_embedding_batch(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self.embed_model.aget_text_embedding_batch(texts)
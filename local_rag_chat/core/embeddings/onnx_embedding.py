@@ -0,0 +1,159 @@
+import asyncio
+import platform
+import re
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from local_rag_chat.logs.logging_config import logger
+
+BGE_QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+ONNX_FILE = "model.onnx"
+QUANTIZED_ONNX_FILE = "model_quantized.onnx"
+MISSING_ONNX_EXTRA = (
+    "The onnx embedding backend needs optimum[onnxruntime], install the onnx extra with "
+    "`poetry install --extras onnx` or `pip install \"optimum[onnxruntime]\"`"
+)
+
+
+def default_query_instruction(model_name: str) -> Optional[str]:
+    # same instruction as HuggingFaceEmbedding uses for the english bge models
+    name = model_name.lower()
+    return BGE_QUERY_INSTRUCTION if "bge-" in name and "-en" in name else None
+
+
+def export_onnx(model_name: str, onnx_dir: str, quantize: bool = True) -> Path:
+    """
+    Export a HuggingFace sentence transformer to ONNX, and dynamically quantize its
+    weights to int8 if quantize. The export is done once and reused afterwards.
+    :return: Path: the directory holding the model and its tokenizer
+    """
+    model_dir = Path(onnx_dir) / re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+    fp32_dir = model_dir / "fp32"
+    int8_dir = model_dir / "int8"
+    target_dir, target_file = (int8_dir, QUANTIZED_ONNX_FILE) if quantize else (fp32_dir, ONNX_FILE)
+    if (target_dir / target_file).exists():
+        return target_dir
+
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    except ImportError as e:
+        raise ImportError(MISSING_ONNX_EXTRA) from e
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if not (fp32_dir / ONNX_FILE).exists():
+        logger.info(f"Exporting {model_name} to ONNX in {fp32_dir}")
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(fp32_dir)
+        tokenizer.save_pretrained(fp32_dir)
+    if quantize:
+        logger.info(f"Quantizing {model_name} to int8 in {int8_dir}")
+        if platform.machine().lower() in ("arm64", "aarch64"):
+            config = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+        else:
+            config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        ORTQuantizer.from_pretrained(fp32_dir).quantize(save_dir=int8_dir, quantization_config=config)
+        tokenizer.save_pretrained(int8_dir)
+    return target_dir
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    CPU embedding model running an ONNX export of a sentence transformer with
+    onnxruntime, int8 quantized by default. Texts are embedded in length-sorted
+    batches, and identical texts of a batch are embedded once.
+    """
+    query_instruction: Optional[str] = Field(default=None, description="Prefix of query texts.")
+    pooling: str = Field(default="cls", description="'cls' or 'mean' pooling of the token states.")
+    max_length: int = Field(default=512, description="Maximum number of tokens per text.")
+
+    _session = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names: set = PrivateAttr()
+
+    def __init__(
+            self,
+            model_name: str = "BAAI/bge-small-en-v1.5",
+            onnx_dir: str = "storage/onnx",
+            quantize: bool = True,
+            embed_batch_size: int = 32,
+            num_threads: Optional[int] = None,
+            query_instruction: Optional[str] = None,
+            pooling: str = "cls",
+            max_length: int = 512,
+            **kwargs
+    ):
+        """
+        :param num_threads: intra-op threads of onnxruntime, all physical cores if None
+        """
+        super().__init__(
+            model_name=model_name,
+            embed_batch_size=embed_batch_size,
+            query_instruction=query_instruction or default_query_instruction(model_name),
+            pooling=pooling,
+            max_length=max_length,
+            **kwargs
+        )
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError(MISSING_ONNX_EXTRA) from e
+        from transformers import AutoTokenizer
+
+        model_dir = export_onnx(model_name, onnx_dir, quantize)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or 0
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            str(model_dir / (QUANTIZED_ONNX_FILE if quantize else ONNX_FILE)),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        unique = sorted(set(texts), key=len)
+        vectors = {}
+        for start in range(0, len(unique), self.embed_batch_size):
+            batch = unique[start:start + self.embed_batch_size]
+            encoded = self._tokenizer(
+                batch, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+            inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+            hidden = self._session.run(None, inputs)[0]
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded["attention_mask"][..., None].astype(hidden.dtype)
+                pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            vectors.update(zip(batch, pooled.tolist()))
+        return [vectors[text] for text in texts]
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([f"{self.query_instruction or ''}{query}"])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return await asyncio.to_thread(self._get_text_embedding, text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await asyncio.to_thread(self._embed, texts)
@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, Iterator, List
+
+from llama_index.core import Document
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from local_rag_chat.core.loaders.simple_loader import SimpleLoader
+from local_rag_chat.logs.logging_config import logger
+from local_rag_chat.logs.metrics import metrics
+
+_DONE = object()
+
+
+@dataclass
+class IngestionProgress:
+    stage: str = "extract"
+    pages: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    indexed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def embeddings_per_second(self) -> float:
+        return self.embedded / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.stage.capitalize()}: {self.pages} pages ({self.pages_per_second:.1f}/s), "
+            f"{self.chunks} chunks, {self.embedded} embedded ({self.embeddings_per_second:.1f}/s), "
+            f"{self.indexed} indexed"
+        )
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q: queue.Queue, stop: threading.Event) -> Iterator:
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+class StreamingIngestion:
+    """
+    Ingest files through extract/clean -> split -> embed -> index stages running
+    on their own threads and connected by bounded queues, so a slow stage applies
+    backpressure instead of buffering the whole document. Nodes are handed to
+    on_nodes batch by batch and are queryable before the whole file is indexed.
+    """
+    def __init__(
+            self,
+            loader: SimpleLoader,
+            embed_model: BaseEmbedding,
+            on_nodes: Callable[[List[BaseNode]], None],
+            embed_batch_size: int = 32,
+            split_batch_size: int = 8,
+            queue_size: int = 8,
+            progress_interval: float = 0.5
+    ):
+        """
+        :param split_batch_size: pages split together, the semantic chunker embeds their sentences in one batch
+        """
+        self.loader = loader
+        self.embed_model = embed_model
+        self.on_nodes = on_nodes
+        self.embed_batch_size = embed_batch_size
+        self.split_batch_size = split_batch_size
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+
+    def _extract(self, files: List[str], doc_ids: List[str]) -> Iterator[Document]:
+        file_doc_ids = dict(zip(files, doc_ids))
+        sections = {}
+        for file, page_num, text in self.loader.iter_file_pages(files):
+            self._progress.pages += 1
+            if not text.strip():
+                continue
+            if file not in sections:
+                sections[file] = self.loader.page_sections(file)
+            yield self.loader.page_document(file, file_doc_ids[file], page_num, text, sections[file][page_num])
+
+    def _split(self, documents: Iterator[Document]) -> Iterator[List[BaseNode]]:
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.split_batch_size:
+                yield from self._split_batch(batch)
+                batch = []
+        if batch:
+            yield from self._split_batch(batch)
+
+    def _split_batch(self, documents: List[Document]) -> Iterator[List[BaseNode]]:
+        nodes = self.loader.split(documents)
+        self._progress.chunks += len(nodes)
+        if nodes:
+            yield nodes
+
+    def _embed(self, node_lists: Iterator[List[BaseNode]]) -> Iterator[List[BaseNode]]:
+        batch = []
+        for nodes in node_lists:
+            batch.extend(nodes)
+            while len(batch) >= self.embed_batch_size:
+                yield self._embed_batch(batch[:self.embed_batch_size])
+                batch = batch[self.embed_batch_size:]
+        if batch:
+            yield self._embed_batch(batch)
+
+    def _embed_batch(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        # semantic chunks already have the embedding derived from their sentences
+        missing = [node for node in nodes if node.embedding is None]
+        if missing:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in missing]
+            embeddings = self.embed_model.get_text_embedding_batch(texts)
+            for node, embedding in zip(missing, embeddings):
+                node.embedding = embedding
+        self._progress.embedded += len(nodes)
+        return nodes
+
+    def _run_stage(self, stage, out_q: queue.Queue, errors: queue.Queue, stop: threading.Event):
+        try:
+            for item in stage:
+                if not _put(out_q, item, stop):
+                    return
+        except Exception as e:
+            errors.put(e)
+            stop.set()
+        finally:
+            stage.close()
+            _put(out_q, _DONE, stop)
+
+    def run(self, files: List[str], doc_ids: List[str]) -> Iterator[IngestionProgress]:
+        """
+        Ingest files, yielding a progress snapshot every progress_interval seconds.
+        """
+        self._progress = IngestionProgress()
+        start = time.perf_counter()
+        stop = threading.Event()
+        errors = queue.Queue()
+        pages_q = queue.Queue(maxsize=self.queue_size)
+        nodes_q = queue.Queue(maxsize=self.queue_size)
+        embedded_q = queue.Queue(maxsize=self.queue_size)
+
+        stages = [
+            (self._extract(files, doc_ids), pages_q),
+            (self._split(_drain(pages_q, stop)), nodes_q),
+            (self._embed(_drain(nodes_q, stop)), embedded_q),
+        ]
+        threads = [
+            threading.Thread(target=self._run_stage, args=(stage, out_q, errors, stop), daemon=True)
+            for stage, out_q in stages
+        ]
+        for thread in threads:
+            thread.start()
+
+        last_report = start
+        try:
+            while not stop.is_set():
+                try:
+                    nodes = embedded_q.get(timeout=self.progress_interval)
+                except queue.Empty:
+                    nodes = None
+                if nodes is _DONE:
+                    break
+                if nodes:
+                    self.on_nodes(nodes)
+                    self._progress.indexed += len(nodes)
+                now = time.perf_counter()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    yield self._snapshot(start)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if not errors.empty():
+            raise errors.get()
+
+        progress = self._snapshot(start)
+        progress.stage = "done"
+        logger.info(f"Ingestion finished. {progress}")
+        metrics.observe_ingestion(
+            progress.elapsed, files=len(files), pages=progress.pages, chunks=progress.indexed
+        )
+        yield progress
+
+    def _snapshot(self, start: float) -> IngestionProgress:
+        progress = replace(self._progress, elapsed=time.perf_counter() - start)
+        # report the stage that is furthest behind
+        if progress.embedded < progress.chunks:
+            progress.stage = "embed"
+        elif progress.indexed < progress.embedded:
+            progress.stage = "index"
+        else:
+            progress.stage = "extract"
+        return progress
@@ -16,6 +16,13 @@ class BaseLLMModel:
         """
         raise NotImplementedError
 
+    def warm_up(self):
+        """
+        Make the model ready to answer, e.g. download it and load it into memory
+        :return: Iterator[str]: progress messages
+        """
+        return iter(())
+
     def get_llm(self):
         """
         Get llm model that follows base class that llama index classes require
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatStartEvent,
+    LLMChatEndEvent,
+    LLMCompletionStartEvent,
+    LLMCompletionEndEvent,
+)
+from llama_index.core.instrumentation.events.span import SpanDropEvent
+from pydantic import PrivateAttr
+
+from local_rag_chat.logs.metrics import metrics, RequestTrace
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+class LLMMetricsHandler(BaseEventHandler):
+    """
+    Time every LLM chat and completion call from its start event to its end event,
+    which for a streamed call is sent once the last token has been read.
+
+    A call that fails is forgotten on its span drop event. A stream that is never read
+    to the end sends neither event, so only the max_pending most recent calls are kept.
+    """
+    max_pending: int = 1024
+    _started: OrderedDict[str, Tuple[float, str, Optional[RequestTrace]]] = PrivateAttr(default_factory=OrderedDict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMMetricsHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> Any:
+        if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+            model = str(event.model_dict.get("model") or event.model_dict.get("model_name") or "")
+            with self._lock:
+                self._started[event.span_id] = (time.perf_counter(), model, metrics.current_trace())
+                while len(self._started) > self.max_pending:
+                    self._started.popitem(last=False)
+        elif isinstance(event, SpanDropEvent):
+            with self._lock:
+                self._started.pop(event.span_id, None)
+        elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+            with self._lock:
+                started = self._started.pop(event.span_id, None)
+            if started is None:
+                return
+            start, model, trace = started
+            call = "chat" if isinstance(event, LLMChatEndEvent) else "completion"
+            metrics.observe_llm_call(model, call, time.perf_counter() - start, trace)
+
+
+def instrument_llms():
+    """
+    Register the LLM metrics handler on the root dispatcher, once, if metrics are enabled.
+    """
+    global _installed
+    if not metrics.enabled:
+        return
+    with _install_lock:
+        if not _installed:
+            get_dispatcher().add_event_handler(LLMMetricsHandler())
+            _installed = True
@@ -1,41 +1,207 @@
-from local_rag_chat.core.llms.base import BaseLLMModel
-from llama_index.llms.ollama import Ollama
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, Optional, Union
+
 import requests
+from requests.adapters import HTTPAdapter
+from llama_index.llms.ollama import Ollama
 
+from local_rag_chat.core.llms.base import BaseLLMModel
 from local_rag_chat.logs.logging_config import logger
-from configs import OLLAMA_BASE_URL
+from configs import (
+    OLLAMA_BASE_URL,
+    OLLAMA_CONNECT_TIMEOUT,
+    OLLAMA_REQUEST_TIMEOUT,
+    OLLAMA_LOAD_TIMEOUT,
+    OLLAMA_TAGS_TTL,
+    OLLAMA_KEEP_ALIVE,
+)
+
+
+def _full_name(model: str) -> str:
+    # ollama lists untagged models under their latest tag
+    return model if ":" in model else f"{model}:latest"
+
+
+@dataclass
+class PullProgress:
+    """
+    State of a model pull running in the background.
+    """
+    model: str
+    status: str = "waiting"
+    completed: int = 0
+    total: int = 0
+    error: Optional[str] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def __str__(self):
+        if self.error:
+            return f"Pulling {self.model} failed: {self.error}"
+        if self.total:
+            return f"Pulling {self.model}: {self.status} {100 * self.completed / self.total:.0f}%"
+        return f"Pulling {self.model}: {self.status}"
+
+    def updates(self, interval: float = 1.0) -> Iterator[str]:
+        """
+        Progress messages every interval seconds until the pull is done.
+        """
+        while not self.done.wait(interval):
+            yield str(self)
+        yield str(self)
+
+
+class OllamaClient:
+    """
+    Pooled keep-alive HTTP client for the Ollama model management endpoints.
+    The model list is cached for tags_ttl seconds, and a model is pulled at
+    most once at a time, on a background thread.
+    """
+    def __init__(
+            self,
+            base_url: str = OLLAMA_BASE_URL,
+            connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+            read_timeout: float = OLLAMA_REQUEST_TIMEOUT,
+            tags_ttl: float = OLLAMA_TAGS_TTL,
+            pool_size: int = 4
+    ):
+        self.base_url = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tags_ttl = tags_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._models: Optional[set[str]] = None
+        self._models_time = 0.0
+        self._pulls: dict[str, PullProgress] = {}
+
+    def list_models(self, refresh: bool = False) -> set[str]:
+        with self._lock:
+            if not refresh and self._models is not None and time.monotonic() - self._models_time < self.tags_ttl:
+                return self._models
+        response = self.session.get(f"{self.base_url}/api/tags", timeout=(self.connect_timeout, self.read_timeout))
+        response.raise_for_status()
+        models = {item["model"] for item in response.json()["models"]}
+        with self._lock:
+            self._models = models
+            self._models_time = time.monotonic()
+        return models
+
+    def model_exists(self, model: str) -> bool:
+        return _full_name(model) in self.list_models()
+
+    def pull(self, model: str) -> PullProgress:
+        """
+        Start pulling a model in the background, or join the running pull of that model.
+        """
+        with self._lock:
+            progress = self._pulls.get(model)
+            if progress is None or progress.done.is_set():
+                progress = PullProgress(model)
+                self._pulls[model] = progress
+                threading.Thread(target=self._run_pull, args=(progress,), daemon=True).start()
+            return progress
+
+    def _run_pull(self, progress: PullProgress):
+        logger.info(f"Pulling Ollama model {progress.model}")
+        try:
+            with self.session.post(
+                    f"{self.base_url}/api/pull",
+                    json={"name": progress.model, "stream": True},
+                    stream=True,
+                    timeout=(self.connect_timeout, self.read_timeout)
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    update = json.loads(line)
+                    if "error" in update:
+                        progress.error = update["error"]
+                        break
+                    progress.status = update.get("status", progress.status)
+                    progress.completed = update.get("completed", progress.completed)
+                    progress.total = update.get("total", progress.total)
+        except (requests.RequestException, ValueError) as e:
+            progress.error = str(e)
+        finally:
+            if progress.error:
+                logger.error(str(progress))
+            else:
+                logger.info(f"Pulled Ollama model {progress.model}")
+            with self._lock:
+                # the next model_exists call sees the new model
+                self._models = None
+            progress.done.set()
+
+    def preload(self, model: str, keep_alive: Union[float, str]):
+        """
+        Load a model into memory and keep it resident for keep_alive, a request without prompt only loads the model.
+        """
+        response = self.session.post(
+            f"{self.base_url}/api/generate",
+            json={"model": model, "keep_alive": keep_alive},
+            timeout=(self.connect_timeout, OLLAMA_LOAD_TIMEOUT)
+        )
+        response.raise_for_status()
+
+
+_shared_client: Optional[OllamaClient] = None
+_shared_client_lock = threading.Lock()
+
+
+def shared_client() -> OllamaClient:
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = OllamaClient()
+        return _shared_client
 
 
 class OllamaModel(BaseLLMModel):
-    def __init__(self, model: str):
+    def __init__(
+            self,
+            model: str,
+            keep_alive: Union[float, str] = OLLAMA_KEEP_ALIVE,
+            client: Optional[OllamaClient] = None
+    ):
         self.model = model
+        self.keep_alive = keep_alive
+        self.client = client or shared_client()
         super().__init__()
 
     def load_llm(self):
-        if not self.model_exists():
-            logger.info(f"Model {self.model} does not exist. Pulling model...")
-            self.pull_model()
-
         self.llm = Ollama(
             model=self.model,
             base_url=OLLAMA_BASE_URL,
-            request_timeout=180
+            request_timeout=OLLAMA_REQUEST_TIMEOUT,
+            keep_alive=self.keep_alive
         )
         logger.info(f"Loaded Ollama model: {self.model}")
 
     def model_exists(self):
-        data = requests.get(f"{OLLAMA_BASE_URL}/api/tags").json()
-        return any(item['model']==self.model for item in data['models'])
+        return self.client.model_exists(self.model)
 
     def predict(self, query):
         response = self.llm.complete(query)
         return response
 
-    def pull_model(self):
-        payload = {
-            "name": self.model
-        }
-        return requests.post(f"{OLLAMA_BASE_URL}/api/pull", json=payload)
-
-
+    def pull_model(self) -> PullProgress:
+        return self.client.pull(self.model)
 
+    def warm_up(self) -> Iterator[str]:
+        if not self.model_exists():
+            logger.info(f"Model {self.model} does not exist. Pulling model...")
+            progress = self.pull_model()
+            yield from progress.updates()
+            if progress.error:
+                raise RuntimeError(str(progress))
+        yield f"Loading {self.model}..."
+        start = time.perf_counter()
+        self.client.preload(self.model, self.keep_alive)
+        logger.info(f"Ollama model {self.model} loaded in {time.perf_counter() - start:.1f}s")
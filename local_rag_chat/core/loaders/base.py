@@ -1,3 +1,6 @@
+import hashlib
+
+
 class BaseLoader:
     """
     Base class for all loaders.
@@ -6,9 +9,26 @@ class BaseLoader:
         self.chunk_size = 512
         self.chunk_overlap = 100
 
+    @staticmethod
+    def document_id(file: str) -> str:
+        """
+        Content hash of the file, so re-uploading the same file maps to the same document.
+        """
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()[:16]
+
     def load(self, file):
         raise NotImplementedError()
 
+    def load_many(self, files):
+        documents = []
+        for file in files:
+            documents.extend(self.load(file))
+        return documents
+
     def split(self, data):
         raise NotImplementedError()
 
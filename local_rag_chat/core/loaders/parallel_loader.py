@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Iterator, Tuple, Optional
+
+import fitz
+from llama_index.core import Document
+
+from local_rag_chat.core.loaders.simple_loader import SimpleLoader
+from local_rag_chat.logs.logging_config import logger
+
+
+def _extract_pages(file: str, start: int, end: int) -> List[str]:
+    """
+    Extract and filter the text of pages [start, end) of a file, run in a worker process.
+    """
+    with fitz.open(file) as reader:
+        return [SimpleLoader._filter_text(reader.load_page(i).get_text()) for i in range(start, end)]
+
+
+class ParallelLoader(SimpleLoader):
+    """
+    Loader that shards the pages of one or more files across a process pool.
+    Pages are streamed back in order and at most max_pending_shards shards are
+    in flight, so memory stays bounded regardless of the file size.
+    """
+    def __init__(self,
+                 embed_model=None,
+                 chunk_size=512,
+                 chunk_overlap=100,
+                 max_workers: Optional[int] = None,
+                 pages_per_shard: int = 16,
+                 max_pending_shards: Optional[int] = None
+    ):
+        super().__init__(embed_model=embed_model, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_shard = pages_per_shard
+        self.max_pending_shards = max_pending_shards or 2 * self.max_workers
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        # the pool is created on first use and reused for later uploads. Workers are spawned,
+        # forking copies the locks held by the model and server threads of this process
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _shards(self, files: List[str]) -> Iterator[Tuple[str, int, int]]:
+        for file in files:
+            with fitz.open(file) as reader:
+                page_count = reader.page_count
+            for start in range(0, page_count, self.pages_per_shard):
+                yield file, start, min(start + self.pages_per_shard, page_count)
+
+    def iter_file_pages(self, files: List[str]) -> Iterator[Tuple[str, int, str]]:
+        """
+        Yield (file, page number, filtered text) for every page of the files, in order.
+        """
+        shards = list(self._shards(files))
+        if self.max_workers == 1 or len(shards) == 1:
+            for file, start, end in shards:
+                for offset, text in enumerate(_extract_pages(file, start, end)):
+                    yield file, start + offset, text
+            return
+
+        executor = self._get_executor()
+        pending = deque()
+        try:
+            for shard in shards:
+                pending.append((shard, executor.submit(_extract_pages, *shard)))
+                if len(pending) >= self.max_pending_shards:
+                    yield from self._drain(pending.popleft())
+            while pending:
+                yield from self._drain(pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _drain(item) -> Iterator[Tuple[str, int, str]]:
+        (file, start, _), future = item
+        for offset, text in enumerate(future.result()):
+            yield file, start + offset, text
+
+    def iter_pages(self, file: str) -> Iterator[Tuple[int, str]]:
+        for _, page_num, text in self.iter_file_pages([file]):
+            yield page_num, text
+
+    def load_many(self, files: List[str]) -> List[Document]:
+        doc_ids = {file: self.document_id(file) for file in files}
+        sections = {file: self.page_sections(file) for file in files}
+        documents = [
+            self.page_document(file, doc_ids[file], page_num, text, sections[file][page_num])
+            for file, page_num, text in self.iter_file_pages(files)
+            if text.strip()
+        ]
+        logger.info(f"Loaded {len(documents)} pages from {len(files)} files")
+        return documents
@@ -0,0 +1,101 @@
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.core.schema import BaseNode, NodeRelationship
+
+
+class SemanticChunker:
+    """
+    Semantic chunking like SemanticSplitterNodeParser: a chunk ends where the cosine
+    distance between the embeddings of two consecutive sentence windows is above the
+    breakpoint_percentile_threshold percentile of the distances of its document.
+
+    The windows of all the documents are embedded in one batched call, repeated
+    windows such as headers and footers only once. With derive_embeddings, every
+    chunk gets the normalized mean of the embeddings of its windows, so chunks are
+    not embedded a second time before indexing.
+    """
+    def __init__(
+            self,
+            embed_model: BaseEmbedding,
+            buffer_size: int = 1,
+            breakpoint_percentile_threshold: float = 95,
+            derive_embeddings: bool = True,
+            sentence_splitter: Optional[Callable[[str], List[str]]] = None
+    ):
+        """
+        :param buffer_size: sentences on each side of a sentence in its window
+        :param derive_embeddings: set the embedding of the chunks from the embeddings of their windows
+        """
+        self.embed_model = embed_model
+        self.buffer_size = buffer_size
+        self.breakpoint_percentile_threshold = breakpoint_percentile_threshold
+        self.derive_embeddings = derive_embeddings
+        self.sentence_splitter = sentence_splitter or split_by_sentence_tokenizer()
+
+    def _windows(self, sentences: List[str]) -> List[str]:
+        return [
+            "".join(sentences[max(i - self.buffer_size, 0):i + self.buffer_size + 1])
+            for i in range(len(sentences))
+        ]
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """
+        L2-normalized embeddings of the texts, one row per text.
+        """
+        unique = list(dict.fromkeys(texts))
+        embeddings = np.asarray(self.embed_model.get_text_embedding_batch(unique), dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings /= np.where(norms > 0, norms, 1.0)
+        rows = {text: row for row, text in enumerate(unique)}
+        return embeddings[[rows[text] for text in texts]]
+
+    def _chunk_spans(self, embeddings: np.ndarray) -> List[Tuple[int, int]]:
+        """
+        [start, end) sentence ranges of the chunks of a document.
+        """
+        if len(embeddings) < 2:
+            return [(0, len(embeddings))]
+        distances = 1 - np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+        threshold = np.percentile(distances, self.breakpoint_percentile_threshold)
+        ends = np.flatnonzero(distances > threshold) + 1
+        bounds = [0, *ends.tolist(), len(embeddings)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _document_nodes(self, document: Document, sentences: List[str], embeddings: np.ndarray) -> List[BaseNode]:
+        spans = self._chunk_spans(embeddings)
+        nodes = build_nodes_from_splits(["".join(sentences[start:end]) for start, end in spans], document)
+        position = 0
+        for node, (start, end) in zip(nodes, spans):
+            node.metadata = dict(document.metadata)
+            start_char = document.text.find(node.text, position)
+            if start_char >= 0:
+                node.start_char_idx = start_char
+                node.end_char_idx = position = start_char + len(node.text)
+            if self.derive_embeddings:
+                embedding = embeddings[start:end].mean(axis=0)
+                norm = np.linalg.norm(embedding)
+                node.embedding = (embedding / norm if norm > 0 else embedding).tolist()
+        for previous, node in zip(nodes, nodes[1:]):
+            node.relationships[NodeRelationship.PREVIOUS] = previous.as_related_node_info()
+            previous.relationships[NodeRelationship.NEXT] = node.as_related_node_info()
+        return nodes
+
+    def split(self, documents: Sequence[Document]) -> List[BaseNode]:
+        sentences = [self.sentence_splitter(document.text) for document in documents]
+        windows = [window for doc_sentences in sentences for window in self._windows(doc_sentences)]
+        if not windows:
+            return []
+        embeddings = self._embed(windows)
+        nodes = []
+        offset = 0
+        for document, doc_sentences in zip(documents, sentences):
+            if doc_sentences:
+                doc_embeddings = embeddings[offset:offset + len(doc_sentences)]
+                nodes.extend(self._document_nodes(document, doc_sentences, doc_embeddings))
+            offset += len(doc_sentences)
+        return nodes
@@ -1,11 +1,17 @@
-from llama_index.core.node_parser import SentenceSplitter, SemanticSplitterNodeParser
+from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core import Document
 from llama_index.core.schema import BaseNode
 
 from local_rag_chat.core.loaders.base import BaseLoader
+from local_rag_chat.core.loaders.semantic_chunker import SemanticChunker
 import fitz
+import os
 import re
-from typing import List
+from typing import List, Iterator, Optional, Tuple
+
+LINE_BREAK_PATTERN = re.compile(r"\s*\n\s*")
+SENTENCE_ENDS = frozenset(".!?")
+
 
 class SimpleLoader(BaseLoader):
     """
@@ -19,40 +25,87 @@ class SimpleLoader(BaseLoader):
     ):
         super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
         self.embed_model = embed_model
+        self.semantic_chunker = None
+        if embed_model:
+            self.semantic_chunker = SemanticChunker(embed_model, buffer_size=1, breakpoint_percentile_threshold=95)
 
     @staticmethod
     def _filter_text(text: str) -> str:
         """
-        Filter text to remove unnecessary whitespaces and line breaks.
+        Filter text to remove unnecessary whitespaces and line breaks, in a single pass:
+        every run of whitespace containing a line break becomes one line break after the
+        end of a sentence, and one space anywhere else.
+        """
+        def replace(match: re.Match) -> str:
+            start = match.start()
+            return "\n" if start and text[start - 1] in SENTENCE_ENDS else " "
+        return LINE_BREAK_PATTERN.sub(replace, text)
+
+    def iter_pages(self, file: str) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (page number, filtered text) for every page of the file, in order.
+        """
+        with fitz.open(file) as reader:
+            for page_num in range(reader.page_count):
+                page = reader.load_page(page_num)
+                page_text = page.get_text()
+                page_text = self._filter_text(page_text)
+                yield page_num, page_text
+
+    def iter_file_pages(self, files: List[str]) -> Iterator[Tuple[str, int, str]]:
+        """
+        Yield (file, page number, filtered text) for every page of the files, in order.
+        """
+        for file in files:
+            for page_num, page_text in self.iter_pages(file):
+                yield file, page_num, page_text
+
+    @staticmethod
+    def page_sections(file: str) -> List[Optional[str]]:
+        """
+        Title of the section every page of the file belongs to, from the table of contents of the file.
+        Pages before the first entry, and all pages of a file without one, have no section.
+        """
+        with fitz.open(file) as reader:
+            page_count = reader.page_count
+            # [level, title, 1-based page], in document order
+            toc = sorted(reader.get_toc(simple=True), key=lambda entry: entry[2])
+        sections: List[Optional[str]] = []
+        section = None
+        entry = 0
+        for page in range(1, page_count + 1):
+            while entry < len(toc) and toc[entry][2] <= page:
+                section = toc[entry][1].strip() or section
+                entry += 1
+            sections.append(section)
+        return sections
+
+    @staticmethod
+    def page_document(file: str, doc_id: str, page_num: int, text: str, section: Optional[str] = None) -> Document:
+        """
+        Document of one page, every chunk split from it keeps its file, page and section.
         """
-        # Remove leading and trailing whitespaces
-        text = re.sub(r"\s+\n\s+", "\n", text)
-        # Remove spaces before line breaks
-        text = re.sub(r"\s+\n", "\n", text)
-        # Remove spaces after line breaks
-        text = re.sub(r"\n\s+", "\n", text)
-        # Remove line breaks which are not at the end of a sentence
-        text = re.sub(r"(?<![.!?])\n", " ", text)
-        # Limit the number of consecutive line breaks to 2
-        text = re.sub(r"\n{3,}", "\n\n", text)
-        return text
+        metadata = {"file_name": os.path.basename(file), "page_label": str(page_num + 1)}
+        if section:
+            metadata["section"] = section
+        return Document(text=text, id_=doc_id, metadata=metadata)
 
     def load(self, file: str)-> List[Document]:
-        reader = fitz.open(file)
-        text = []
-        for page_num in range(reader.page_count):
-            page = reader.load_page(page_num)
-            page_text = page.get_text()
-            page_text = self._filter_text(page_text)
-            text.append(page_text)
-        text = " ".join(text)
-        return [Document(text=text)]
+        doc_id = self.document_id(file)
+        sections = self.page_sections(file)
+        return [
+            self.page_document(file, doc_id, page_num, text, sections[page_num])
+            for page_num, text in self.iter_pages(file)
+            if text.strip()
+        ]
 
     def split(self, documents: List[Document]) -> List[BaseNode]:
-        if self.embed_model:
-            node_parser = SemanticSplitterNodeParser(
-                buffer_size=1, breakpoint_percentile_threshold=95, embed_model=self.embed_model
-            )
-        else:
-            node_parser = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
-        return node_parser.get_nodes_from_documents(documents)
+        if self.semantic_chunker is not None:
+            # the sentence windows of all the pages are embedded together, and the chunks reuse their embeddings
+            return self.semantic_chunker.split(documents)
+        node_parser = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        # pages of a file share its id, the parser would give all their chunks the metadata of the last page
+        nodes = []
+        for document in documents:
+            nodes.extend(node_parser.get_nodes_from_documents([document]))
+        return nodes
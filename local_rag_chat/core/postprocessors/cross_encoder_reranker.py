@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from local_rag_chat.logs.logging_config import logger
+from local_rag_chat.logs.metrics import metrics
+
+
+class CrossEncoderReranker(BaseNodePostprocessor):
+    """
+    Rerank retrieved nodes with a small cross-encoder run on the CPU.
+
+    The uncached (query, chunk) pairs of at most max_candidates nodes are scored
+    in one padded batch of at most max_length tokens each, which bounds the time
+    added to a query. The top_n nodes are kept, minus those scoring more than
+    cutoff_margin below the best one, so a clearly better chunk is sent to the LLM
+    without the weaker ones. Pair scores are kept in an LRU cache.
+
+    Summary nodes are passed through unchanged, a summary needs all of them.
+    """
+    model: str = Field(default="cross-encoder/ms-marco-MiniLM-L-6-v2", description="Cross-encoder model name.")
+    top_n: int = Field(default=3, description="Maximum number of nodes returned.")
+    max_candidates: int = Field(default=20, description="Maximum number of nodes scored per query.")
+    max_length: int = Field(default=256, description="Maximum tokens of a (query, chunk) pair.")
+    cutoff_margin: Optional[float] = Field(
+        default=4.0, description="Drop nodes scoring this much below the best one, None keeps top_n nodes."
+    )
+    min_n: int = Field(default=1, description="Minimum number of nodes kept by the cut-off.")
+    cache_size: int = Field(default=2048, description="Number of cached pair scores.")
+
+    _model: Any = PrivateAttr(default=None)
+    _cache: OrderedDict = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderReranker"
+
+    @property
+    def cross_encoder(self):
+        # loaded on the first query so the app starts without the model
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Loading reranker model {self.model}")
+                    self._model = CrossEncoder(self.model, max_length=self.max_length, device="cpu")
+        return self._model
+
+    def score(self, query: str, nodes: List[NodeWithScore]) -> List[float]:
+        keys = [(query, node.node.hash) for node in nodes]
+        scores: List[Optional[float]] = [None] * len(nodes)
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    scores[i] = cached
+            missing = [i for i, score in enumerate(scores) if score is None]
+            self._hits += len(nodes) - len(missing)
+            self._misses += len(missing)
+        if missing:
+            pairs = [(query, nodes[i].node.get_content(metadata_mode=MetadataMode.NONE)) for i in missing]
+            predicted = self.cross_encoder.predict(
+                pairs, batch_size=len(pairs), show_progress_bar=False, convert_to_numpy=True
+            )
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._cache[keys[i]] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def _postprocess_nodes(
+            self,
+            nodes: List[NodeWithScore],
+            query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if query_bundle is None or not nodes:
+            return nodes
+        if any("summary_level" in node.node.metadata for node in nodes):
+            return nodes
+        with metrics.span("rerank"):
+            candidates = nodes[:self.max_candidates]
+            scores = self.score(query_bundle.query_str, candidates)
+            ranked = sorted(zip(scores, range(len(candidates))), reverse=True)[:self.top_n]
+            if self.cutoff_margin is not None:
+                best = ranked[0][0]
+                ranked = ranked[:self.min_n] + [r for r in ranked[self.min_n:] if r[0] >= best - self.cutoff_margin]
+        logger.debug(f"Reranked {len(candidates)} nodes into {len(ranked)}, cache stats: {self.stats()}")
+        return [NodeWithScore(node=candidates[i].node, score=score) for score, i in ranked]
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "entries": len(self._cache),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+        }
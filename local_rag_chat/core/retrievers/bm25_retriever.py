@@ -0,0 +1,454 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional, List, Iterable, Tuple
+
+import numpy as np
+from bm25s.stopwords import STOPWORDS_EN
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import BaseNode, QueryBundle, NodeWithScore
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from local_rag_chat.core.vector_stores.metadata_index import MetadataIndex
+
+try:
+    import Stemmer
+except ImportError:
+    Stemmer = None
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+STOPWORDS = frozenset(STOPWORDS_EN)
+
+
+class Tokenizer:
+    """
+    Lowercase, drop English stopwords and stem, the same way BM25Retriever tokenizes.
+    """
+    def __init__(self, language: str = "english"):
+        self.stemmer = Stemmer.Stemmer(language) if Stemmer is not None else None
+
+    def __call__(self, text: str) -> List[str]:
+        tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+        if self.stemmer is not None:
+            tokens = self.stemmer.stemWords(tokens)
+        return tokens
+
+
+@dataclass
+class CorpusStats:
+    """
+    Collection statistics of BM25 scores. Indexes scoring a query with the combined
+    statistics of all of them give the scores a single index over their union would.
+    """
+    num_rows: int
+    num_docs: int
+    total_len: float
+    doc_freqs: Dict[str, int]
+
+    @classmethod
+    def combine(cls, stats: Iterable["CorpusStats"], terms: Iterable[str]) -> "CorpusStats":
+        """
+        Statistics of the union of the indexes, with the document frequencies of the given terms only.
+        """
+        stats = list(stats)
+        return cls(
+            num_rows=sum(s.num_rows for s in stats),
+            num_docs=sum(s.num_docs for s in stats),
+            total_len=sum(s.total_len for s in stats),
+            doc_freqs={term: sum(s.doc_freqs.get(term, 0) for s in stats) for term in terms},
+        )
+
+
+class BM25Index:
+    """
+    BM25 inverted index with CSR postings: the postings of term t are
+    rows[indptr[t]:indptr[t + 1]] with term frequencies tfs[indptr[t]:indptr[t + 1]].
+
+    New documents go to a small delta segment and deleted ones are tombstoned;
+    both are folded into the CSR arrays by merge() once they grow, like segment
+    merging in Lucene. Until then document frequencies count deleted documents.
+    """
+    INDEX_FILE = "bm25.npz"
+    META_FILE = "bm25.json"
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, tokenizer: Optional[Tokenizer] = None):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer or Tokenizer()
+        self.vocab: dict[str, int] = {}
+        self.node_ids: List[str] = []
+        self.rows: dict[str, int] = {}
+
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._post_rows = np.zeros(0, dtype=np.int32)
+        self._post_tfs = np.zeros(0, dtype=np.float32)
+        self._delta: dict[int, List[Tuple[int, int]]] = {}
+        self._delta_size = 0
+
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._alive_len = 0.0
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.rows)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Bytes of the posting and document length arrays, the vocabulary and the delta segment are not counted.
+        """
+        return sum(a.nbytes for a in (self._indptr, self._post_rows, self._post_tfs, self._doc_len, self._alive))
+
+    def corpus_stats(self) -> CorpusStats:
+        # counts deleted documents until the next merge, like search does
+        doc_freqs = np.diff(self._indptr)
+        freqs = {
+            term: (int(doc_freqs[term_id]) if term_id < len(doc_freqs) else 0) + len(self._delta.get(term_id, ()))
+            for term, term_id in self.vocab.items()
+        }
+        return CorpusStats(
+            num_rows=len(self.node_ids),
+            num_docs=len(self.rows),
+            total_len=float(self._alive_len),
+            doc_freqs=freqs,
+        )
+
+    def _grow(self, rows: int):
+        needed = len(self.node_ids) + rows
+        if needed <= len(self._doc_len):
+            return
+        capacity = max(needed, 2 * len(self._doc_len), 1024)
+        self._doc_len = np.concatenate([self._doc_len, np.zeros(capacity - len(self._doc_len), np.float32)])
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - len(self._alive), bool)])
+
+    def add(self, docs: Iterable[Tuple[str, str]]):
+        """
+        Index (node id, text) pairs, re-adding an id replaces the old document.
+        """
+        docs = list(docs)
+        self.remove([node_id for node_id, _ in docs if node_id in self.rows])
+        self._grow(len(docs))
+        for node_id, text in docs:
+            row = len(self.node_ids)
+            self.node_ids.append(node_id)
+            self.rows[node_id] = row
+            tokens = self.tokenizer(text)
+            for term, tf in Counter(tokens).items():
+                term_id = self.vocab.setdefault(term, len(self.vocab))
+                self._delta.setdefault(term_id, []).append((row, tf))
+                self._delta_size += 1
+            self._doc_len[row] = len(tokens)
+            self._alive[row] = True
+            self._alive_len += len(tokens)
+        if self._delta_size > max(10_000, len(self._post_rows) // 10):
+            self.merge()
+
+    def remove(self, node_ids: Iterable[str]):
+        for node_id in node_ids:
+            row = self.rows.pop(node_id, None)
+            if row is None:
+                continue
+            self._alive[row] = False
+            self._alive_len -= self._doc_len[row]
+        if len(self.node_ids) > 1024 and len(self.rows) < 0.8 * len(self.node_ids):
+            self.merge()
+
+    def merge(self):
+        """
+        Fold the delta segment into the CSR arrays and drop deleted documents, renumbering rows.
+        """
+        n_rows = len(self.node_ids)
+        main_terms = np.repeat(np.arange(len(self._indptr) - 1), np.diff(self._indptr))
+        delta = [(term_id, row, tf) for term_id, postings in self._delta.items() for row, tf in postings]
+        delta = np.asarray(delta, dtype=np.int64).reshape(-1, 3)
+        terms = np.concatenate([main_terms, delta[:, 0]])
+        rows = np.concatenate([self._post_rows.astype(np.int64), delta[:, 1]])
+        tfs = np.concatenate([self._post_tfs, delta[:, 2].astype(np.float32)])
+
+        alive = self._alive[:n_rows]
+        keep = alive[rows]
+        new_rows = np.cumsum(alive) - 1
+        terms, rows, tfs = terms[keep], new_rows[rows[keep]], tfs[keep]
+        order = np.lexsort((rows, terms))
+
+        self._post_rows = rows[order].astype(np.int32)
+        self._post_tfs = tfs[order]
+        self._indptr = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(self.vocab)))])
+        self._delta = {}
+        self._delta_size = 0
+
+        live = np.flatnonzero(alive)
+        self.node_ids = [self.node_ids[row] for row in live]
+        self.rows = {node_id: row for row, node_id in enumerate(self.node_ids)}
+        self._doc_len = self._doc_len[live].copy()
+        self._alive = np.ones(len(live), dtype=bool)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = (self._indptr[term_id], self._indptr[term_id + 1]) if term_id < len(self._indptr) - 1 else (0, 0)
+        rows, tfs = self._post_rows[start:end], self._post_tfs[start:end]
+        delta = self._delta.get(term_id)
+        if delta:
+            delta = np.asarray(delta)
+            rows = np.concatenate([rows, delta[:, 0]])
+            tfs = np.concatenate([tfs, delta[:, 1].astype(np.float32)])
+        return rows, tfs
+
+    @staticmethod
+    def _restrict(rows: np.ndarray, tfs: np.ndarray, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Postings of the allowed rows, found by binary search in the sorted posting rows.
+        """
+        if len(allowed) >= len(rows):
+            keep = np.isin(rows, allowed, assume_unique=True)
+            return rows[keep], tfs[keep]
+        positions = np.minimum(np.searchsorted(rows, allowed), len(rows) - 1)
+        positions = positions[rows[positions] == allowed]
+        return rows[positions], tfs[positions]
+
+    def query_postings(
+            self,
+            query: str,
+            node_ids: Optional[Iterable[str]] = None,
+            stats: Optional[CorpusStats] = None
+    ) -> Optional["QueryPostings"]:
+        """
+        The postings of the query terms, to be scored without holding the index. Arrays are
+        replaced rather than resized by updates, so the ones referenced stay valid; a document
+        deleted meanwhile may still be scored. None if no document can match.
+
+        :param node_ids: restrict the results to these documents, only their postings are scored
+        :param stats: collection statistics to score with instead of those of this index
+        """
+        if not self.rows:
+            return None
+        if stats is None:
+            n_rows = len(self.node_ids)
+            avg_len = max(self._alive_len / len(self.rows), 1e-9)
+        else:
+            n_rows = stats.num_rows
+            avg_len = max(stats.total_len / max(stats.num_docs, 1), 1e-9)
+        allowed = None
+        if node_ids is not None:
+            allowed = np.unique(np.fromiter(
+                (self.rows[node_id] for node_id in node_ids if node_id in self.rows), dtype=np.int64
+            ))
+            if not len(allowed):
+                return None
+        terms = []
+        for term in set(self.tokenizer(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            rows, tfs = self._postings(term_id)
+            if not len(rows):
+                continue
+            doc_freq = len(rows) if stats is None else stats.doc_freqs.get(term, len(rows))
+            idf = np.log(1 + (n_rows - doc_freq + 0.5) / (doc_freq + 0.5))
+            terms.append((rows, tfs, idf))
+        if not terms:
+            return None
+        return QueryPostings(
+            terms=terms,
+            allowed=allowed,
+            avg_len=avg_len,
+            k1=self.k1,
+            b=self.b,
+            doc_len=self._doc_len,
+            alive=self._alive,
+            node_ids=self.node_ids,
+        )
+
+    def search(
+            self,
+            query: str,
+            top_k: int,
+            node_ids: Optional[Iterable[str]] = None,
+            stats: Optional[CorpusStats] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Score only the documents in the postings of the query terms, see query_postings.
+        """
+        postings = self.query_postings(query, node_ids, stats)
+        return postings.top(top_k) if postings is not None else []
+
+    def save(self, persist_dir: str):
+        self.merge()
+        os.makedirs(persist_dir, exist_ok=True)
+        np.savez(
+            os.path.join(persist_dir, self.INDEX_FILE),
+            indptr=self._indptr,
+            rows=self._post_rows,
+            tfs=self._post_tfs,
+            doc_len=self._doc_len,
+        )
+        terms = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(persist_dir, self.META_FILE), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": terms, "node_ids": self.node_ids}, f)
+
+    @classmethod
+    def load(cls, persist_dir: str, tokenizer: Optional[Tokenizer] = None) -> "BM25Index":
+        with open(os.path.join(persist_dir, cls.META_FILE), "r") as f:
+            meta = json.load(f)
+        index = cls(k1=meta["k1"], b=meta["b"], tokenizer=tokenizer)
+        with np.load(os.path.join(persist_dir, cls.INDEX_FILE)) as arrays:
+            index._indptr = arrays["indptr"]
+            index._post_rows = arrays["rows"]
+            index._post_tfs = arrays["tfs"]
+            index._doc_len = arrays["doc_len"]
+        index.vocab = {term: term_id for term_id, term in enumerate(meta["terms"])}
+        index.node_ids = meta["node_ids"]
+        index.rows = {node_id: row for row, node_id in enumerate(index.node_ids)}
+        index._alive = np.ones(len(index.node_ids), dtype=bool)
+        index._alive_len = float(index._doc_len.sum())
+        return index
+
+    @classmethod
+    def exists(cls, persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, cls.META_FILE))
+
+
+@dataclass
+class QueryPostings:
+    """
+    What BM25Index.search scores: the (rows, tfs, idf) of every query term and
+    the document arrays of the index at the time the postings were read.
+    """
+    terms: List[Tuple[np.ndarray, np.ndarray, float]]
+    allowed: Optional[np.ndarray]
+    avg_len: float
+    k1: float
+    b: float
+    doc_len: np.ndarray
+    alive: np.ndarray
+    node_ids: List[str]
+
+    def top(self, top_k: int) -> List[Tuple[str, float]]:
+        all_rows = []
+        all_scores = []
+        for rows, tfs, idf in self.terms:
+            if self.allowed is not None:
+                rows, tfs = BM25Index._restrict(rows, tfs, self.allowed)
+                if not len(rows):
+                    continue
+            norm = tfs + self.k1 * (1 - self.b + self.b * self.doc_len[rows] / self.avg_len)
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (self.k1 + 1) / norm)
+        if not all_rows:
+            return []
+        rows = np.concatenate(all_rows)
+        scores = np.concatenate(all_scores)
+        keep = self.alive[rows]
+        rows, inverse = np.unique(rows[keep], return_inverse=True)
+        scores = np.bincount(inverse, weights=scores[keep])
+
+        top_k = min(top_k, len(rows))
+        if top_k <= 0:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.node_ids[rows[i]], float(scores[i])) for i in top]
+
+
+class BM25KeywordRetriever(BaseRetriever):
+    """
+    BM25 keyword retriever over a BM25Index that is updated in place,
+    so adding or removing nodes does not re-tokenize the rest of the corpus.
+    Metadata filters are resolved to node ids through a MetadataIndex before scoring.
+    """
+    def __init__(
+            self,
+            nodes: Optional[List[BaseNode]] = None,
+            similarity_top_k: int = 5,
+            k1: float = 1.5,
+            b: float = 0.75,
+            language: str = "english",
+            index: Optional[BM25Index] = None,
+            **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.similarity_top_k = similarity_top_k
+        self.index = index or BM25Index(k1=k1, b=b, tokenizer=Tokenizer(language))
+        self._nodes: dict[str, BaseNode] = {}
+        self._metadata = MetadataIndex()
+        self._lock = threading.RLock()
+        if index is not None:
+            self._nodes = {node.node_id: node for node in nodes or [] if node.node_id in index.rows}
+            for node in self._nodes.values():
+                self._metadata.add(node.node_id, node.metadata)
+        elif nodes:
+            self.add_nodes(nodes)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self._nodes)
+
+    def add_nodes(self, nodes: Iterable[BaseNode]):
+        nodes = list(nodes)
+        with self._lock:
+            self.index.add((node.node_id, node.get_content()) for node in nodes)
+            self._nodes.update((node.node_id, node) for node in nodes)
+            for node in nodes:
+                self._metadata.add(node.node_id, node.metadata)
+
+    def delete_nodes(self, node_ids: Iterable[str]):
+        node_ids = list(node_ids)
+        with self._lock:
+            self.index.remove(node_ids)
+            for node_id in node_ids:
+                self._nodes.pop(node_id, None)
+                self._metadata.remove(node_id)
+
+    def persist(self, persist_dir: str):
+        with self._lock:
+            self.index.save(persist_dir)
+
+    def corpus_stats(self) -> CorpusStats:
+        with self._lock:
+            return self.index.corpus_stats()
+
+    @classmethod
+    def from_persist_dir(
+            cls,
+            persist_dir: str,
+            nodes: List[BaseNode],
+            similarity_top_k: int = 5,
+            language: str = "english",
+            **kwargs
+    ) -> "BM25KeywordRetriever":
+        """
+        Load an index saved with persist, nodes are the documents it was built from.
+        """
+        index = BM25Index.load(persist_dir, tokenizer=Tokenizer(language))
+        return cls(nodes=nodes, similarity_top_k=similarity_top_k, index=index, **kwargs)
+
+    def retrieve_filtered(
+            self,
+            query_bundle: QueryBundle,
+            node_ids: Optional[Iterable[str]],
+            filters: Optional[MetadataFilters] = None,
+            stats: Optional[CorpusStats] = None
+    ) -> List[NodeWithScore]:
+        """
+        Retrieve among the given nodes matching the filters only, all nodes if both are None.
+
+        :param stats: collection statistics to score with, see BM25Index.search
+        """
+        with self._lock:
+            if filters is not None:
+                matched = self._metadata.match(filters)
+                node_ids = matched if node_ids is None else matched.intersection(node_ids)
+            postings = self.index.query_postings(query_bundle.query_str, node_ids, stats)
+        if postings is None:
+            return []
+        # scored without the lock, so queries run concurrently and do not wait for updates
+        hits = postings.top(self.similarity_top_k)
+        nodes = [(self._nodes.get(node_id), score) for node_id, score in hits]
+        # skipping the nodes deleted since the postings were read
+        return [NodeWithScore(node=node, score=score) for node, score in nodes if node is not None]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.retrieve_filtered(query_bundle, None)
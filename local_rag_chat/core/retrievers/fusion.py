@@ -0,0 +1,74 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore
+
+FUSION_RRF = "rrf"
+FUSION_WEIGHTED = "weighted"
+FUSION_MODES = (FUSION_RRF, FUSION_WEIGHTED)
+
+
+def _candidates(results: Sequence[List[NodeWithScore]]):
+    """
+    Union of the retrieved nodes, with a (num_retrievers, num_candidates) matrix
+    of their ranks and scores in each result list (nan where a list missed the node).
+    """
+    columns: dict[str, int] = {}
+    nodes: List[NodeWithScore] = []
+    for result in results:
+        for hit in result:
+            if hit.node.node_id not in columns:
+                columns[hit.node.node_id] = len(nodes)
+                nodes.append(hit)
+    ranks = np.full((len(results), len(nodes)), np.nan)
+    scores = np.full((len(results), len(nodes)), np.nan)
+    for i, result in enumerate(results):
+        cols = [columns[hit.node.node_id] for hit in result]
+        ranks[i, cols] = np.arange(len(result))
+        scores[i, cols] = [hit.score or 0.0 for hit in result]
+    return nodes, ranks, scores
+
+
+def reciprocal_rank_scores(ranks: np.ndarray, weights: np.ndarray, k: float = 60.0) -> np.ndarray:
+    return np.nansum(weights[:, None] / (k + ranks + 1), axis=0)
+
+
+def normalized_scores(scores: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Min-max normalize each retriever's scores to [0, 1] and sum them weighted, a missed node scores 0.
+    """
+    low = np.nanmin(scores, axis=1, keepdims=True, initial=np.inf, where=~np.isnan(scores))
+    high = np.nanmax(scores, axis=1, keepdims=True, initial=-np.inf, where=~np.isnan(scores))
+    span = np.where(high > low, high - low, 1.0)
+    normalized = np.where(high > low, (scores - low) / span, 1.0)
+    return np.nansum(weights[:, None] * np.where(np.isnan(scores), 0.0, normalized), axis=0)
+
+
+def fuse_results(
+        results: Sequence[List[NodeWithScore]],
+        top_k: int,
+        mode: str = FUSION_RRF,
+        weights: Optional[Sequence[float]] = None,
+        rrf_k: float = 60.0
+) -> List[NodeWithScore]:
+    """
+    Fuse the ranked lists of several retrievers into one top_k list.
+
+    :param mode: "rrf" for weighted reciprocal rank fusion, "weighted" for a weighted sum of min-max normalized scores
+    :param weights: one weight per result list, equal weights if None
+    """
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Unsupported fusion mode: {mode}")
+    nodes, ranks, scores = _candidates(results)
+    if not nodes:
+        return []
+    weights = np.ones(len(results)) if weights is None else np.asarray(weights, dtype=float)
+    if mode == FUSION_RRF:
+        fused = reciprocal_rank_scores(ranks, weights, rrf_k)
+    else:
+        fused = normalized_scores(scores, weights)
+
+    top_k = min(top_k, len(nodes))
+    top = np.argpartition(-fused, top_k - 1)[:top_k]
+    top = top[np.argsort(-fused[top], kind="stable")]
+    return [NodeWithScore(node=nodes[i].node, score=float(fused[i])) for i in top]
@@ -1,12 +1,23 @@
-from typing import Optional, List
-from llama_index.core import VectorStoreIndex, StorageContext
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Sequence, Collection, Tuple
+from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
 from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.base.embeddings.base import BaseEmbedding
-from llama_index.core.retrievers import QueryFusionRetriever
-from llama_index.core.retrievers.fusion_retriever import FUSION_MODES
-from llama_index.retrievers.bm25 import BM25Retriever
+from llama_index.core.indices.utils import embed_nodes
 from llama_index.core.schema import BaseNode, QueryBundle, NodeWithScore
-from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from llama_index.core.storage.docstore.types import RefDocInfo
+from llama_index.core.storage.docstore.utils import doc_to_json
+from llama_index.core.vector_stores.types import BasePydanticVectorStore, MetadataFilters, VectorStoreQuery
+
+from local_rag_chat.core.retrievers.bm25_retriever import BM25KeywordRetriever, BM25Index, CorpusStats
+from local_rag_chat.core.retrievers.fusion import fuse_results, FUSION_RRF
+from local_rag_chat.core.vector_stores.numpy_vector_store import NumpyVectorStore
+from local_rag_chat.logs.metrics import metrics
+
+# shared by all the retrievers, sharded retrieval builds one per shard
+_executor = ThreadPoolExecutor(thread_name_prefix="hybrid-retriever")
 
 
 class HybridRetriever(BaseRetriever):
@@ -16,51 +27,318 @@ class HybridRetriever(BaseRetriever):
             embed_model: BaseEmbedding,
             top_k: int = 5,
             vector_store: Optional[BasePydanticVectorStore] = None,
+            vector_index: Optional[VectorStoreIndex] = None,
+            ann: Optional[str] = None,
+            nlist: Optional[int] = None,
+            nprobe: int = 8,
+            compression: Optional[str] = None,
+            bm25_retriever: Optional[BM25KeywordRetriever] = None,
+            fusion_mode: str = FUSION_RRF,
+            fusion_weights: Sequence[float] = (0.6, 0.4),
+            fusion_top_k: int = 3,
+            rrf_k: float = 60.0,
             **kwargs
     ):
+        """
+        :param ann: approximate nearest-neighbour index for dense retrieval, "ivf" or None for an exact scan
+        :param nlist: number of IVF lists, defaults to sqrt(number of vectors)
+        :param nprobe: number of IVF lists scanned per query, higher is slower with better recall
+        :param compression: "int8" or "binary" to keep compressed vectors in memory and rescore from disk
+        :param bm25_retriever: prebuilt keyword retriever over the same nodes, built from the nodes if None
+        :param fusion_mode: "rrf" for reciprocal rank fusion, "weighted" for weighted normalized score fusion
+        :param fusion_weights: weights of the dense and keyword results
+        :param fusion_top_k: number of fused nodes returned
+        :param rrf_k: rank offset of reciprocal rank fusion
+        """
         super().__init__(**kwargs)
+        if ann is not None or compression is not None:
+            if vector_store is not None:
+                raise ValueError("Pass either an ANN index type or compression, or a vector store, not both.")
+            vector_store = NumpyVectorStore(index_type=ann or "flat", nlist=nlist, nprobe=nprobe, compression=compression)
         self.nodes = nodes
         self.embed_model = embed_model
         self.top_k = top_k
         self.vector_store = vector_store
-        self.retriever = self._init_hybrid_retriever()
+        self.vector_index: Optional[VectorStoreIndex] = vector_index
+        self.bm25_retriever: Optional[BM25KeywordRetriever] = bm25_retriever
+        self.fusion_mode = fusion_mode
+        self.fusion_weights = fusion_weights
+        self.fusion_top_k = fusion_top_k
+        self.rrf_k = rrf_k
+        self.document_nodes: dict[str, list[str]] = {}
+        # length of the node texts, kept up to date so memory_bytes does not scan the docstore
+        self._text_bytes = 0
+        # serializes index updates, queries rely on the thread safety of the stores instead
+        self._lock = threading.RLock()
+        self._init_hybrid_retriever()
 
     def _load_index(self):
+        if self.vector_index is not None:
+            self._track_nodes(self.nodes)
+            return self.vector_index
         if self.nodes is None:
             raise ValueError("Nodes must be provided to the retriever.")
         else:
             return self._init_from_nodes()
 
     def _init_from_nodes(self):
-        if self.vector_store is None:
-            vector_index = VectorStoreIndex(self.nodes, embed_model=self.embed_model)
-        else:
-            storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
-            vector_index = VectorStoreIndex(
-                self.nodes, storage_context=storage_context, embed_model=self.embed_model
-            )
-        return vector_index
+        storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+        self.vector_index = VectorStoreIndex([], storage_context=storage_context, embed_model=self.embed_model)
+        self._store_nodes(self.nodes)
+        self._track_nodes(self.nodes)
+        return self.vector_index
 
     def _init_hybrid_retriever(self):
-        vector_index = self._load_index()
-        vector_retriever = vector_index.as_retriever(
-            similarity_top_k=self.top_k
+        self.vector_index = self._load_index()
+        if self.bm25_retriever is None:
+            self.bm25_retriever = BM25KeywordRetriever(
+                nodes=self.nodes, similarity_top_k=self.top_k
+            )
+
+    def persist(self, persist_dir: str):
+        with self._lock:
+            # the index struct is only serialized here, see _store_nodes
+            self.vector_index.storage_context.index_store.add_index_struct(self.vector_index.index_struct)
+            self.vector_index.storage_context.persist(persist_dir=persist_dir)
+            self.bm25_retriever.persist(persist_dir)
+
+    @classmethod
+    def from_persist_dir(
+            cls,
+            persist_dir: str,
+            embed_model: BaseEmbedding,
+            top_k: int = 5,
+            ann: Optional[str] = None,
+            nlist: Optional[int] = None,
+            nprobe: int = 8,
+            compression: Optional[str] = None,
+            **kwargs
+    ):
+        """
+        Load a retriever saved with persist, the vectors are memory-mapped instead of re-embedded
+        and the keyword index is read back instead of re-tokenized.
+        """
+        vector_store = NumpyVectorStore.from_persist_dir(
+            persist_dir, index_type=ann or "flat", nlist=nlist, nprobe=nprobe, compression=compression
+        )
+        storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+        vector_index = load_index_from_storage(storage_context, embed_model=embed_model)
+        nodes = list(storage_context.docstore.docs.values())
+        bm25_retriever = None
+        if BM25Index.exists(persist_dir):
+            bm25_retriever = BM25KeywordRetriever.from_persist_dir(persist_dir, nodes, similarity_top_k=top_k)
+        return cls(
+            nodes=nodes,
+            embed_model=embed_model,
+            top_k=top_k,
+            vector_store=vector_store,
+            vector_index=vector_index,
+            bm25_retriever=bm25_retriever,
+            **kwargs
+        )
+
+    def _track_nodes(self, nodes: list[BaseNode]):
+        for node in nodes:
+            self.document_nodes.setdefault(node.ref_doc_id, []).append(node.node_id)
+            self._text_bytes += len(node.get_content())
+
+    @property
+    def document_ids(self) -> list[str]:
+        return list(self.document_nodes)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Estimated bytes held in memory by the vectors, the keyword index and the node texts.
+        """
+        vector_bytes = getattr(self.vector_index.vector_store, "memory_bytes", 0)
+        return vector_bytes + self.bm25_retriever.index.memory_bytes + self._text_bytes
+
+    def _store_nodes(self, nodes: list[BaseNode]):
+        """
+        Write nodes to the vector store, the index struct and the docstore directly.
+        VectorStoreIndex.insert_nodes re-serializes the whole index struct per call, and
+        KVDocumentStore.add_documents the node list of a document per node, so appending
+        would get slower as the corpus grows.
+        """
+        if not nodes:
+            return
+        embeddings = embed_nodes(nodes, self.embed_model)
+        embedded = []
+        for node in nodes:
+            node = node.model_copy()
+            node.embedding = embeddings[node.node_id]
+            embedded.append(node)
+        new_ids = self.vector_index.vector_store.add(embedded)
+
+        index_struct = self.vector_index.index_struct
+        node_pairs = []
+        metadata_pairs = []
+        document_nodes: dict[str, list[str]] = {}
+        for node, new_id in zip(embedded, new_ids):
+            node.embedding = None
+            index_struct.add_node(node, text_id=new_id)
+            node_pairs.append((node.node_id, doc_to_json(node)))
+            metadata = {"doc_hash": node.hash}
+            if node.ref_doc_id is not None:
+                metadata["ref_doc_id"] = node.ref_doc_id
+                document_nodes.setdefault(node.ref_doc_id, []).append(node.node_id)
+            metadata_pairs.append((node.node_id, metadata))
+
+        docstore = self.vector_index.docstore
+        ref_doc_pairs = []
+        for doc_id, node_ids in document_nodes.items():
+            ref_doc_info = docstore.get_ref_doc_info(doc_id) or RefDocInfo()
+            known = set(ref_doc_info.node_ids)
+            ref_doc_info.node_ids = ref_doc_info.node_ids + [node_id for node_id in node_ids if node_id not in known]
+            ref_doc_pairs.append((doc_id, ref_doc_info.to_dict()))
+        kvstore = docstore._kvstore
+        kvstore.put_all(node_pairs, collection=docstore._node_collection)
+        kvstore.put_all(metadata_pairs, collection=docstore._metadata_collection)
+        kvstore.put_all(ref_doc_pairs, collection=docstore._ref_doc_collection)
+
+    def add_nodes(self, nodes: list[BaseNode]):
+        """
+        Append nodes to the dense and keyword indexes without touching the existing ones.
+        """
+        with self._lock:
+            self._store_nodes(nodes)
+            self.bm25_retriever.add_nodes(nodes)
+            self._track_nodes(nodes)
+
+    def delete_document(self, doc_id: str):
+        """
+        Remove every node of a document from the dense and keyword indexes.
+        """
+        with self._lock:
+            node_ids = self.document_nodes.pop(doc_id, [])
+            if not node_ids:
+                return
+            docstore = self.vector_index.docstore
+            for node_id in node_ids:
+                node = docstore.get_document(node_id, raise_error=False)
+                if node is not None:
+                    self._text_bytes -= len(node.get_content())
+            self.vector_index.delete_nodes(node_ids, delete_from_docstore=True)
+            for node_id in node_ids:
+                self.vector_index.index_struct.delete(node_id)
+            self.bm25_retriever.delete_nodes(node_ids)
+
+    def _dense_retrieve(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]] = None,
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        """
+        Query the vector store directly and resolve the ids through the docstore,
+        skipping nodes deleted since the store answered.
+        """
+        vector_store = self.vector_index.vector_store
+        result = vector_store.query(
+            VectorStoreQuery(
+                query_embedding=query_bundle.embedding,
+                similarity_top_k=self.top_k,
+                doc_ids=list(doc_ids) if doc_ids is not None else None,
+                filters=filters
+            )
+        )
+        if result.nodes is not None:
+            return [NodeWithScore(node=node, score=score) for node, score in zip(result.nodes, result.similarities)]
+        docstore = self.vector_index.docstore
+        hits = []
+        for node_id, score in zip(result.ids, result.similarities):
+            node = docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                hits.append(NodeWithScore(node=node, score=score))
+        return hits
+
+    def ranked_lists(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None,
+            keyword_stats: Optional[CorpusStats] = None
+    ) -> Tuple[List[NodeWithScore], List[NodeWithScore]]:
+        """
+        Unfused dense and keyword top_k of an embedded query, computed on the calling thread.
+
+        :param keyword_stats: collection statistics the keyword scores are computed with
+        """
+        dense = self._dense_retrieve(query_bundle, doc_ids, filters)
+        sparse = self.bm25_retriever.retrieve_filtered(
+            query_bundle, self._document_node_ids(doc_ids), filters, keyword_stats
         )
+        return dense, sparse
+
+    def _fuse(self, dense: List[NodeWithScore], sparse: List[NodeWithScore]) -> List[NodeWithScore]:
+        with metrics.span("fusion"):
+            return fuse_results(
+                [dense, sparse],
+                top_k=self.fusion_top_k,
+                mode=self.fusion_mode,
+                weights=self.fusion_weights,
+                rrf_k=self.rrf_k
+            )
+
+    def _document_node_ids(self, doc_ids: Optional[Collection[str]]) -> Optional[List[str]]:
+        if doc_ids is None:
+            return None
+        return [node_id for doc_id in doc_ids for node_id in self.document_nodes.get(doc_id, [])]
 
-        bm25_retriever = BM25Retriever.from_defaults(
-            index=vector_index, similarity_top_k=self.top_k
+    def retrieve_documents(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        """
+        Retrieve among the nodes of the given documents matching the filters only,
+        all documents if doc_ids is None. Both retrievers resolve the restrictions
+        before scoring, so only the matching nodes are scored.
+        """
+        if query_bundle.embedding is None:
+            with metrics.span("embed_query"):
+                query_bundle.embedding = self.embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+        sparse = _executor.submit(
+            metrics.wrap("bm25", self.bm25_retriever.retrieve_filtered),
+            query_bundle,
+            self._document_node_ids(doc_ids),
+            filters
         )
-        hybrid_retriever = QueryFusionRetriever(
-            [vector_retriever, bm25_retriever],
-            similarity_top_k=3,
-            num_queries=1,
-            retriever_weights=[0.6, 0.4],
-            use_async=True,
-            mode=FUSION_MODES.RECIPROCAL_RANK
-            # llm=self.llm
+        with metrics.span("dense"):
+            dense = self._dense_retrieve(query_bundle, doc_ids, filters)
+        return self._fuse(dense, sparse.result())
+
+    async def aretrieve_documents(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            with metrics.span("embed_query"):
+                # local models embed synchronously even through the async API
+                query_bundle.embedding = await asyncio.to_thread(
+                    self.embed_model.get_agg_embedding_from_queries, query_bundle.embedding_strs
+                )
+        loop = asyncio.get_running_loop()
+        dense, sparse = await asyncio.gather(
+            loop.run_in_executor(
+                _executor, metrics.wrap("dense", self._dense_retrieve), query_bundle, doc_ids, filters
+            ),
+            loop.run_in_executor(
+                _executor,
+                metrics.wrap("bm25", self.bm25_retriever.retrieve_filtered),
+                query_bundle,
+                self._document_node_ids(doc_ids),
+                filters
+            ),
         )
-        return hybrid_retriever
+        return self._fuse(dense, sparse)
 
     def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
-        retrieve_nodes = self.retriever.retrieve(query_bundle)
-        return retrieve_nodes
+        return self.retrieve_documents(query_bundle, None)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return await self.aretrieve_documents(query_bundle, None)
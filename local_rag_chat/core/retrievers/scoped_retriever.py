@@ -0,0 +1,30 @@
+import asyncio
+from typing import List, Optional, Set
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import QueryBundle, NodeWithScore
+from llama_index.core.vector_stores.types import MetadataFilters
+
+
+class DocumentScopedRetriever(BaseRetriever):
+    """
+    View of a shared retriever restricted to a set of documents and optionally
+    to the nodes matching metadata filters. Both are read on every query, so
+    documents added to the set or new filters apply immediately.
+    The wrapped retriever must implement retrieve_documents(query_bundle, doc_ids, filters),
+    and aretrieve_documents for native async retrieval, otherwise async retrieval
+    runs the synchronous one on a worker thread.
+    """
+    def __init__(self, retriever: BaseRetriever, doc_ids: Set[str], filters: Optional[MetadataFilters] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.retriever = retriever
+        self.doc_ids = doc_ids
+        self.filters = filters
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.retriever.retrieve_documents(query_bundle, frozenset(self.doc_ids), self.filters)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if hasattr(self.retriever, "aretrieve_documents"):
+            return await self.retriever.aretrieve_documents(query_bundle, frozenset(self.doc_ids), self.filters)
+        return await asyncio.to_thread(self._retrieve, query_bundle)
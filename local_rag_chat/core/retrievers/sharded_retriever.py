@@ -0,0 +1,448 @@
+import asyncio
+import heapq
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from local_rag_chat.core.retrievers.bm25_retriever import CorpusStats, Tokenizer
+from local_rag_chat.core.retrievers.fusion import fuse_results, FUSION_RRF
+from local_rag_chat.core.retrievers.hybrid_retriever import HybridRetriever
+from local_rag_chat.core.vector_stores.numpy_vector_store import NumpyVectorStore
+from local_rag_chat.logs.logging_config import logger
+from local_rag_chat.logs.metrics import metrics
+
+
+@dataclass
+class Shard:
+    shard_id: str
+    doc_ids: set = field(default_factory=set)
+    num_nodes: int = 0
+    memory_bytes: int = 0
+    # kept while the shard is evicted, queries score keywords with the statistics of all their shards.
+    # None once the shard changed, recomputed on the next query
+    keyword_stats: Optional[CorpusStats] = None
+    retriever: Optional[HybridRetriever] = None
+    # changed since it was last written, written before it is evicted
+    dirty: bool = False
+    # held while the shard is loaded or updated, a held shard is not evicted
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Hybrid retrieval over one HybridRetriever shard per document, small documents
+    sharing a shard of at most shard_max_nodes nodes. Adding or removing a document
+    only updates its shard.
+
+    A query is fanned out to the shards holding the requested documents on a worker
+    pool, each shard returns its dense and keyword top_k, and the merged lists are
+    fused into the global top fusion_top_k. Dense scores are cosine similarities and
+    keyword scores are computed with the BM25 statistics of all the queried shards,
+    so both merge as they would rank in a single index over those shards.
+
+    With a storage_dir, shards are written to a scratch directory under it on flush
+    or when they are evicted, loaded on first use, and the least recently used ones are
+    dropped from memory while the loaded shards hold more than memory_budget bytes.
+    Without one, every shard stays in memory.
+    """
+    def __init__(
+            self,
+            nodes: Optional[List[BaseNode]],
+            embed_model: BaseEmbedding,
+            top_k: int = 5,
+            compression: Optional[str] = None,
+            fusion_mode: str = FUSION_RRF,
+            fusion_weights: Sequence[float] = (0.6, 0.4),
+            fusion_top_k: int = 3,
+            rrf_k: float = 60.0,
+            storage_dir: Optional[str] = None,
+            memory_budget: Optional[int] = None,
+            shard_max_nodes: Optional[int] = None,
+            max_workers: Optional[int] = None,
+            **kwargs
+    ):
+        """
+        :param compression: "int8" or "binary" to keep compressed vectors in memory and rescore from disk
+        :param storage_dir: directory the shards are spilled to, None keeps them all in memory
+        :param memory_budget: bytes of loaded shards above which the least recently used are dropped
+        :param shard_max_nodes: documents are added to the last shard while it has at most this many nodes,
+            None gives every document its own shard
+        :param max_workers: threads querying the shards, defaults to the number of CPUs
+        """
+        super().__init__(**kwargs)
+        self.embed_model = embed_model
+        self.top_k = top_k
+        self.compression = compression
+        self.fusion_mode = fusion_mode
+        self.fusion_weights = fusion_weights
+        self.fusion_top_k = fusion_top_k
+        self.rrf_k = rrf_k
+        self.memory_budget = memory_budget
+        self.shard_max_nodes = shard_max_nodes
+        self._tokenizer = Tokenizer()
+
+        self._root: Optional[str] = None
+        if storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+            # shards are scratch copies of the in-memory indexes, removed with the retriever
+            self._root = tempfile.mkdtemp(prefix="shards-", dir=storage_dir)
+            weakref.finalize(self, shutil.rmtree, self._root, True)
+
+        self._shards: Dict[str, Shard] = {}
+        self._doc_shards: Dict[str, Shard] = {}
+        # loaded shards, least recently used first
+        self._loaded: OrderedDict[str, Shard] = OrderedDict()
+        self._loaded_bytes = 0
+        self._next_id = 0
+        self._open_shard: Optional[Shard] = None
+        # guards the maps above, held briefly
+        self._lock = threading.RLock()
+        # serializes index updates
+        self._update_lock = threading.Lock()
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sharded-retriever")
+        if nodes:
+            self.add_nodes(nodes)
+
+    @property
+    def document_ids(self) -> list[str]:
+        with self._lock:
+            return list(self._doc_shards)
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._shards)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "shards": len(self._shards),
+                "loaded": len(self._loaded),
+                "loaded_bytes": self._loaded_bytes,
+            }
+
+    def _shard_dir(self, shard: Shard) -> str:
+        return os.path.join(self._root, shard.shard_id)
+
+    def _build(self, nodes: List[BaseNode]) -> HybridRetriever:
+        return HybridRetriever(
+            nodes=nodes,
+            embed_model=self.embed_model,
+            top_k=self.top_k,
+            vector_store=NumpyVectorStore(compression=self.compression, vectors_dir=self._root),
+            fusion_top_k=self.fusion_top_k,
+        )
+
+    def _load_locked(self, shard: Shard) -> HybridRetriever:
+        """
+        The retriever of the shard, read back from disk if it was evicted. Must hold the shard's lock.
+        """
+        retriever = shard.retriever
+        if retriever is None:
+            retriever = HybridRetriever.from_persist_dir(
+                self._shard_dir(shard),
+                embed_model=self.embed_model,
+                top_k=self.top_k,
+                compression=self.compression,
+                fusion_top_k=self.fusion_top_k,
+            )
+            logger.debug(f"Loaded shard {shard.shard_id} with {shard.num_nodes} nodes")
+            shard.retriever = retriever
+            self._account(shard)
+        else:
+            self._touch(shard)
+        return retriever
+
+    def _load(self, shard: Shard) -> HybridRetriever:
+        retriever = shard.retriever
+        if retriever is not None:
+            self._touch(shard)
+            return retriever
+        with shard.lock:
+            return self._load_locked(shard)
+
+    def _touch(self, shard: Shard):
+        with self._lock:
+            if shard.shard_id in self._loaded:
+                self._loaded.move_to_end(shard.shard_id)
+
+    def _account(self, shard: Shard):
+        """
+        Refresh the size of a loaded shard and evict others if the budget is exceeded.
+        """
+        with self._lock:
+            if shard.shard_id not in self._shards:
+                return
+            if shard.shard_id in self._loaded:
+                self._loaded_bytes -= shard.memory_bytes
+            shard.memory_bytes = shard.retriever.memory_bytes
+            self._loaded[shard.shard_id] = shard
+            self._loaded.move_to_end(shard.shard_id)
+            self._loaded_bytes += shard.memory_bytes
+            victims = self._evict()
+        # writing the changed victims can take a while, the maps are not held meanwhile
+        self._spill(victims)
+
+    def _evict(self) -> List[Shard]:
+        """
+        Take the least recently used shards out of the loaded ones until the budget is met.
+        Their locks are acquired and released by _spill.
+        """
+        victims = []
+        if self._root is None or self.memory_budget is None:
+            return victims
+        for shard_id in list(self._loaded)[:-1]:
+            if self._loaded_bytes <= self.memory_budget:
+                break
+            shard = self._loaded[shard_id]
+            # shards being loaded or updated are skipped, they are evicted on a later call
+            if not shard.lock.acquire(blocking=False):
+                continue
+            del self._loaded[shard_id]
+            self._loaded_bytes -= shard.memory_bytes
+            victims.append(shard)
+        return victims
+
+    def _spill(self, victims: List[Shard]):
+        for shard in victims:
+            try:
+                if shard.dirty:
+                    self._save_locked(shard, shard.retriever)
+                # running queries keep the retriever they got, it is freed when they finish
+                shard.retriever = None
+                logger.debug(f"Evicted shard {shard.shard_id} with {shard.num_nodes} nodes")
+            finally:
+                shard.lock.release()
+
+    def _forget(self, shard: Shard):
+        with self._lock:
+            self._shards.pop(shard.shard_id, None)
+            if self._loaded.pop(shard.shard_id, None) is not None:
+                self._loaded_bytes -= shard.memory_bytes
+            if self._open_shard is shard:
+                self._open_shard = None
+        if self._root is not None:
+            shutil.rmtree(self._shard_dir(shard), ignore_errors=True)
+
+    def _changed_locked(self, shard: Shard, retriever: HybridRetriever):
+        """
+        Mark the shard as changed and account for its new size. Must hold the shard's lock.
+        """
+        shard.num_nodes = sum(len(node_ids) for node_ids in retriever.document_nodes.values())
+        shard.keyword_stats = None
+        shard.dirty = True
+        self._account(shard)
+
+    def _save_locked(self, shard: Shard, retriever: HybridRetriever):
+        """
+        Write the shard to disk so it can be evicted. Must hold the shard's lock.
+        """
+        if self._root is not None:
+            retriever.persist(self._shard_dir(shard))
+        # computed after persist, which merges the keyword index the shard is searched with
+        shard.keyword_stats = retriever.bm25_retriever.corpus_stats()
+        shard.dirty = False
+
+    def flush(self):
+        """
+        Write the shards changed since they were last written, e.g. once an ingestion
+        finishes, so that evicting them later on a query does not have to.
+        """
+        with self._lock:
+            shards = [shard for shard in self._shards.values() if shard.dirty]
+        for shard in shards:
+            with shard.lock:
+                if shard.dirty and shard.retriever is not None:
+                    self._save_locked(shard, shard.retriever)
+
+    def _target_shard(self, doc_id: str, num_nodes: int) -> Optional[Shard]:
+        with self._lock:
+            if doc_id in self._doc_shards:
+                return self._doc_shards[doc_id]
+            shard = self._open_shard
+            if shard is not None and self.shard_max_nodes is not None \
+                    and shard.num_nodes + num_nodes <= self.shard_max_nodes:
+                return shard
+            return None
+
+    def add_nodes(self, nodes: List[BaseNode]):
+        """
+        Add the nodes of each document to the shard holding the document, to the last shard
+        if it has room for them, or to a new shard.
+        """
+        by_document: Dict[str, List[BaseNode]] = {}
+        for node in nodes:
+            by_document.setdefault(node.ref_doc_id, []).append(node)
+        with self._update_lock:
+            for doc_id, doc_nodes in by_document.items():
+                shard = self._target_shard(doc_id, len(doc_nodes))
+                if shard is None:
+                    with self._lock:
+                        shard = Shard(shard_id=f"shard-{self._next_id:06d}")
+                        self._next_id += 1
+                    with shard.lock:
+                        shard.retriever = self._build(doc_nodes)
+                        with self._lock:
+                            self._shards[shard.shard_id] = shard
+                            self._open_shard = shard
+                        self._changed_locked(shard, shard.retriever)
+                else:
+                    with shard.lock:
+                        retriever = self._load_locked(shard)
+                        retriever.add_nodes(doc_nodes)
+                        self._changed_locked(shard, retriever)
+                with self._lock:
+                    shard.doc_ids.add(doc_id)
+                    self._doc_shards[doc_id] = shard
+
+    def delete_document(self, doc_id: str):
+        """
+        Remove a document from its shard, the shard is dropped once it holds no document.
+        """
+        with self._update_lock:
+            with self._lock:
+                shard = self._doc_shards.pop(doc_id, None)
+                if shard is None:
+                    return
+                shard.doc_ids.discard(doc_id)
+                empty = not shard.doc_ids
+            if empty:
+                self._forget(shard)
+                return
+            with shard.lock:
+                retriever = self._load_locked(shard)
+                retriever.delete_document(doc_id)
+                self._changed_locked(shard, retriever)
+
+    def _targets(self, doc_ids: Optional[Collection[str]]) -> List[Shard]:
+        with self._lock:
+            if doc_ids is None:
+                return list(self._shards.values())
+            shards = {}
+            for doc_id in doc_ids:
+                shard = self._doc_shards.get(doc_id)
+                if shard is not None:
+                    shards[shard.shard_id] = shard
+            return list(shards.values())
+
+    def _search_shard(
+            self,
+            shard: Shard,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters],
+            keyword_stats: Optional[CorpusStats]
+    ) -> Tuple[List[NodeWithScore], List[NodeWithScore]]:
+        retriever = self._load(shard)
+        if doc_ids is not None:
+            with self._lock:
+                whole_shard = shard.doc_ids.issubset(doc_ids)
+            if whole_shard:
+                # no restriction to resolve
+                doc_ids = None
+        return retriever.ranked_lists(query_bundle, doc_ids, filters, keyword_stats)
+
+    @staticmethod
+    def _shard_stats(shard: Shard) -> Optional[CorpusStats]:
+        if shard.keyword_stats is not None:
+            return shard.keyword_stats
+        if shard.lock.acquire(blocking=False):
+            try:
+                if shard.keyword_stats is None and shard.retriever is not None:
+                    shard.keyword_stats = shard.retriever.bm25_retriever.corpus_stats()
+                return shard.keyword_stats
+            finally:
+                shard.lock.release()
+        # not waiting for the update holding the shard, nor caching statistics it is about to change
+        retriever = shard.retriever
+        return retriever.bm25_retriever.corpus_stats() if retriever is not None else None
+
+    def _keyword_stats(self, shards: List[Shard], query_str: str) -> Optional[CorpusStats]:
+        if len(shards) < 2:
+            return None
+        stats = [stats for stats in map(self._shard_stats, shards) if stats is not None]
+        if len(stats) < 2:
+            return None
+        return CorpusStats.combine(stats, set(self._tokenizer(query_str)))
+
+    def _merge(self, results: List[Tuple[List[NodeWithScore], List[NodeWithScore]]]) -> List[NodeWithScore]:
+        dense = heapq.nlargest(self.top_k, (hit for hits, _ in results for hit in hits), key=lambda hit: hit.score or 0.0)
+        sparse = heapq.nlargest(self.top_k, (hit for _, hits in results for hit in hits), key=lambda hit: hit.score or 0.0)
+        with metrics.span("fusion"):
+            return fuse_results(
+                [dense, sparse],
+                top_k=self.fusion_top_k,
+                mode=self.fusion_mode,
+                weights=self.fusion_weights,
+                rrf_k=self.rrf_k
+            )
+
+    def retrieve_documents(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        """
+        Retrieve among the nodes of the given documents matching the filters only,
+        all documents if doc_ids is None. Only the shards holding the documents are queried.
+        """
+        shards = self._targets(doc_ids)
+        if not shards:
+            return []
+        if query_bundle.embedding is None:
+            with metrics.span("embed_query"):
+                query_bundle.embedding = self.embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+        search = metrics.wrap("shards", self._search_shard)
+        stats = self._keyword_stats(shards, query_bundle.query_str)
+        if len(shards) == 1 or self.max_workers == 1:
+            # nothing to overlap, the hand-off to the pool would only add latency
+            results = [search(shard, query_bundle, doc_ids, filters, stats) for shard in shards]
+        else:
+            futures = [
+                self._executor.submit(search, shard, query_bundle, doc_ids, filters, stats)
+                for shard in shards
+            ]
+            results = [future.result() for future in futures]
+        return self._merge(results)
+
+    async def aretrieve_documents(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        shards = self._targets(doc_ids)
+        if not shards:
+            return []
+        if query_bundle.embedding is None:
+            with metrics.span("embed_query"):
+                # local models embed synchronously even through the async API
+                query_bundle.embedding = await asyncio.to_thread(
+                    self.embed_model.get_agg_embedding_from_queries, query_bundle.embedding_strs
+                )
+        loop = asyncio.get_running_loop()
+        search = metrics.wrap("shards", self._search_shard)
+        stats = self._keyword_stats(shards, query_bundle.query_str)
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, search, shard, query_bundle, doc_ids, filters, stats)
+            for shard in shards
+        ))
+        return self._merge(list(results))
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.retrieve_documents(query_bundle, None)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return await self.aretrieve_documents(query_bundle, None)
@@ -0,0 +1,322 @@
+import json
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, Future
+from contextlib import nullcontext
+from typing import Optional, List, Iterable, Collection, Tuple, Callable, ContextManager
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.llms.base import BaseLLM
+from llama_index.core.schema import BaseNode, TextNode, QueryBundle, NodeWithScore
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from local_rag_chat.core.serving.concurrency import GenerationLimiter
+from local_rag_chat.core.vector_stores.metadata_index import MetadataIndex
+from local_rag_chat.logs.logging_config import logger
+
+SECTION_SUMMARY_PROMPT = (
+    "Summarize the following part of a document in a few sentences. "
+    "Keep names, numbers and conclusions.\n\n"
+    "{text}\n\n"
+    "Summary:"
+)
+DOCUMENT_SUMMARY_PROMPT = (
+    "The following are summaries of consecutive parts of the document {file_name}. "
+    "Write a summary of the whole document covering its purpose and main points.\n\n"
+    "{text}\n\n"
+    "Summary:"
+)
+
+
+class SummaryTree:
+    """
+    Map-reduce summaries of one document: consecutive chunks are grouped and
+    summarized into sections, the sections are grouped and summarized again
+    until a single group is left, which is summarized into the document summary.
+    """
+    def __init__(self, doc_id: str, root: TextNode, sections: List[List[TextNode]]):
+        self.doc_id = doc_id
+        self.root = root
+        # sections[0] summarizes the chunks, sections[-1] is the level right below the root
+        self.sections = sections
+
+    @property
+    def top_sections(self) -> List[TextNode]:
+        return self.sections[-1] if self.sections else []
+
+    def to_dict(self) -> dict:
+        return {
+            "doc_id": self.doc_id,
+            "root": self.root.to_dict(),
+            "sections": [[node.to_dict() for node in level] for level in self.sections],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SummaryTree":
+        return cls(
+            doc_id=data["doc_id"],
+            root=TextNode.from_dict(data["root"]),
+            sections=[[TextNode.from_dict(node) for node in level] for level in data["sections"]],
+        )
+
+    @staticmethod
+    def _group(texts: List[str], max_group_chars: int) -> List[str]:
+        groups = []
+        current = []
+        size = 0
+        for text in texts:
+            if current and size + len(text) > max_group_chars:
+                groups.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(text)
+            size += len(text)
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+
+    @classmethod
+    def build(
+            cls,
+            doc_id: str,
+            chunks: List[BaseNode],
+            llm: BaseLLM,
+            max_group_chars: int = 6000,
+            slot: Callable[[], ContextManager] = nullcontext
+    ) -> "SummaryTree":
+        """
+        :param slot: entered around every LLM call, e.g. to wait for a generation slot
+        """
+        def complete(prompt: str) -> str:
+            with slot():
+                return llm.complete(prompt).text.strip()
+
+        file_name = chunks[0].metadata.get("file_name", doc_id)
+        metadata = {"file_name": file_name}
+        texts = [chunk.get_content() for chunk in chunks]
+        sections = []
+        groups = cls._group(texts, max_group_chars)
+        while len(groups) > 1:
+            level = len(sections) + 1
+            summaries = [complete(SECTION_SUMMARY_PROMPT.format(text=group)) for group in groups]
+            sections.append([
+                TextNode(
+                    id_=f"{doc_id}-summary-{level}-{i}",
+                    text=summary,
+                    metadata={**metadata, "summary_level": level},
+                )
+                for i, summary in enumerate(summaries)
+            ])
+            groups = cls._group(summaries, max_group_chars)
+        summary = complete(DOCUMENT_SUMMARY_PROMPT.format(file_name=file_name, text=groups[0]))
+        root = TextNode(id_=f"{doc_id}-summary", text=summary, metadata={**metadata, "summary_level": 0})
+        for node in [root] + [node for level in sections for node in level]:
+            node.excluded_embed_metadata_keys = ["summary_level"]
+            node.excluded_llm_metadata_keys = ["summary_level"]
+        return cls(doc_id, root, sections)
+
+
+class SummaryTreeRetriever(BaseRetriever):
+    """
+    Answers summarization questions with at most max_nodes precomputed summary nodes
+    (document summaries first, then their top-level sections) instead of every chunk.
+
+    Trees are built per document by a background worker once its ingestion finishes,
+    and cached in memory and in cache_dir. Queries never wait for a tree, the documents
+    whose tree is not ready are answered by the fallback retriever. With a limiter,
+    every LLM call of a build waits until no chat generation is running or waiting.
+    """
+    def __init__(
+            self,
+            llm: BaseLLM,
+            cache_dir: Optional[str] = None,
+            max_nodes: int = 6,
+            max_group_chars: int = 6000,
+            fallback: Optional[BaseRetriever] = None,
+            limiter: Optional[GenerationLimiter] = None,
+            **kwargs
+    ):
+        """
+        :param fallback: retriever implementing retrieve_documents(query_bundle, doc_ids, filters),
+            queried for the documents whose tree is not built yet
+        :param limiter: limiter of the chat generations, builds take its background slots
+        """
+        super().__init__(**kwargs)
+        self.llm = llm
+        self.cache_dir = cache_dir
+        self.max_nodes = max_nodes
+        self.max_group_chars = max_group_chars
+        self.fallback = fallback
+        self.limiter = limiter
+        self.document_chunks: dict[str, List[BaseNode]] = {}
+        # chunk metadata postings, filters are resolved to chunk ids and then to their documents
+        self._metadata = MetadataIndex()
+        self._chunk_documents: dict[str, str] = {}
+        # documents whose ingestion finished, only their trees are built and cached
+        self.complete_documents: set[str] = set()
+        self.trees: dict[str, SummaryTree] = {}
+        self._jobs: dict[str, Future] = {}
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary-tree")
+
+    def add_nodes(self, nodes: Iterable[BaseNode]):
+        with self._lock:
+            for node in nodes:
+                self.document_chunks.setdefault(node.ref_doc_id, []).append(node)
+                self._metadata.add(node.node_id, node.metadata)
+                self._chunk_documents[node.node_id] = node.ref_doc_id
+                # a tree built before all chunks arrived is stale
+                self.trees.pop(node.ref_doc_id, None)
+                self.complete_documents.discard(node.ref_doc_id)
+
+    def delete_document(self, doc_id: str):
+        with self._lock:
+            for chunk in self.document_chunks.pop(doc_id, []):
+                self._metadata.remove(chunk.node_id)
+                self._chunk_documents.pop(chunk.node_id, None)
+            self.complete_documents.discard(doc_id)
+            self.trees.pop(doc_id, None)
+            job = self._jobs.pop(doc_id, None)
+        if job is not None:
+            job.cancel()
+
+    def _cache_path(self, doc_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{doc_id}.json")
+
+    def _load_cached(self, doc_id: str) -> Optional[SummaryTree]:
+        if self.cache_dir is None or not os.path.exists(self._cache_path(doc_id)):
+            return None
+        with open(self._cache_path(doc_id), "r") as f:
+            return SummaryTree.from_dict(json.load(f))
+
+    def _save_cached(self, tree: SummaryTree):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._cache_path(tree.doc_id), "w") as f:
+            json.dump(tree.to_dict(), f)
+
+    def _build(self, doc_id: str) -> Optional[SummaryTree]:
+        with self._lock:
+            chunks = list(self.document_chunks.get(doc_id, []))
+        if not chunks:
+            return None
+        tree = self._load_cached(doc_id)
+        cached = tree is not None
+        if tree is None:
+            logger.info(f"Building summary tree of document {doc_id} from {len(chunks)} chunks")
+            slot = self.limiter.background_slot if self.limiter is not None else nullcontext
+            tree = SummaryTree.build(doc_id, chunks, self.llm, self.max_group_chars, slot)
+        with self._lock:
+            # the cache is keyed by content, a tree missing chunks must not be saved under it
+            complete = doc_id in self.complete_documents and len(self.document_chunks.get(doc_id, ())) == len(chunks)
+            if complete:
+                self.trees[doc_id] = tree
+        if complete and not cached:
+            self._save_cached(tree)
+        return tree if complete else None
+
+    def _run_job(self, doc_id: str) -> Optional[SummaryTree]:
+        try:
+            return self._build(doc_id)
+        except Exception:
+            logger.exception(f"Failed to build the summary tree of document {doc_id}")
+            return None
+        finally:
+            with self._lock:
+                self._jobs.pop(doc_id, None)
+
+    def schedule(self, doc_ids: Iterable[str]):
+        """
+        Mark the ingestion of the given documents as finished and build their trees in the background.
+        """
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id not in self.document_chunks:
+                    continue
+                self.complete_documents.add(doc_id)
+                if doc_id not in self.trees and doc_id not in self._jobs:
+                    self._jobs[doc_id] = self._executor.submit(self._run_job, doc_id)
+
+    def get_tree(self, doc_id: str) -> Optional[SummaryTree]:
+        """
+        The tree of a document, None while it is being built or its ingestion is not finished.
+        A document whose build failed is scheduled again.
+        """
+        with self._lock:
+            tree = self.trees.get(doc_id)
+            job = self._jobs.get(doc_id)
+            complete = doc_id in self.complete_documents
+        if tree is not None:
+            return tree
+        if job is not None:
+            if not job.done():
+                return None
+            try:
+                return job.result()
+            except CancelledError:
+                # the document was deleted while its tree was being built
+                return None
+        if complete:
+            self.schedule([doc_id])
+        return None
+
+    def _select_documents(self, doc_ids: Optional[Collection[str]], filters: Optional[MetadataFilters]) -> List[str]:
+        with self._lock:
+            if filters is None and doc_ids is None:
+                return list(self.document_chunks)
+            candidates = set(self.document_chunks if doc_ids is None else doc_ids)
+            if filters is not None:
+                matched = {self._chunk_documents[node_id] for node_id in self._metadata.match(filters)}
+                candidates.intersection_update(matched)
+            # in upload order, like without a restriction
+            return [doc_id for doc_id in self.document_chunks if doc_id in candidates]
+
+    def _summaries(self, doc_ids: List[str]) -> Tuple[List[NodeWithScore], List[str]]:
+        """
+        The summary nodes of the documents whose tree is ready, and the ids of the other documents.
+        """
+        trees = []
+        pending = []
+        for doc_id in doc_ids:
+            tree = self.get_tree(doc_id)
+            if tree is None:
+                pending.append(doc_id)
+            else:
+                trees.append(tree)
+        nodes = [NodeWithScore(node=tree.root, score=1.0) for tree in trees]
+        sections = [NodeWithScore(node=node, score=0.5) for tree in trees for node in tree.top_sections]
+        return (nodes + sections)[:self.max_nodes], pending
+
+    def retrieve_documents(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        """
+        Summaries of the given documents only, all documents if doc_ids is None.
+        With filters, only the documents having a chunk that matches them are summarized.
+        """
+        summaries, pending = self._summaries(self._select_documents(doc_ids, filters))
+        if pending and self.fallback is not None:
+            logger.debug(f"Summary trees of {len(pending)} documents are not ready, using the fallback retriever")
+            summaries += self.fallback.retrieve_documents(query_bundle, pending, filters)
+        return summaries
+
+    async def aretrieve_documents(
+            self,
+            query_bundle: QueryBundle,
+            doc_ids: Optional[Collection[str]],
+            filters: Optional[MetadataFilters] = None
+    ) -> List[NodeWithScore]:
+        summaries, pending = self._summaries(self._select_documents(doc_ids, filters))
+        if pending and self.fallback is not None:
+            logger.debug(f"Summary trees of {len(pending)} documents are not ready, using the fallback retriever")
+            summaries += await self.fallback.aretrieve_documents(query_bundle, pending, filters)
+        return summaries
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.retrieve_documents(query_bundle, None)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return await self.aretrieve_documents(query_bundle, None)
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+
+class ServerBusyError(Exception):
+    """
+    Raised when a request can not get a generation slot in time.
+    """
+
+
+class GenerationLimiter:
+    """
+    Caps the number of concurrent LLM generations. Up to max_waiting requests
+    wait for a slot, for at most wait_timeout seconds; further requests are
+    rejected immediately with ServerBusyError instead of piling up on the LLM.
+
+    Background generations, e.g. summary builds on worker threads, take a
+    background_slot instead, which is only handed out while no request is
+    generating or waiting.
+    """
+    def __init__(self, max_concurrent: int = 2, max_waiting: int = 16, wait_timeout: Optional[float] = 30):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.background = 0
+        # notified when the requests go idle, background generations wait on it
+        self._idle = threading.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ServerBusyError(f"{self.waiting} requests are already waiting for a generation slot.")
+        acquired = False
+        self._change(waiting=1)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_timeout)
+            acquired = True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ServerBusyError(f"No generation slot freed up within {self.wait_timeout}s.")
+        finally:
+            # from waiting to active in one step, so a background generation never sees a gap
+            self._change(waiting=-1, active=int(acquired))
+        try:
+            yield
+        finally:
+            self.completed += 1
+            self._semaphore.release()
+            self._change(active=-1)
+
+    def _change(self, waiting: int = 0, active: int = 0):
+        with self._idle:
+            self.waiting += waiting
+            self.active += active
+            if self.waiting == 0 and self.active == 0:
+                self._idle.notify_all()
+
+    @contextmanager
+    def background_slot(self) -> Iterator[None]:
+        """
+        Block the calling thread until no request is generating or waiting, and no other
+        background generation runs. Requests do not wait for background generations,
+        at most one is ahead of them on the LLM.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: self.active == 0 and self.waiting == 0 and self.background == 0)
+            self.background += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self.background -= 1
+                self._idle.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "background": self.background,
+        }
+
+
+async def iterate_tokens(response) -> AsyncIterator[str]:
+    """
+    Tokens of a streaming chat response. Closing the iterator, e.g. when the
+    client disconnects, closes the underlying LLM stream instead of letting
+    the generation run to the end.
+    """
+    tokens = response.async_response_gen()
+    try:
+        async for token in tokens:
+            yield token
+    finally:
+        await tokens.aclose()
+        stream = getattr(response, "achat_stream", None)
+        if stream is not None:
+            await stream.aclose()
+
+
+async def coalesce_tokens(tokens: AsyncIterator[str], interval: float = 0.05, max_tokens: int = 16) -> AsyncIterator[str]:
+    """
+    Join streamed tokens into chunks, so a UI is updated every interval seconds
+    or every max_tokens tokens instead of once per token. The first token is
+    passed on right away to keep the time to first token, and buffered tokens
+    are flushed when the next token arrives or the stream ends.
+    interval=0 and max_tokens=1 pass every token on by itself.
+    """
+    buffer = []
+    last_flush = None
+    async for token in tokens:
+        buffer.append(token)
+        now = time.monotonic()
+        if last_flush is None or len(buffer) >= max_tokens or now - last_flush >= interval:
+            yield "".join(buffer)
+            buffer.clear()
+            last_flush = now
+    if buffer:
+        yield "".join(buffer)
+
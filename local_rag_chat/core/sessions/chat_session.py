@@ -0,0 +1,26 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+from llama_index.core.chat_engine.types import BaseChatEngine
+from llama_index.core.llms import LLM
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from local_rag_chat.core.chat_engine.chat_engine_manager import ChatEngineManager
+
+
+@dataclass
+class ChatSession:
+    """
+    State of one user: the LLM, the documents it uploaded and its conversation.
+    The indexes and the embedding model are shared by all sessions.
+    """
+    session_id: str
+    llm_name: str
+    llm: LLM
+    memory: ChatMemoryBuffer
+    doc_ids: set[str] = field(default_factory=set)
+    # restricts retrieval to the matching chunks, e.g. one file or a page range
+    filters: Optional[MetadataFilters] = None
+    chat_engine_manager: Optional[ChatEngineManager] = None
+    chat_engine: Optional[BaseChatEngine] = None
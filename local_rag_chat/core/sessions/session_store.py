@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Optional, TypeVar
+
+from local_rag_chat.logs.logging_config import logger
+
+T = TypeVar("T")
+
+
+class SessionStore(Generic[T]):
+    """
+    Per-user session objects keyed by session id. Sessions idle for longer than
+    idle_ttl seconds are evicted, and the least recently used ones are evicted
+    beyond max_sessions; on_evict is called with every evicted session.
+    """
+    def __init__(
+            self,
+            factory: Callable[[str], T],
+            max_sessions: int = 64,
+            idle_ttl: Optional[float] = 3600,
+            on_evict: Optional[Callable[[T], None]] = None
+    ):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self._sessions: OrderedDict[str, T] = OrderedDict()
+        self._last_access: dict[str, float] = {}
+        self._lock = threading.RLock()
+        self.evictions = 0
+
+    @property
+    def num_sessions(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> T:
+        """
+        The session with the given id, created on first use.
+        """
+        self.evict_idle()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                logger.info(f"Creating session {session_id}")
+                session = self.factory(session_id)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = time.monotonic()
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._pop(next(iter(self._sessions))))
+        self._evicted(evicted)
+        return session
+
+    def _pop(self, session_id: str) -> T:
+        self._last_access.pop(session_id, None)
+        return self._sessions.pop(session_id)
+
+    def _evicted(self, sessions: list):
+        for session in sessions:
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(session)
+
+    def evict_idle(self):
+        if self.idle_ttl is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                session_id for session_id, last_access in self._last_access.items()
+                if now - last_access > self.idle_ttl
+            ]
+            evicted = [self._pop(session_id) for session_id in idle]
+        if evicted:
+            logger.info(f"Evicting {len(evicted)} idle sessions")
+        self._evicted(evicted)
+
+    def remove(self, session_id: str):
+        with self._lock:
+            evicted = [self._pop(session_id)] if session_id in self._sessions else []
+        self._evicted(evicted)
@@ -0,0 +1,68 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+COMPRESSIONS = ("int8", "binary")
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class VectorQuantizer:
+    """
+    Compressed codes of L2-normalized vectors, scored in a coarse first pass
+    whose shortlist is rescored with the full-precision vectors.
+
+    "int8" scales the components of every vector to [-127, 127] by its largest
+    one, with a float32 scale per row so vectors added later are never clipped;
+    about 4x smaller than float32.
+    "binary" keeps the sign bit of every component, 32x smaller than float32,
+    and scores rows by their Hamming distance to the query's sign bits.
+    """
+    def __init__(self, compression: str):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression: {compression}, must be one of {COMPRESSIONS}")
+        self.compression = compression
+
+    @property
+    def dtype(self):
+        return np.uint8 if self.compression == "binary" else np.int8
+
+    def width(self, dim: int) -> int:
+        return (dim + 7) // 8 if self.compression == "binary" else dim
+
+    @property
+    def has_scales(self) -> bool:
+        return self.compression == "int8"
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        The codes of the vectors and, for int8, the scale of every row.
+        """
+        if self.compression == "binary":
+            return np.packbits(vectors > 0, axis=1), None
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12).astype(np.float32) / 127
+        return np.rint(vectors / scales[:, None]).astype(np.int8), scales
+
+    def scores(
+            self,
+            codes: np.ndarray,
+            query: np.ndarray,
+            scales: Optional[np.ndarray] = None,
+            block_size: int = 16384
+    ) -> np.ndarray:
+        """
+        Approximate similarities of the query to every row of codes, only their order is meaningful.
+        Rows are scored in blocks so the float32 copy of the codes stays small.
+
+        :param scales: the row scales returned by encode, for int8 codes
+        """
+        scores = np.empty(len(codes), dtype=np.float32)
+        if self.compression == "binary":
+            query_bits = np.packbits(query > 0)
+        for start in range(0, len(codes), block_size):
+            block = codes[start:start + block_size]
+            if self.compression == "binary":
+                scores[start:start + len(block)] = -_POPCOUNT[block ^ query_bits].sum(axis=1, dtype=np.int32)
+            else:
+                scores[start:start + len(block)] = (block.astype(np.float32) @ query) * scales[start:start + len(block)]
+        return scores
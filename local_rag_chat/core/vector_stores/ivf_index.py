@@ -0,0 +1,95 @@
+from typing import List, Optional
+
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Inverted file index over L2-normalized vectors. A spherical k-means coarse
+    quantizer splits the rows into nlist lists; a query only scores the rows of
+    the nprobe lists whose centroids are closest to it. Higher nprobe trades
+    latency for recall, nprobe == nlist is an exact search.
+    """
+    def __init__(
+            self,
+            nlist: Optional[int] = None,
+            nprobe: int = 8,
+            train_iters: int = 8,
+            max_train_points: int = 32,
+            seed: int = 0
+    ):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self._lists: List[List[np.ndarray]] = []
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _assign(self, vectors: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        # batched so the (n, nlist) score matrix stays small
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch_size):
+            batch = vectors[start:start + batch_size]
+            assignments[start:start + batch_size] = np.argmax(batch @ self.centroids.T, axis=1)
+        return assignments
+
+    def train(self, vectors: np.ndarray):
+        """
+        Fit the centroids on a sample of the vectors and assign every vector to a list.
+        """
+        n = len(vectors)
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(n, nlist * self.max_train_points)
+        sample = vectors[rng.choice(n, size=sample_size, replace=False)]
+
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            self.centroids = centroids
+            assignments = self._assign(sample)
+            order = np.argsort(assignments, kind="stable")
+            lists, starts = np.unique(assignments[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[lists] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = ~sums.any(axis=1)
+            # re-seed empty lists with random sample points
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            norms = np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+            centroids = (sums / norms).astype(np.float32)
+        self.centroids = centroids
+
+        self._lists = [[] for _ in range(nlist)]
+        self.add(np.arange(n), vectors)
+        self.trained_size = n
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        assignments = self._assign(vectors)
+        order = np.argsort(assignments, kind="stable")
+        lists, starts = np.unique(assignments[order], return_index=True)
+        for list_id, chunk in zip(lists, np.split(rows[order], starts[1:])):
+            self._lists[list_id].append(chunk)
+
+    def _list_rows(self, list_id: int) -> np.ndarray:
+        chunks = self._lists[list_id]
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        if len(chunks) > 1:
+            # merge appended chunks lazily, the first time the list is probed
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        Rows stored in the nprobe lists closest to the query.
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self._list_rows(list_id) for list_id in probe])
@@ -0,0 +1,130 @@
+import re
+from typing import Any, Dict, Iterable, Set
+
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+
+FILTERABLE_TYPES = (str, int, float, bool)
+# ids and hashes made of digits are longer and stay strings
+NUMBER_PATTERN = re.compile(r"-?\d{1,12}(\.\d+)?")
+RANGE_OPERATORS = {
+    FilterOperator.GT: lambda a, b: a > b,
+    FilterOperator.GTE: lambda a, b: a >= b,
+    FilterOperator.LT: lambda a, b: a < b,
+    FilterOperator.LTE: lambda a, b: a <= b,
+}
+
+
+def _normalize(value: Any):
+    """
+    Numbers and short numeric strings compare as numbers, so a "page_label" of "12" matches 12 and sorts after 9.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value)
+    return float(value) if NUMBER_PATTERN.fullmatch(value) else value
+
+
+def _in_range(value, operator: FilterOperator, target) -> bool:
+    # numbers and strings are not ordered against each other
+    if isinstance(value, float) != isinstance(target, float):
+        return False
+    return RANGE_OPERATORS[operator](value, target)
+
+
+class MetadataIndex:
+    """
+    Posting lists from every (key, value) pair of node metadata to the ids of
+    the nodes having it. A MetadataFilters is resolved to the set of matching
+    node ids before any scoring, in time proportional to the postings it reads,
+    so a query restricted to one file or a few pages only scores those nodes.
+
+    Only str, int, float and bool values are indexed. Supported operators are
+    ==, !=, >, >=, <, <=, in and nin; != and nin read the ids of every node.
+    """
+    def __init__(self):
+        self._postings: Dict[str, Dict[Any, Set[str]]] = {}
+        self._items: Dict[str, Dict[str, Any]] = {}
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._items
+
+    def add(self, node_id: str, metadata: Dict[str, Any]):
+        self.remove(node_id)
+        item = {key: _normalize(value) for key, value in metadata.items() if isinstance(value, FILTERABLE_TYPES)}
+        self._items[node_id] = item
+        for key, value in item.items():
+            self._postings.setdefault(key, {}).setdefault(value, set()).add(node_id)
+
+    def remove(self, node_id: str):
+        item = self._items.pop(node_id, None)
+        if item is None:
+            return
+        for key, value in item.items():
+            values = self._postings[key]
+            values[value].discard(node_id)
+            if not values[value]:
+                del values[value]
+
+    def lookup(self, key: str, values: Iterable[Any]) -> Set[str]:
+        """
+        Ids of the nodes whose key is one of the values.
+        """
+        postings = self._postings.get(key, {})
+        ids = set()
+        for value in values:
+            ids.update(postings.get(_normalize(value), ()))
+        return ids
+
+    def _match_filter(self, metadata_filter: MetadataFilter) -> Set[str]:
+        operator = metadata_filter.operator
+        value = metadata_filter.value
+        if operator == FilterOperator.EQ:
+            return self.lookup(metadata_filter.key, [value])
+        if operator == FilterOperator.NE:
+            return self._items.keys() - self.lookup(metadata_filter.key, [value])
+        if operator == FilterOperator.IN:
+            return self.lookup(metadata_filter.key, value)
+        if operator == FilterOperator.NIN:
+            return self._items.keys() - self.lookup(metadata_filter.key, value)
+        if operator in RANGE_OPERATORS:
+            target = _normalize(value)
+            ids = set()
+            for candidate, node_ids in self._postings.get(metadata_filter.key, {}).items():
+                if _in_range(candidate, operator, target):
+                    ids.update(node_ids)
+            return ids
+        raise ValueError(f"Unsupported metadata filter operator: {operator}")
+
+    def match(self, filters: MetadataFilters) -> Set[str]:
+        """
+        Ids of the nodes matching the filters.
+        """
+        matches = [
+            self.match(f) if isinstance(f, MetadataFilters) else self._match_filter(f)
+            for f in filters.filters
+        ]
+        if not matches:
+            return set(self._items)
+        if filters.condition == FilterCondition.OR:
+            return set().union(*matches)
+        # intersecting from the smallest set keeps the work proportional to it
+        matches.sort(key=len)
+        return set(matches[0]).intersection(*matches[1:])
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._items)
+
+    @classmethod
+    def from_dict(cls, items: Dict[str, Dict[str, Any]]) -> "MetadataIndex":
+        index = cls()
+        for node_id, metadata in items.items():
+            index.add(node_id, metadata)
+        return index
+
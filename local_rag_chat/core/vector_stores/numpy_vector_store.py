@@ -0,0 +1,466 @@
+import json
+import os
+import tempfile
+import threading
+import weakref
+from typing import Any, List, Optional, Sequence
+
+import fsspec
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.storage_context import DEFAULT_PERSIST_DIR
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from local_rag_chat.core.vector_stores.compression import VectorQuantizer
+from local_rag_chat.core.vector_stores.ivf_index import IVFIndex
+from local_rag_chat.core.vector_stores.metadata_index import MetadataIndex
+
+DEFAULT_PERSIST_FNAME = "default__vector_store.json"
+DEFAULT_RESCORE_FACTORS = {"int8": 4, "binary": 16}
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_rows(path: str, matrix: np.ndarray, rows: np.ndarray, block_size: int = 65536):
+    """
+    Write the given rows of matrix to a raw float32 file, in blocks so a memory-mapped matrix is never fully read.
+    """
+    with open(path, "wb") as f:
+        for start in range(0, len(rows), block_size):
+            f.write(np.ascontiguousarray(matrix[rows[start:start + block_size]], dtype=np.float32).tobytes())
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    In-memory vector store keeping L2-normalized embeddings in one contiguous
+    float32 matrix. A query scores every row with a single matrix-vector product
+    and selects the top k with argpartition. Vectors are persisted as a raw
+    float32 file that is memory-mapped back on load.
+
+    With index_type="ivf" and at least ivf_min_vectors rows, queries only score
+    the rows of the nprobe closest IVF lists instead of the whole matrix.
+
+    With compression="int8" or "binary", only compressed codes are kept in memory
+    and the float32 vectors live in a memory-mapped file under vectors_dir. A query
+    scores the codes, then rescores the top rescore_factor * k rows with the
+    float32 vectors read from disk.
+
+    Metadata filters, doc ids and node ids are resolved to rows through posting
+    lists of the node metadata before scoring, so a filtered query only scores
+    the matching rows. The ref doc id of a node is indexed as "ref_doc_id".
+    """
+    stores_text: bool = False
+    index_type: str = "flat"
+    nlist: Optional[int] = None
+    nprobe: int = 8
+    ivf_min_vectors: int = 10_000
+    compression: Optional[str] = None
+    rescore_factor: Optional[int] = None
+    vectors_dir: Optional[str] = None
+
+    _matrix: np.ndarray = PrivateAttr()
+    _alive: np.ndarray = PrivateAttr()
+    _size: int = PrivateAttr(default=0)
+    _ids: List[str] = PrivateAttr()
+    _ref_doc_ids: List[Optional[str]] = PrivateAttr()
+    _rows: dict = PrivateAttr()
+    _metadata: MetadataIndex = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _ivf: Optional[IVFIndex] = PrivateAttr(default=None)
+    _quantizer: Optional[VectorQuantizer] = PrivateAttr(default=None)
+    _codes: np.ndarray = PrivateAttr()
+    # int8 row scales, None for the other compressions
+    _scales: Optional[np.ndarray] = PrivateAttr(default=None)
+    _vectors_file: Optional[str] = PrivateAttr(default=None)
+    _vectors_cleanup: Optional[weakref.finalize] = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if self.index_type not in ("flat", "ivf"):
+            raise ValueError(f"Unsupported index type: {self.index_type}")
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._release_vectors_file()
+        self._quantizer = VectorQuantizer(self.compression) if self.compression else None
+        self._codes = np.empty((0, 0), dtype=np.int8)
+        self._scales = None
+        if self._quantizer is not None and self._quantizer.has_scales:
+            self._scales = np.empty(0, dtype=np.float32)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._ids = []
+        self._ref_doc_ids = []
+        self._rows = {}
+        self._metadata = MetadataIndex()
+        self._ivf = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._matrix.shape[1] if self._matrix.shape[1] else None
+
+    @property
+    def num_vectors(self) -> int:
+        return len(self._rows)
+
+    @property
+    def node_ids(self) -> List[str]:
+        return list(self._rows)
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Bytes of vector data held in memory, memory-mapped vectors are not counted.
+        """
+        if self._quantizer is not None:
+            scales = self._scales[:self._size].nbytes if self._scales is not None else 0
+            return self._codes[:self._size].nbytes + scales
+        return 0 if isinstance(self._matrix, np.memmap) else self._matrix[:self._size].nbytes
+
+    def _release_vectors_file(self):
+        if self._vectors_cleanup is not None:
+            self._vectors_cleanup()
+        self._vectors_file = None
+        self._vectors_cleanup = None
+
+    def _new_vectors_file(self, rows: np.ndarray) -> str:
+        """
+        Private float32 file of a compressed store, filled with the given rows of the current matrix.
+        The file is removed once it is replaced or the store is garbage collected. Must hold the lock.
+        """
+        if self.vectors_dir:
+            os.makedirs(self.vectors_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".f32", dir=self.vectors_dir)
+        os.close(fd)
+        _write_rows(path, self._matrix, rows)
+        # mappings of the old file held by running queries stay valid after its removal
+        self._release_vectors_file()
+        self._vectors_file = path
+        self._vectors_cleanup = weakref.finalize(self, _remove_file, path)
+        return path
+
+    def _map_vectors(self, path: str, rows: int, dim: int):
+        self._matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim)) if rows else \
+            np.empty((0, dim), dtype=np.float32)
+
+    def _append_vectors(self, start: int, vectors: np.ndarray):
+        """
+        Append float32 vectors to the on-disk file of a compressed store. Must hold the lock.
+        """
+        # the first append copies a persisted file instead of writing to it
+        path = self._vectors_file or self._new_vectors_file(np.arange(start))
+        with open(path, "r+b") as f:
+            f.seek(start * vectors.shape[1] * 4)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._map_vectors(path, start + len(vectors), vectors.shape[1])
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _reserve(self, rows: int, dim: int):
+        """
+        Grow the matrix geometrically so appends are amortized O(1).
+        A memory-mapped matrix is copied into memory on the first append.
+        """
+        if self.dim is not None and dim != self.dim:
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {self.dim}.")
+        needed = self._size + rows
+        if self._quantizer is not None:
+            # the float32 vectors are appended to their file, only the codes are kept in memory
+            if needed <= self._codes.shape[0]:
+                return
+            capacity = max(needed, 2 * self._codes.shape[0], 1024)
+            codes = np.empty((capacity, self._quantizer.width(dim)), dtype=self._quantizer.dtype)
+            if self._size:
+                codes[:self._size] = self._codes[:self._size]
+            self._codes = codes
+            if self._scales is not None:
+                scales = np.empty(capacity, dtype=np.float32)
+                scales[:self._size] = self._scales[:self._size]
+                self._scales = scales
+        else:
+            if needed <= self._matrix.shape[0] and not isinstance(self._matrix, np.memmap):
+                return
+            capacity = max(needed, 2 * self._matrix.shape[0], 1024)
+            matrix = np.empty((capacity, dim), dtype=np.float32)
+            if self._size:
+                matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._alive = alive
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = self._normalize(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        with self._lock:
+            self._delete_rows([self._rows[node.node_id] for node in nodes if node.node_id in self._rows])
+            self._reserve(len(nodes), vectors.shape[1])
+            start = self._size
+            if self._quantizer is not None:
+                codes, scales = self._quantizer.encode(vectors)
+                self._codes[start:start + len(nodes)] = codes
+                if scales is not None:
+                    self._scales[start:start + len(nodes)] = scales
+                self._append_vectors(start, vectors)
+            else:
+                self._matrix[start:start + len(nodes)] = vectors
+            self._alive[start:start + len(nodes)] = True
+            for offset, node in enumerate(nodes):
+                self._rows[node.node_id] = start + offset
+                self._ids.append(node.node_id)
+                self._ref_doc_ids.append(node.ref_doc_id)
+                self._metadata.add(node.node_id, {**node.metadata, "ref_doc_id": node.ref_doc_id})
+            self._size += len(nodes)
+            if self._ivf is not None:
+                self._ivf.add(np.arange(start, self._size), vectors)
+        return [node.node_id for node in nodes]
+
+    def get(self, node_id: str) -> List[float]:
+        return self._matrix[self._rows[node_id]].tolist()
+
+    def _delete_rows(self, rows: List[int]):
+        for row in rows:
+            self._alive[row] = False
+            self._rows.pop(self._ids[row], None)
+            self._metadata.remove(self._ids[row])
+        # compact once more than half of the rows are deleted
+        if self._size > 1024 and len(self._rows) < self._size // 2:
+            self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        if self._quantizer is not None:
+            self._codes = np.ascontiguousarray(self._codes[keep])
+            if self._scales is not None:
+                self._scales = self._scales[keep]
+            dim = self._matrix.shape[1]
+            self._map_vectors(self._new_vectors_file(keep), len(keep), dim)
+        else:
+            self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._ids = [self._ids[row] for row in keep]
+        self._ref_doc_ids = [self._ref_doc_ids[row] for row in keep]
+        self._rows = {node_id: row for row, node_id in enumerate(self._ids)}
+        self._size = len(keep)
+        # rows were renumbered, the IVF lists are rebuilt on the next query
+        self._ivf = None
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            self._delete_rows([self._rows[node_id] for node_id in self._metadata.lookup("ref_doc_id", [ref_doc_id])])
+
+    def delete_nodes(
+            self,
+            node_ids: Optional[List[str]] = None,
+            filters: Optional[MetadataFilters] = None,
+            **delete_kwargs: Any
+    ) -> None:
+        """
+        Delete the given nodes, or the nodes matching the filters, or the given nodes matching the filters.
+        """
+        with self._lock:
+            ids = set(node_ids) if node_ids is not None else None
+            if filters is not None:
+                matched = self._metadata.match(filters)
+                ids = matched if ids is None else ids & matched
+            self._delete_rows([self._rows[node_id] for node_id in ids or () if node_id in self._rows])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _restricted_rows(self, query: VectorStoreQuery) -> Optional[np.ndarray]:
+        """
+        Sorted rows allowed by the query's filters, doc ids and node ids, None if it has none.
+        Must hold the lock.
+        """
+        restrictions = []
+        if query.filters is not None:
+            restrictions.append(self._metadata.match(query.filters))
+        if query.doc_ids is not None:
+            restrictions.append(self._metadata.lookup("ref_doc_id", query.doc_ids))
+        if query.node_ids is not None:
+            restrictions.append(set(query.node_ids))
+        if not restrictions:
+            return None
+        restrictions.sort(key=len)
+        node_ids = restrictions[0].intersection(*restrictions[1:])
+        row_of = self._rows
+        rows = np.fromiter((row_of[node_id] for node_id in node_ids if node_id in row_of), np.int64)
+        rows.sort()
+        return rows
+
+    def _ivf_candidates(self, query_vector: np.ndarray, nprobe: Optional[int]) -> Optional[np.ndarray]:
+        """
+        Rows to score for an IVF query, None to scan the whole matrix. Must hold the lock.
+        """
+        if self.index_type != "ivf" or self._size < self.ivf_min_vectors:
+            return None
+        # (re)train once the store has doubled since the last training
+        if self._ivf is None or self._size > 2 * self._ivf.trained_size:
+            self._ivf = IVFIndex(nlist=self.nlist, nprobe=self.nprobe)
+            self._ivf.train(self._matrix[:self._size])
+        return self._ivf.candidates(query_vector, nprobe)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        Query the store, an nprobe keyword overrides the store's nprobe for IVF queries.
+        """
+        if query.query_embedding is None:
+            raise ValueError("NumpyVectorStore requires a query embedding.")
+        query_vector = self._normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        with self._lock:
+            # the arrays are only replaced, never shrunk in place, so this snapshot stays consistent
+            size = self._size
+            matrix = self._matrix[:size]
+            alive = self._alive[:size].copy()
+            ids = self._ids[:size]
+            codes = self._codes[:size]
+            scales = self._scales[:size] if self._scales is not None else None
+            allowed = self._restricted_rows(query)
+            rows = self._ivf_candidates(query_vector, kwargs.get("nprobe"))
+        if size == 0:
+            return VectorStoreQueryResult(ids=[], similarities=[])
+
+        if allowed is not None:
+            allowed = allowed[allowed < size]
+            allowed = allowed[alive[allowed]]
+        if rows is None:
+            if allowed is not None:
+                rows = allowed
+            elif not alive.all():
+                rows = np.flatnonzero(alive)
+        else:
+            rows = rows[rows < size]
+            if allowed is None:
+                rows = rows[alive[rows]]
+            elif len(allowed) <= len(rows):
+                # scoring every allowed row is exact and no more work than the probed lists
+                rows = allowed
+            else:
+                rows = np.intersect1d(rows, allowed)
+        if self._quantizer is not None:
+            rows = self._shortlist(codes, scales, rows, query_vector, query.similarity_top_k)
+        scores = matrix @ query_vector if rows is None else matrix[rows] @ query_vector
+
+        top_k = min(query.similarity_top_k, len(scores))
+        if top_k <= 0:
+            return VectorStoreQueryResult(ids=[], similarities=[])
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        top_rows = top if rows is None else rows[top]
+        return VectorStoreQueryResult(
+            ids=[ids[row] for row in top_rows],
+            similarities=scores[top].tolist()
+        )
+
+    def _shortlist(
+            self,
+            codes: np.ndarray,
+            scales: Optional[np.ndarray],
+            rows: Optional[np.ndarray],
+            query_vector: np.ndarray,
+            top_k: int
+    ) -> np.ndarray:
+        """
+        Rows of the best compressed scores, to be rescored with their float32 vectors.
+        """
+        if rows is not None:
+            codes = codes[rows]
+            scales = scales[rows] if scales is not None else None
+        coarse = self._quantizer.scores(codes, query_vector, scales)
+        factor = self.rescore_factor or DEFAULT_RESCORE_FACTORS[self.compression]
+        shortlist_size = min(len(coarse), max(top_k, 1) * factor)
+        if shortlist_size == 0:
+            return np.empty(0, dtype=np.int64)
+        shortlist = np.argpartition(-coarse, shortlist_size - 1)[:shortlist_size]
+        if rows is not None:
+            shortlist = rows[shortlist]
+        # sorted rows read the memory-mapped vectors front to back
+        return np.sort(shortlist)
+
+    @staticmethod
+    def _vectors_path(persist_path: str) -> str:
+        return os.path.splitext(persist_path)[0] + ".f32"
+
+    def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+        """
+        Write the live vectors to a raw float32 file next to persist_path and the row ids to persist_path.
+        """
+        with self._lock:
+            keep = np.flatnonzero(self._alive[:self._size])
+            dirpath = os.path.dirname(persist_path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+            dim = self.dim or 0
+            if len(keep):
+                # written aside and renamed, the matrix may be a memory map of the file being replaced
+                vectors_path = self._vectors_path(persist_path)
+                _write_rows(vectors_path + ".tmp", self._matrix, keep)
+                os.replace(vectors_path + ".tmp", vectors_path)
+            with open(persist_path, "w") as f:
+                json.dump({
+                    "dim": dim,
+                    "ids": [self._ids[row] for row in keep],
+                    "ref_doc_ids": [self._ref_doc_ids[row] for row in keep],
+                    "metadata": self._metadata.to_dict(),
+                }, f)
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(**kwargs)
+        if not os.path.exists(persist_path):
+            return store
+        with open(persist_path, "r") as f:
+            data = json.load(f)
+        size = len(data["ids"])
+        if size:
+            store._matrix = np.memmap(cls._vectors_path(persist_path), dtype=np.float32, mode="r", shape=(size, data["dim"]))
+            if store._quantizer is not None:
+                encoded = [
+                    store._quantizer.encode(np.asarray(store._matrix[start:start + 65536]))
+                    for start in range(0, size, 65536)
+                ]
+                store._codes = np.concatenate([codes for codes, _ in encoded])
+                if store._scales is not None:
+                    store._scales = np.concatenate([scales for _, scales in encoded])
+        store._alive = np.ones(size, dtype=bool)
+        store._size = size
+        store._ids = data["ids"]
+        store._ref_doc_ids = data["ref_doc_ids"]
+        store._rows = {node_id: row for row, node_id in enumerate(store._ids)}
+        # stores persisted without metadata only support doc id restrictions
+        metadata = data.get("metadata") or {
+            node_id: {"ref_doc_id": ref_doc_id} for node_id, ref_doc_id in zip(store._ids, store._ref_doc_ids)
+        }
+        store._metadata = MetadataIndex.from_dict(metadata)
+        return store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str = DEFAULT_PERSIST_DIR, **kwargs: Any) -> "NumpyVectorStore":
+        return cls.from_persist_path(os.path.join(persist_dir, DEFAULT_PERSIST_FNAME), **kwargs)
@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import asyncio
 from local_rag_chat.core.llms.ollama import OllamaModel
@@ -5,15 +6,18 @@ from local_rag_chat.core.llms.openai import OpenAIModel
 from local_rag_chat.core.loaders.simple_loader import SimpleLoader
 from local_rag_chat.core.embeddings.embedding_manager import EmbeddingManager
 from local_rag_chat.core.retrievers.hybrid_retriever import HybridRetriever
+from local_rag_chat.eval.response_eval import ResponseEvalRunner
 from llama_index.core.evaluation import (
     generate_question_context_pairs,
     EmbeddingQAFinetuneDataset,
     FaithfulnessEvaluator
 )
 from llama_index.core.evaluation import RetrieverEvaluator
-from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core import Settings, VectorStoreIndex, get_response_synthesizer
 import argparse
+from typing import Optional
 from local_rag_chat.logs.logging_config import logger
+from configs import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ENTRIES
 
 def display_results(name, eval_results)-> pd.DataFrame:
     """Display results from evaluate."""
@@ -43,21 +47,39 @@ class RagEvalPipeline:
                  llm: str = "llama3.2",
                  chunk_size: int = 512,
                  chunk_overlap: int = 100,
-                 top_k: int = 5
+                 top_k: int = 5,
+                 embedding_cache_dir: Optional[str] = EMBEDDING_CACHE_DIR,
+                 output_dir: str = "eval_results",
+                 eval_cache_dir: Optional[str] = "storage/eval_cache",
+                 max_concurrency: int = 4
     ):
         self.top_k = top_k
+        self.eval_model = eval_model
+        self.llm_name = llm
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.output_dir = output_dir
+        self.eval_cache_dir = eval_cache_dir
+        self.max_concurrency = max_concurrency
         # dataset
         loader = SimpleLoader(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
         self.nodes = loader.fit(dataset_path)
         self.qa_dataset = EmbeddingQAFinetuneDataset.from_json(qa_dataset_path)
 
         # retriever
-        self.embed_model = EmbeddingManager(model='BAAI/bge-small-en-v1.5').get_embedding()
+        self.embed_model = EmbeddingManager(
+            model='BAAI/bge-small-en-v1.5',
+            cache_dir=embedding_cache_dir,
+            cache_max_entries=EMBEDDING_CACHE_MAX_ENTRIES
+        ).get_embedding()
         Settings.embed_model = self.embed_model
 
         # llm
         self.gpt4 = OpenAIModel(model=eval_model).get_llm()
-        self.llm = OllamaModel(model=llm).get_llm()
+        ollama_model = OllamaModel(model=llm)
+        for message in ollama_model.warm_up():
+            logger.info(message)
+        self.llm = ollama_model.get_llm()
         Settings.llm = self.llm
 
     async def retrieval_evaluator(self) -> pd.DataFrame:
@@ -75,19 +97,27 @@ class RagEvalPipeline:
         """
         Evaluate the responses from the llm
         Only use FaithfulnessEvaluator for now
-        :return:
+        Finished queries are checkpointed, an interrupted run resumes where it stopped.
+        :return: number of passing responses, number of evaluated queries, number of failed queries
         """
         vector_index = VectorStoreIndex(self.nodes)
-        query_engine = vector_index.as_query_engine()
-        queries = list(self.qa_dataset.queries.values())
-
-        coroutines = [query_engine.aquery(q) for q in queries]
-        results = await asyncio.gather(*coroutines, return_exceptions=True)
-        print("finished query")
-
-        evaluator = FaithfulnessEvaluator(llm=self.gpt4)
-        total_correct = sum(1 if evaluator.evaluate_response(response=r).passing else 0 for r in results)
-        return total_correct, len(results)
+        runner = ResponseEvalRunner(
+            retriever=vector_index.as_retriever(similarity_top_k=self.top_k),
+            synthesizer=get_response_synthesizer(llm=self.llm),
+            evaluator=FaithfulnessEvaluator(llm=self.gpt4),
+            checkpoint_path=os.path.join(
+                self.output_dir,
+                f"response_{self.llm_name}_{self.chunk_size}_{self.chunk_overlap}_{self.top_k}.jsonl"
+            ),
+            cache_dir=self.eval_cache_dir,
+            llm_name=self.llm_name,
+            judge_name=self.eval_model,
+            max_concurrency=self.max_concurrency
+        )
+        records = await runner.arun(self.qa_dataset.queries)
+        failed = sum(1 for r in records if r.error is not None)
+        total_correct = sum(1 for r in records if r.passing)
+        return total_correct, len(records) - failed, failed
 
     def generate_qa_dataset(self, output_path: str) -> None:
         qa_dataset = generate_question_context_pairs(
@@ -149,6 +179,41 @@ if __name__ == "__main__":
         default=5,
         help="Top k retrievals"
     )
+    parser.add_argument(
+        "--embedding_cache_dir",
+        type=str,
+        default=EMBEDDING_CACHE_DIR,
+        help="Directory of the on-disk embedding cache"
+    )
+    parser.add_argument(
+        "--no_embedding_cache",
+        action="store_true",
+        help="Always embed with the model instead of using the embedding cache"
+    )
+
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="eval_results",
+        help="Directory of the checkpoint files, a rerun with the same config resumes from them"
+    )
+    parser.add_argument(
+        "--eval_cache_dir",
+        type=str,
+        default="storage/eval_cache",
+        help="Directory of the generated answer and judgement caches"
+    )
+    parser.add_argument(
+        "--no_eval_cache",
+        action="store_true",
+        help="Always generate and judge instead of using the answer and judgement caches"
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=4,
+        help="Queries answered and judged concurrently"
+    )
 
     async def main(args):
         rag_eval = RagEvalPipeline(
@@ -157,7 +222,12 @@ if __name__ == "__main__":
             eval_model=args.eval_model,
             llm=args.llm,
             chunk_size=args.chunk_size,
-            chunk_overlap=args.chunk_overlap
+            chunk_overlap=args.chunk_overlap,
+            top_k=args.top_k,
+            embedding_cache_dir=None if args.no_embedding_cache else args.embedding_cache_dir,
+            output_dir=args.output_dir,
+            eval_cache_dir=None if args.no_eval_cache else args.eval_cache_dir,
+            max_concurrency=args.max_concurrency
         )
         logger.info("Starting evaluation")
         if args.eval_type != "response":
@@ -170,12 +240,12 @@ if __name__ == "__main__":
             )
 
         if args.eval_type != "retrieval":
-            correct, total = await rag_eval.response_evaluator()
+            correct, total, failed = await rag_eval.response_evaluator()
             print('Response Evaluation (Faithfulness):')
-            print(f"Correct: {correct}/{total}")
+            print(f"Correct: {correct}/{total}, failed: {failed}")
             # save results
-            with open(f"response_{args.llm}_{args.chunk_size}_{args.chunk_overlap}.txt", "w") as f:
-                f.write(f"Correct: {correct}/{total}")
+            with open(f"response_{args.llm}_{args.chunk_size}_{args.chunk_overlap}_{args.top_k}.txt", "w") as f:
+                f.write(f"Correct: {correct}/{total}, failed: {failed}")
 
     args = parser.parse_args()
     asyncio.run(main(args))
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.evaluation import BaseEvaluator
+from llama_index.core.response_synthesizers import BaseSynthesizer
+
+from local_rag_chat.logs.logging_config import logger
+
+
+class JsonlStore:
+    """
+    Append-only JSON lines file of records keyed by `key_field`, read back into
+    memory on open. A record written later overrides an earlier one with the same
+    key, and a truncated last line left by a crash is ignored.
+    """
+    def __init__(self, path: str, key_field: str = "key"):
+        self.path = path
+        self.key_field = key_field
+        self.records: Dict[str, dict] = {}
+        dirpath = os.path.dirname(path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.records[record[key_field]] = record
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.records.get(key)
+
+    def put(self, record: dict):
+        self.records[record[self.key_field]] = record
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+
+def cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class EvalRecord:
+    query_id: str
+    query: str
+    answer: Optional[str] = None
+    contexts: List[str] = field(default_factory=list)
+    passing: Optional[bool] = None
+    score: Optional[float] = None
+    feedback: Optional[str] = None
+    error: Optional[str] = None
+
+
+class ResponseEvalRunner:
+    """
+    Answers and judges the queries of a dataset with at most max_concurrency
+    queries in flight. Every finished query is appended to the checkpoint file,
+    so a rerun only processes the queries that are missing or failed.
+
+    Answers are cached by (llm, query, retrieved contexts) and judgements by
+    (judge, query, answer, contexts), so runs of a config sweep that retrieve
+    the same contexts for a query reuse its answer and judgement.
+    """
+    def __init__(
+            self,
+            retriever: BaseRetriever,
+            synthesizer: BaseSynthesizer,
+            evaluator: BaseEvaluator,
+            checkpoint_path: str,
+            cache_dir: Optional[str] = None,
+            llm_name: str = "",
+            judge_name: str = "",
+            max_concurrency: int = 4
+    ):
+        self.retriever = retriever
+        self.synthesizer = synthesizer
+        self.evaluator = evaluator
+        self.llm_name = llm_name
+        self.judge_name = judge_name
+        self.max_concurrency = max_concurrency
+        self.checkpoint = JsonlStore(checkpoint_path, key_field="query_id")
+        self.answers: Optional[JsonlStore] = None
+        self.judgements: Optional[JsonlStore] = None
+        if cache_dir is not None:
+            self.answers = JsonlStore(os.path.join(cache_dir, "answers.jsonl"))
+            self.judgements = JsonlStore(os.path.join(cache_dir, "judgements.jsonl"))
+
+    async def _answer(self, query: str, contexts: List[str], nodes) -> str:
+        key = cache_key(self.llm_name, query, contexts)
+        cached = self.answers.get(key) if self.answers is not None else None
+        if cached is not None:
+            return cached["answer"]
+        response = await self.synthesizer.asynthesize(query, nodes)
+        answer = str(response)
+        if self.answers is not None:
+            self.answers.put({"key": key, "answer": answer})
+        return answer
+
+    async def _judge(self, record: EvalRecord):
+        key = cache_key(self.judge_name, record.query, record.answer, record.contexts)
+        cached = self.judgements.get(key) if self.judgements is not None else None
+        if cached is None:
+            result = await self.evaluator.aevaluate(
+                query=record.query, response=record.answer, contexts=record.contexts
+            )
+            cached = {"key": key, "passing": result.passing, "score": result.score, "feedback": result.feedback}
+            if self.judgements is not None:
+                self.judgements.put(cached)
+        record.passing = cached["passing"]
+        record.score = cached["score"]
+        record.feedback = cached["feedback"]
+
+    async def _evaluate(self, query_id: str, query: str, semaphore: asyncio.Semaphore) -> EvalRecord:
+        record = EvalRecord(query_id=query_id, query=query)
+        async with semaphore:
+            try:
+                nodes = await self.retriever.aretrieve(query)
+                record.contexts = [node.node.get_content() for node in nodes]
+                record.answer = await self._answer(query, record.contexts, nodes)
+                await self._judge(record)
+            except Exception as e:
+                logger.warning(f"Evaluating query {query_id} failed: {e!r}")
+                record.error = repr(e)
+        self.checkpoint.put(asdict(record))
+        return record
+
+    async def arun(self, queries: Dict[str, str]) -> List[EvalRecord]:
+        """
+        Evaluate the queries, keyed by query id, and return the records of all of them.
+        """
+        done = {
+            query_id for query_id, record in self.checkpoint.records.items()
+            if record.get("error") is None and query_id in queries
+        }
+        if done:
+            logger.info(f"Resuming evaluation, {len(done)}/{len(queries)} queries already evaluated")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.gather(*[
+            self._evaluate(query_id, query, semaphore)
+            for query_id, query in queries.items() if query_id not in done
+        ])
+        return [EvalRecord(**self.checkpoint.records[query_id]) for query_id in queries]
@@ -0,0 +1,278 @@
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from local_rag_chat.logs.logging_config import logger
+from configs import METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    """
+    Prometheus histogram with one series per label value combination.
+    """
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # per bucket counts, then sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{self._labels(key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._labels(key, le)} {count}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+@dataclass
+class RequestTrace:
+    """
+    Timing spans of one chat request, logged together once the request ends.
+    """
+    kind: str
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    start: float = field(default_factory=time.perf_counter)
+    spans: List[Tuple[str, float]] = field(default_factory=list)
+
+    def summary(self) -> str:
+        spans = ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.spans)
+        return f"Request {self.request_id} ({self.kind}) took {(time.perf_counter() - self.start) * 1000:.1f}ms: {spans}"
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("rag_trace", default=None)
+
+
+class Metrics:
+    """
+    Per-stage timing spans and throughput histograms of the chat pipeline,
+    served in the Prometheus text format. When disabled every call returns
+    immediately, spans are a shared no-op context manager.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stage_seconds = Histogram(
+            "rag_stage_seconds", "Duration of pipeline stages.", ["stage"]
+        )
+        self.request_seconds = Histogram(
+            "rag_request_seconds", "Duration of chat requests until the last token.", ["kind"]
+        )
+        self.time_to_first_token = Histogram(
+            "rag_time_to_first_token_seconds", "Time from a chat request to its first answer token.", ["kind"]
+        )
+        self.tokens_per_second = Histogram(
+            "rag_tokens_per_second", "Answer streaming speed after the first token.", ["kind"], RATE_BUCKETS
+        )
+        self.llm_seconds = Histogram(
+            "rag_llm_call_seconds", "Duration of LLM calls.", ["model", "call"]
+        )
+        self.ingestion_rate = Histogram(
+            "rag_ingestion_items_per_second", "Ingestion throughput of a batch of files.", ["item"], RATE_BUCKETS
+        )
+        self._histograms = [
+            self.stage_seconds,
+            self.request_seconds,
+            self.time_to_first_token,
+            self.tokens_per_second,
+            self.llm_seconds,
+            self.ingestion_rate,
+        ]
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def span(self, stage: str):
+        """
+        Time a stage, attributed to the current request if there is one.
+        """
+        if not self.enabled:
+            return _NOOP
+        return self._span(stage)
+
+    @contextmanager
+    def _span(self, stage: str, trace: Optional[RequestTrace] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stage_seconds.observe(seconds, stage=stage)
+            trace = trace or _current_trace.get()
+            if trace is not None:
+                trace.spans.append((stage, seconds))
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        """
+        Time every call of fn as a stage of the current request,
+        for functions run on executor threads that do not see the request's context.
+        """
+        if not self.enabled:
+            return fn
+        trace = _current_trace.get()
+
+        def timed(*args, **kwargs):
+            with self._span(stage, trace):
+                return fn(*args, **kwargs)
+        return timed
+
+    @contextmanager
+    def request(self, kind: str) -> Iterator[Optional[RequestTrace]]:
+        """
+        Attribute the spans of the block to a new request trace, None when disabled.
+        The trace is finished by finish_request, or by the response wrapped with trace_stream.
+        """
+        if not self.enabled:
+            yield None
+            return
+        trace = RequestTrace(kind)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    def finish_request(self, trace: Optional[RequestTrace], first_token: Optional[float] = None, tokens: int = 0):
+        if trace is None:
+            return
+        elapsed = time.perf_counter() - trace.start
+        self.request_seconds.observe(elapsed, kind=trace.kind)
+        if first_token is not None:
+            trace.spans.append(("first_token", first_token))
+            self.time_to_first_token.observe(first_token, kind=trace.kind)
+            if tokens > 1 and elapsed > first_token:
+                self.tokens_per_second.observe((tokens - 1) / (elapsed - first_token), kind=trace.kind)
+        logger.info(trace.summary())
+
+    def trace_stream(self, response, trace: Optional[RequestTrace]):
+        """
+        Wrap a streaming chat response to record its time to first token and tokens per second.
+        """
+        if trace is None:
+            return response
+        return _TracedResponse(response, self, trace)
+
+    def current_trace(self) -> Optional[RequestTrace]:
+        return _current_trace.get()
+
+    def observe_llm_call(self, model: str, call: str, seconds: float, trace: Optional[RequestTrace] = None):
+        if not self.enabled:
+            return
+        self.llm_seconds.observe(seconds, model=model, call=call)
+        if trace is not None:
+            trace.spans.append((f"llm_{call}", seconds))
+
+    def observe_ingestion(self, seconds: float, **items: int):
+        if not self.enabled or seconds <= 0:
+            return
+        for item, count in items.items():
+            self.ingestion_rate.observe(count / seconds, item=item)
+
+    def render(self) -> str:
+        return "\n".join(line for histogram in self._histograms for line in histogram.render()) + "\n"
+
+    def start_server(self, host: str = "127.0.0.1", port: int = 9464) -> Optional[ThreadingHTTPServer]:
+        """
+        Serve the metrics on http://host:port/metrics from a background thread.
+        """
+        if not self.enabled or self._server is not None:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+
+class _TracedResponse:
+    def __init__(self, response, metrics: Metrics, trace: RequestTrace):
+        self._response = response
+        self._metrics = metrics
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    @property
+    def response_gen(self) -> Iterator[str]:
+        first_token, tokens = None, 0
+        gen = self._response.response_gen
+        try:
+            for token in gen:
+                if first_token is None:
+                    first_token = time.perf_counter() - self._trace.start
+                tokens += 1
+                yield token
+        finally:
+            if hasattr(gen, "close"):
+                gen.close()
+            self._metrics.finish_request(self._trace, first_token, tokens)
+
+    async def async_response_gen(self):
+        first_token, tokens = None, 0
+        gen = self._response.async_response_gen()
+        try:
+            async for token in gen:
+                if first_token is None:
+                    first_token = time.perf_counter() - self._trace.start
+                tokens += 1
+                yield token
+        finally:
+            await gen.aclose()
+            self._metrics.finish_request(self._trace, first_token, tokens)
+
+
+metrics = Metrics(enabled=METRICS_ENABLED)
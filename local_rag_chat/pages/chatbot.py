@@ -1,9 +1,14 @@
 import gradio as gr
 from gradio_pdf import PDF
 
+from local_rag_chat.core.serving.concurrency import ServerBusyError, iterate_tokens, coalesce_tokens
 from local_rag_chat.logs.logging_config import logger
 from local_rag_chat.pages.theme import CSS
 from pipeline import RAGPipeline
+from configs import (
+    STREAM_FLUSH_INTERVAL,
+    STREAM_FLUSH_TOKENS,
+)
 
 
 CHAT_MSG_PLACEHOLDER = "Thinking..."
@@ -15,10 +20,13 @@ logger.info("Initializing App in chatbot.py")
 class App:
     def __init__(self, pipeline: RAGPipeline):
         self._pipeline = pipeline
-        self.document_processed = False
+        # shared with the pipeline's background summary builds
+        self._limiter = pipeline.generation_limiter
 
-    def _get_response(self, query: str, history: list[dict[str, str]]):
-        if not self.document_processed:
+    async def _get_response(self, query: str, history: list[dict[str, str]], request: gr.Request):
+        session_id = request.session_hash
+        # an idle session may have been evicted together with its documents
+        if not self._pipeline.session(session_id).doc_ids:
             logger.warning("Document not processed yet, cannot get response.")
             yield ["## Please upload a document first!", history, query]
             return
@@ -31,30 +39,54 @@ class App:
         message = {'role': 'user', 'content': query}
         text = ""
         yield ["", history + [message, DEFAULT_ASSISTANT_DICT], ""]
-        streaming_response = self._pipeline.stream(query)
-        for token in streaming_response.response_gen:
-            text += token
-            assistant_message = {'role': 'assistant', 'content': text}
-            yield ["", history + [message, assistant_message or DEFAULT_ASSISTANT_DICT], ""]
+        try:
+            async with self._limiter.slot():
+                streaming_response = await self._pipeline.astream(query, session_id=session_id)
+                tokens = iterate_tokens(streaming_response)
+                try:
+                    # every update re-sends and diffs the whole chat, so tokens are sent in chunks;
+                    # Gradio only transmits the appended text of the assistant message
+                    async for chunk in coalesce_tokens(tokens, STREAM_FLUSH_INTERVAL, STREAM_FLUSH_TOKENS):
+                        text += chunk
+                        assistant_message = {'role': 'assistant', 'content': text}
+                        yield ["", history + [message, assistant_message], ""]
+                finally:
+                    # stops the LLM stream if the client went away
+                    await tokens.aclose()
+        except ServerBusyError as e:
+            logger.warning(f"Rejected query: {e} {self._limiter.stats()}")
+            yield ["## Server is busy, please try again in a moment.", history, query]
 
-    def upload_file(self, files):
+    def upload_file(self, files, request: gr.Request):
         logger.info("Uploading file...")
+        session_id = request.session_hash
         try:
             yield "## Processing documents, please wait..."
-            self._pipeline.process_documents(files)
-            self.document_processed = True
+            # the first indexed chunks can already be queried
+            for progress in self._pipeline.process_documents_stream(files, session_id=session_id):
+                yield f"## {progress}"
             logger.info("Documents processed successfully!")
             yield "## Documents processed successfully!"
         except Exception as e:
             logger.error(f"Error processing documents: {e}")
             yield "## Error processing documents, please try again!"
 
-    def change_llm(self, model: str):
+    def change_llm(self, model: str, request: gr.Request):
         logger.info(f"Changing model to: {model}")
         yield "## Changing model, please wait..."
-        self._pipeline.change_llm(model)
+        try:
+            # the current model keeps answering until the new one is loaded
+            for progress in self._pipeline.change_llm_stream(model, session_id=request.session_hash):
+                yield f"## {progress}"
+        except Exception as e:
+            logger.error(f"Error changing model: {e}")
+            yield "## Error changing model, please try again!"
+            return
         yield "## Model changed successfully!"
 
+    def close_session(self, request: gr.Request):
+        self._pipeline.close_session(request.session_hash)
+
     def build(self):
         with gr.Blocks(css=CSS) as app:
             status = gr.Markdown("")
@@ -99,4 +131,5 @@ class App:
                             inputs=[text_box, chatbot],
                             outputs=[status, chatbot, text_box]
                         )
+            app.unload(self.close_session)
         return app
@@ -1,98 +1,500 @@
-from typing import Optional
+import asyncio
+import threading
+from collections import Counter
+from typing import Optional, Iterator, Hashable
 from llama_index.core import Settings
 from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.base.embeddings.base import BaseEmbedding
-from llama_index.core.chat_engine.types import BaseChatEngine
-from llama_index.core.schema import BaseNode
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.llms import LLM
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.schema import BaseNode, QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+from local_rag_chat.core.chat_engine.answer_cache import SemanticAnswerCache, ReplayedResponse, RecordingResponse
 from local_rag_chat.core.chat_engine.chat_engine_manager import ChatEngineManager
+from local_rag_chat.core.llms.base import BaseLLMModel
+from local_rag_chat.core.llms.instrumentation import instrument_llms
 from local_rag_chat.core.llms.ollama import OllamaModel
 from local_rag_chat.core.llms.openai import OpenAIModel
-from local_rag_chat.core.loaders.base import BaseLoader
 from local_rag_chat.core.loaders.simple_loader import SimpleLoader
+from local_rag_chat.core.postprocessors.cross_encoder_reranker import CrossEncoderReranker
+from local_rag_chat.core.loaders.parallel_loader import ParallelLoader
 from local_rag_chat.core.retrievers.hybrid_retriever import HybridRetriever
+from local_rag_chat.core.retrievers.sharded_retriever import ShardedRetriever
+from local_rag_chat.core.retrievers.summary_retriever import SummaryTreeRetriever
+from local_rag_chat.core.retrievers.scoped_retriever import DocumentScopedRetriever
+from local_rag_chat.core.serving.concurrency import GenerationLimiter
+from local_rag_chat.core.sessions.chat_session import ChatSession
+from local_rag_chat.core.sessions.session_store import SessionStore
+from local_rag_chat.core.vector_stores.numpy_vector_store import NumpyVectorStore
 from local_rag_chat.core.embeddings.embedding_manager import EmbeddingManager
-from llama_index.core import SummaryIndex
+from local_rag_chat.core.embeddings.embedding_cache import CachedEmbedding
+from local_rag_chat.core.ingestion.streaming_ingestion import StreamingIngestion, IngestionProgress
 from local_rag_chat.logs.logging_config import logger
+from local_rag_chat.logs.metrics import metrics
+from configs import (
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_BACKEND,
+    EMBEDDING_LAZY,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_NUM_THREADS,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_QUANTIZE,
+    VECTOR_COMPRESSION,
+    VECTOR_STORAGE_DIR,
+    SUMMARY_CACHE_DIR,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    SESSION_MAX_SESSIONS,
+    SESSION_IDLE_TTL,
+    SESSION_MEMORY_TOKEN_LIMIT,
+    RERANKER_MODEL,
+    RERANK_CANDIDATES,
+    RERANK_TOP_N,
+    RERANK_CUTOFF_MARGIN,
+    SHARDED_RETRIEVAL,
+    SHARD_STORAGE_DIR,
+    SHARD_MEMORY_BUDGET,
+    SHARD_MAX_NODES,
+    MAX_CONCURRENT_GENERATIONS,
+    MAX_WAITING_GENERATIONS,
+    GENERATION_WAIT_TIMEOUT,
+)
+
+DEFAULT_SESSION = "default"
 
 
 class RAGPipeline:
+    """
+    The indexes and the embedding model are shared by every chat session, while each
+    session keeps its own LLM, document set and conversation memory. A document is
+    indexed once however many sessions upload it, and removed from the indexes once
+    no session uses it anymore.
+    """
     def __init__(
             self,
             llm: str = "llama3.2:1b",
             embedding: str = "BAAI/bge-small-en-v1.5",
-            chat_mode: str = "condense_plus_context"
+            chat_mode: str = "condense_plus_context",
+            embedding_cache_dir: Optional[str] = EMBEDDING_CACHE_DIR,
+            embedding_backend: str = EMBEDDING_BACKEND,
+            incremental: bool = True,
+            parallel_loading: bool = False,
+            router_mode: str = "embedding",
+            summary_cache_dir: Optional[str] = SUMMARY_CACHE_DIR,
+            answer_cache: bool = False,
+            reranker: Optional[str] = RERANKER_MODEL,
+            sharded: bool = SHARDED_RETRIEVAL,
+            max_sessions: int = SESSION_MAX_SESSIONS,
+            session_idle_ttl: Optional[float] = SESSION_IDLE_TTL
     ):
         self.llm = llm
         self.chat_mode = chat_mode
+        self.router_mode = router_mode
+        self.summary_cache_dir = summary_cache_dir
+        self.incremental = incremental
+        self.sharded = sharded
+        # bumped when the chunks of a document change, cached answers are only served
+        # to sessions with the same documents in the same versions
+        self._document_versions: Counter[str] = Counter()
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        if answer_cache:
+            self.answer_cache = SemanticAnswerCache(
+                threshold=ANSWER_CACHE_THRESHOLD,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                ttl=ANSWER_CACHE_TTL
+            )
+
+        # shared by the sessions, the model is loaded on the first query
+        self.reranker: Optional[CrossEncoderReranker] = None
+        if reranker:
+            self.reranker = CrossEncoderReranker(
+                model=reranker, top_n=RERANK_TOP_N, cutoff_margin=RERANK_CUTOFF_MARGIN
+            )
+
+        # chat requests take its slots, background summary builds wait until they are all free
+        self.generation_limiter = GenerationLimiter(
+            max_concurrent=MAX_CONCURRENT_GENERATIONS,
+            max_waiting=MAX_WAITING_GENERATIONS,
+            wait_timeout=GENERATION_WAIT_TIMEOUT
+        )
 
         self.retrievers: list[BaseRetriever] = []
-        self.embed_model: BaseEmbedding = EmbeddingManager(model=embedding).get_embedding()
+        self.hybrid_retriever: Optional[HybridRetriever | ShardedRetriever] = None
+        self.summary_retriever: Optional[SummaryTreeRetriever] = None
+        self.embed_model: BaseEmbedding = EmbeddingManager(
+            model=embedding,
+            cache_dir=embedding_cache_dir,
+            cache_max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+            backend=embedding_backend,
+            lazy=EMBEDDING_LAZY,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            num_threads=EMBEDDING_NUM_THREADS,
+            onnx_dir=EMBEDDING_ONNX_DIR,
+            quantize=EMBEDDING_QUANTIZE
+        ).get_embedding()
         Settings.embed_model = self.embed_model
 
-        self.llm_model: Optional[OpenAIModel | OllamaModel] = None
+        self._lock = threading.RLock()
+        instrument_llms()
+        self._llms: dict[str, BaseLLMModel] = {}
+        self.llm_model: Optional[LLM] = None
         self._initialize_llm()
 
-        self.chat_engine_manager: Optional[ChatEngineManager] = None
-        self.chat_engine: Optional[BaseChatEngine] = None
-        self.loader: BaseLoader = SimpleLoader()
+        self.loader: SimpleLoader = ParallelLoader() if parallel_loading else SimpleLoader()
+        self._document_refs: Counter[str] = Counter()
+        # documents being ingested, another session uploading them does not index them twice
+        self._pending_doc_ids: set[str] = set()
+        self.sessions: SessionStore[ChatSession] = SessionStore(
+            self._create_session,
+            max_sessions=max_sessions,
+            idle_ttl=session_idle_ttl,
+            on_evict=self._close_session
+        )
+        self._initialize_retrievers([])
+
+    def _get_llm_model(self, llm: str) -> BaseLLMModel:
+        """
+        LLM clients are shared by the sessions using the same model.
+        """
+        with self._lock:
+            if llm not in self._llms:
+                logger.info(f"Initializing LLM: {llm}")
+                if "gpt" in llm:
+                    self._llms[llm] = OpenAIModel(model=llm)
+                else:
+                    self._llms[llm] = OllamaModel(model=llm)
+            return self._llms[llm]
+
+    def _get_llm(self, llm: str) -> LLM:
+        return self._get_llm_model(llm).get_llm()
 
     def _initialize_llm(self):
-        logger.info(f"Initializing LLM: {self.llm}")
-        if "gpt" in self.llm:
-            llm_model = OpenAIModel(model=self.llm)
-        else:
-            llm_model = OllamaModel(model=self.llm)
-        self.llm_model = llm_model.get_llm()
-        Settings.llm = llm_model.get_llm()
+        """
+        The default LLM, used by new sessions and to build document summaries.
+        It is loaded before the app starts so the first query does not wait for it.
+        """
+        for message in self._get_llm_model(self.llm).warm_up():
+            logger.info(message)
+        self.llm_model = self._get_llm(self.llm)
+        Settings.llm = self.llm_model
+        if self.summary_retriever is not None:
+            self.summary_retriever.llm = self.llm_model
 
-    def change_llm(self, llm: str):
-        self.llm = llm
-        self._initialize_llm()
+    def _create_session(self, session_id: str) -> ChatSession:
+        return ChatSession(
+            session_id=session_id,
+            llm_name=self.llm,
+            llm=self.llm_model,
+            memory=ChatMemoryBuffer(token_limit=SESSION_MEMORY_TOKEN_LIMIT)
+        )
+
+    def _close_session(self, session: ChatSession):
+        logger.info(f"Closing session {session.session_id}")
+        self._release_documents(session, list(session.doc_ids))
+
+    def session(self, session_id: str = DEFAULT_SESSION) -> ChatSession:
+        return self.sessions.get(session_id)
+
+    def close_session(self, session_id: str):
+        self.sessions.remove(session_id)
+
+    def change_llm_stream(self, llm: str, session_id: str = DEFAULT_SESSION) -> Iterator[str]:
+        """
+        Switch the LLM of one session, its conversation is kept. The session keeps
+        answering with its current model until the new one is pulled and loaded.
+        :return: progress messages
+        """
+        yield from self._get_llm_model(llm).warm_up()
+        session = self.session(session_id)
+        session.llm_name = llm
+        session.llm = self._get_llm(llm)
+        session.chat_engine = None
+
+    def change_llm(self, llm: str, session_id: str = DEFAULT_SESSION):
+        for message in self.change_llm_stream(llm, session_id=session_id):
+            logger.info(message)
 
     def _initialize_retrievers(self, nodes: list[BaseNode]):
         logger.info(f"Initializing list of retrievers")
-        hybrid_retriever = HybridRetriever(
-            nodes=nodes,
-            embed_model=self.embed_model,
-            top_k=5
-        )
+        # the reranker picks the best chunks among more candidates
+        top_k = RERANK_CANDIDATES if self.reranker is not None else 5
+        fusion_top_k = top_k if self.reranker is not None else 3
+        if self.sharded:
+            self.hybrid_retriever = ShardedRetriever(
+                nodes=nodes,
+                embed_model=self.embed_model,
+                top_k=top_k,
+                fusion_top_k=fusion_top_k,
+                compression=VECTOR_COMPRESSION,
+                storage_dir=SHARD_STORAGE_DIR,
+                memory_budget=SHARD_MEMORY_BUDGET,
+                shard_max_nodes=SHARD_MAX_NODES
+            )
+        else:
+            self.hybrid_retriever = HybridRetriever(
+                nodes=nodes,
+                embed_model=self.embed_model,
+                top_k=top_k,
+                fusion_top_k=fusion_top_k,
+                vector_store=NumpyVectorStore(compression=VECTOR_COMPRESSION, vectors_dir=VECTOR_STORAGE_DIR)
+            )
         # summary retriever
-        summary_index = SummaryIndex(nodes)
-        list_retriever = summary_index.as_retriever()
+        # documents whose summary tree is not built yet are answered with chunks
+        self.summary_retriever = SummaryTreeRetriever(
+            llm=self.llm_model,
+            cache_dir=self.summary_cache_dir,
+            fallback=self.hybrid_retriever,
+            limiter=self.generation_limiter
+        )
+        self.summary_retriever.add_nodes(nodes)
+
+        self.retrievers = [self.hybrid_retriever, self.summary_retriever]
+
+    def _add_to_retrievers(self, nodes: list[BaseNode]):
+        """
+        Append nodes to the existing retrievers, the chat engines keep using the same objects.
+        """
+        logger.debug(f"Adding {len(nodes)} nodes to the existing retrievers")
+        with self._lock:
+            self._document_versions.update({node.ref_doc_id for node in nodes})
+        self.hybrid_retriever.add_nodes(nodes)
+        self.summary_retriever.add_nodes(nodes)
+
+    @property
+    def document_ids(self) -> list[str]:
+        """
+        Ids of the documents indexed for any session.
+        """
+        return self.hybrid_retriever.document_ids if self.hybrid_retriever else []
+
+    def _delete_document(self, doc_id: str):
+        logger.info(f"Removing document {doc_id} from the indexes")
+        with self._lock:
+            self._document_versions[doc_id] += 1
+        self.hybrid_retriever.delete_document(doc_id)
+        self.summary_retriever.delete_document(doc_id)
 
-        self.retrievers = [hybrid_retriever, list_retriever]
+    def _acquire_documents(self, session: ChatSession, doc_ids: list[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id not in session.doc_ids:
+                    session.doc_ids.add(doc_id)
+                    self._document_refs[doc_id] += 1
 
+    def _release_documents(self, session: ChatSession, doc_ids: list[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id not in session.doc_ids:
+                    continue
+                session.doc_ids.discard(doc_id)
+                self._document_refs[doc_id] -= 1
+                if self._document_refs[doc_id] <= 0:
+                    del self._document_refs[doc_id]
+                    if doc_id in self.document_ids:
+                        self._delete_document(doc_id)
 
-    def _initialize_chat_engine(self):
-        logger.info(f"Initializing Chat Engine: {self.chat_mode}")
+    def remove_document(self, doc_id: str, session_id: str = DEFAULT_SESSION):
+        """
+        Remove a document from a session, and from the indexes if no other session uses it.
+        """
+        session = self.session(session_id)
+        if doc_id not in session.doc_ids:
+            raise ValueError(f"Document {doc_id} is not indexed.")
+        self._release_documents(session, [doc_id])
+
+    def _initialize_chat_engine(self, session: ChatSession):
+        logger.info(f"Initializing Chat Engine: {self.chat_mode} for session {session.session_id}")
         if not self.retrievers:
             raise ValueError("Retriever list not initialized.")
 
-        self.chat_engine_manager = ChatEngineManager(
-            self.llm_model,
-            self.retrievers,
-            chat_mode=self.chat_mode
+        session.chat_engine_manager = ChatEngineManager(
+            session.llm,
+            [DocumentScopedRetriever(retriever, session.doc_ids, session.filters) for retriever in self.retrievers],
+            chat_mode=self.chat_mode,
+            embed_model=self.embed_model,
+            router_mode=self.router_mode,
+            memory=session.memory,
+            node_postprocessors=[self.reranker] if self.reranker is not None else None
+        )
+        session.chat_engine = session.chat_engine_manager.get_engine()
+
+    def set_filters(self, filters: Optional[MetadataFilters], session_id: str = DEFAULT_SESSION):
+        """
+        Restrict the retrieval of a session to the chunks matching the metadata filters,
+        e.g. a "file_name" or a "page_label" range; None lifts the restriction.
+        """
+        session = self.session(session_id)
+        session.filters = filters
+        if session.chat_engine_manager is not None:
+            for retriever in session.chat_engine_manager.retrievers:
+                retriever.filters = filters
+
+    def _session_engine(self, session_id: str) -> ChatSession:
+        session = self.session(session_id)
+        if not session.chat_engine:
+            self._initialize_chat_engine(session)
+        return session
+
+    @staticmethod
+    def _is_standalone(session: ChatSession) -> bool:
+        # only standalone questions are cached, follow-ups depend on the history
+        return not any(m.role == MessageRole.USER for m in session.memory.get_all())
+
+    def _scope(self, session: ChatSession) -> Hashable:
+        """
+        The documents of a session with their versions, answers are cached per scope.
+        """
+        with self._lock:
+            return frozenset((doc_id, self._document_versions[doc_id]) for doc_id in session.doc_ids)
+
+    def _cached_answer(
+            self,
+            session: ChatSession,
+            query: str,
+            query_bundle: QueryBundle,
+            node_ids: list[str],
+            scope: Hashable
+    ):
+        answer = self.answer_cache.lookup(query_bundle.embedding, node_ids, scope)
+        logger.debug(f"Answer cache stats: {self.answer_cache.stats()}")
+        if answer is None:
+            return None
+        session.memory.put(ChatMessage(role=MessageRole.USER, content=query))
+        session.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        return ReplayedResponse(answer)
+
+    def _recording(self, response, query_bundle: QueryBundle, node_ids: list[str], scope: Hashable):
+        return RecordingResponse(
+            response,
+            on_complete=lambda text: self.answer_cache.put(query_bundle.embedding, node_ids, scope, text)
         )
-        self.chat_engine = self.chat_engine_manager.get_engine()
 
-    def stream(self, query: str):
+    def stream(self, query: str, session_id: str = DEFAULT_SESSION):
         """
-        Stream the chatbot
-        using chat_history in chat_engine if we want to control the chat history
+        Stream the answer of a session's chat engine,
+        the conversation history is kept in the session memory
         :param query:
+        :param session_id:
         :return:
         """
-        if not self.chat_engine:
-            self._initialize_chat_engine()
-        return self.chat_engine.stream_chat(query)
+        with metrics.request("stream") as trace:
+            return metrics.trace_stream(self._stream(query, session_id), trace)
 
-    def process_documents(self, file_paths: list[str] | str):
-        documents = []
+    def _stream(self, query: str, session_id: str):
+        session = self._session_engine(session_id)
+        if self.answer_cache is None or not self._is_standalone(session):
+            return session.chat_engine.stream_chat(query)
+
+        scope = self._scope(session)
+        with metrics.span("embed_query"):
+            query_bundle = QueryBundle(query, embedding=self.embed_model.get_query_embedding(query))
+        nodes = session.chat_engine_manager.retriever.retrieve(query_bundle)
+        node_ids = [node.node.node_id for node in nodes]
+        with metrics.span("answer_cache"):
+            cached = self._cached_answer(session, query, query_bundle, node_ids, scope)
+        if cached is not None:
+            return cached
+        # on a miss the chat engine answers from these nodes instead of retrieving them again
+        session.chat_engine.prefetch(query_bundle, nodes)
+        return self._recording(session.chat_engine.stream_chat(query), query_bundle, node_ids, scope)
+
+    async def astream(self, query: str, session_id: str = DEFAULT_SESSION):
+        """
+        Async version of stream, the tokens are read from the response's async_response_gen.
+        """
+        with metrics.request("astream") as trace:
+            return metrics.trace_stream(await self._astream(query, session_id), trace)
+
+    async def _astream(self, query: str, session_id: str):
+        session = self._session_engine(session_id)
+        if self.answer_cache is None or not self._is_standalone(session):
+            return await session.chat_engine.astream_chat(query)
+
+        scope = self._scope(session)
+        with metrics.span("embed_query"):
+            # local models embed synchronously even through the async API, and a lazy one loads first
+            embedding = await asyncio.to_thread(self.embed_model.get_query_embedding, query)
+            query_bundle = QueryBundle(query, embedding=embedding)
+        nodes = await session.chat_engine_manager.retriever.aretrieve(query_bundle)
+        node_ids = [node.node.node_id for node in nodes]
+        with metrics.span("answer_cache"):
+            cached = self._cached_answer(session, query, query_bundle, node_ids, scope)
+        if cached is not None:
+            return cached
+        session.chat_engine.prefetch(query_bundle, nodes)
+        return self._recording(await session.chat_engine.astream_chat(query), query_bundle, node_ids, scope)
+
+    def _split_new_files(self, file_paths: list[str] | str) -> tuple[list[str], list[str], list[str]]:
+        """
+        Return the document ids of all files, and the files and ids that still need indexing.
+        Must hold the lock.
+        """
         if isinstance(file_paths, str):
             file_paths = [file_paths]
-        for file in file_paths:
-            documents.extend(self.loader.fit(file))
-        # TODO: clear chat engine memory for new documents
-        if self.chat_engine:
-            pass
-        self._initialize_retrievers(documents)
+        doc_ids = [self.loader.document_id(file) for file in file_paths]
+        new_files = []
+        new_doc_ids = []
+        for file, doc_id in zip(file_paths, doc_ids):
+            if doc_id in self.document_ids or doc_id in self._pending_doc_ids or doc_id in new_doc_ids:
+                logger.info(f"Document {file} is already indexed, skipping")
+                continue
+            new_files.append(file)
+            new_doc_ids.append(doc_id)
+        return doc_ids, new_files, new_doc_ids
+
+    def process_documents_stream(
+            self,
+            file_paths: list[str] | str,
+            session_id: str = DEFAULT_SESSION
+    ) -> Iterator[IngestionProgress]:
+        """
+        Add the given files to a session, yielding progress while they are extracted, split, embedded and indexed.
+        In incremental mode the files are added to the session's documents, otherwise they replace them.
+        Files already indexed for any session are not indexed again.
+        Indexed chunks are queryable while the rest of the files are still being processed.
+        """
+        session = self.session(session_id)
+        with self._lock:
+            doc_ids, new_files, new_doc_ids = self._split_new_files(file_paths)
+            self._pending_doc_ids.update(new_doc_ids)
+        try:
+            if not self.incremental:
+                self._release_documents(session, [d for d in list(session.doc_ids) if d not in doc_ids])
+                # the chat engine is rebuilt with a fresh memory for the new documents
+                session.memory.reset()
+                session.chat_engine = None
+            self._acquire_documents(session, doc_ids)
+            if new_files:
+                ingestion = StreamingIngestion(self.loader, self.embed_model, on_nodes=self._add_to_retrievers)
+                try:
+                    yield from ingestion.run(new_files, new_doc_ids)
+                except BaseException:
+                    # also when the consumer stops early, a partially indexed document
+                    # would be taken as indexed and never completed by a later upload
+                    with self._lock:
+                        for doc_id in new_doc_ids:
+                            if doc_id in self.document_ids:
+                                self._delete_document(doc_id)
+                    raise
+                if isinstance(self.hybrid_retriever, ShardedRetriever):
+                    # written once per upload rather than per batch, and not on a query's eviction
+                    self.hybrid_retriever.flush()
+                self.summary_retriever.schedule(new_doc_ids)
+        finally:
+            with self._lock:
+                self._pending_doc_ids.difference_update(new_doc_ids)
+        if isinstance(self.embed_model, CachedEmbedding):
+            logger.info(f"Embedding cache stats: {self.embed_model.cache.stats()}")
+
+    def process_documents(self, file_paths: list[str] | str, session_id: str = DEFAULT_SESSION) -> list[str]:
+        """
+        Add the given files to a session and return their document ids.
+        """
+        with self._lock:
+            doc_ids, _, _ = self._split_new_files(file_paths)
+        for progress in self.process_documents_stream(file_paths, session_id):
+            logger.debug(f"Ingestion progress: {progress}")
+        return doc_ids
@@ -0,0 +1,47 @@
+import numpy as np
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+from pipeline import RAGPipeline
+
+
+def _chunks(doc_id, texts, rng):
+    nodes = []
+    for i, text in enumerate(texts):
+        node = TextNode(id_=f"{doc_id}-{i}", text=text, embedding=rng.standard_normal(384).tolist())
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+        nodes.append(node)
+    return nodes
+
+
+def _pipeline(monkeypatch, tmp_path) -> RAGPipeline:
+    # the default LLM is warmed up against a running Ollama server otherwise
+    monkeypatch.setattr(RAGPipeline, "_initialize_llm", lambda self: None)
+    monkeypatch.chdir(tmp_path)
+    return RAGPipeline(
+        embedding_cache_dir=None, summary_cache_dir=None, answer_cache=True, reranker=None, sharded=False
+    )
+
+
+def test_cached_answer_is_invalidated_by_a_document_version_bump(monkeypatch, tmp_path):
+    rng = np.random.default_rng(0)
+    pipeline = _pipeline(monkeypatch, tmp_path)
+    session = pipeline.session("s1")
+    pipeline._acquire_documents(session, ["a"])
+    pipeline._add_to_retrievers(_chunks("a", ["old text", "more old text"], rng))
+
+    query = rng.standard_normal(384)
+    node_ids = ["a-0", "a-1"]
+    pipeline.answer_cache.put(query, node_ids, pipeline._scope(session), "old answer")
+    assert pipeline.answer_cache.lookup(query, node_ids, pipeline._scope(session)) == "old answer"
+
+    # another session indexing another document keeps the answer
+    other = pipeline.session("s2")
+    pipeline._acquire_documents(other, ["b"])
+    pipeline._add_to_retrievers(_chunks("b", ["unrelated"], rng))
+    assert pipeline.answer_cache.lookup(query, node_ids, pipeline._scope(session)) == "old answer"
+
+    # the document is removed, then indexed again with new chunks under the same ids
+    pipeline.remove_document("a", "s1")
+    pipeline._acquire_documents(session, ["a"])
+    pipeline._add_to_retrievers(_chunks("a", ["new text", "more new text"], rng))
+    assert pipeline.answer_cache.lookup(query, node_ids, pipeline._scope(session)) is None
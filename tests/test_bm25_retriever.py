@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+from llama_index.core.schema import QueryBundle, TextNode
+
+from local_rag_chat.core.retrievers.bm25_retriever import BM25Index, BM25KeywordRetriever
+
+WORDS = [f"word{i}" for i in range(300)]
+
+
+def _nodes(rng, prefix, n, length=30):
+    return [TextNode(id_=f"{prefix}{i}", text=" ".join(rng.choice(WORDS, length))) for i in range(n)]
+
+
+def test_queries_run_while_nodes_are_added_and_deleted():
+    rng = np.random.default_rng(0)
+    retriever = BM25KeywordRetriever(_nodes(rng, "base", 500), similarity_top_k=5)
+    stop = threading.Event()
+    errors = []
+
+    def update():
+        batch = 0
+        while not stop.is_set():
+            nodes = _nodes(rng, f"batch{batch}-", 20)
+            retriever.add_nodes(nodes)
+            retriever.delete_nodes([node.node_id for node in nodes[::2]])
+            batch += 1
+
+    thread = threading.Thread(target=update)
+    thread.start()
+    try:
+        for _ in range(200):
+            query = QueryBundle(" ".join(rng.choice(WORDS, 4)))
+            try:
+                hits = retriever.retrieve(query)
+            except Exception as e:
+                errors.append(e)
+                break
+            scores = [hit.score for hit in hits]
+            assert scores == sorted(scores, reverse=True)
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
+
+
+def _search_all(index, rng, n_queries=50):
+    queries = [" ".join(rng.choice(WORDS, 4)) for _ in range(n_queries)]
+    return [[(node_id, round(score, 5)) for node_id, score in index.search(query, 10)] for query in queries]
+
+
+def test_delta_merge_keeps_the_results():
+    rng = np.random.default_rng(1)
+    index = BM25Index()
+    index.add((node.node_id, node.text) for node in _nodes(rng, "base", 400))
+    index.merge()
+    index.add((node.node_id, node.text) for node in _nodes(rng, "delta", 100))
+    assert index._delta_size
+
+    before = _search_all(index, np.random.default_rng(2))
+    index.merge()
+    assert not index._delta_size
+    assert _search_all(index, np.random.default_rng(2)) == before
+
+
+def test_merge_after_deletions_matches_a_fresh_index():
+    rng = np.random.default_rng(3)
+    nodes = _nodes(rng, "base", 400)
+    index = BM25Index()
+    index.add((node.node_id, node.text) for node in nodes)
+    index.merge()
+    index.remove(node.node_id for node in nodes[::3])
+    index.merge()
+
+    fresh = BM25Index()
+    fresh.add((node.node_id, node.text) for i, node in enumerate(nodes) if i % 3)
+    assert _search_all(index, np.random.default_rng(4)) == _search_all(fresh, np.random.default_rng(4))
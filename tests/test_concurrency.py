@@ -0,0 +1,27 @@
+import asyncio
+import threading
+
+from local_rag_chat.core.serving.concurrency import GenerationLimiter
+
+
+def test_background_slot_waits_for_requests():
+    limiter = GenerationLimiter(max_concurrent=1)
+    started = threading.Event()
+
+    def background():
+        with limiter.background_slot():
+            started.set()
+
+    async def request():
+        async with limiter.slot():
+            thread = threading.Thread(target=background)
+            thread.start()
+            # a request holding the slot keeps the background generation waiting
+            await asyncio.sleep(0.1)
+            assert not started.is_set()
+        return thread
+
+    thread = asyncio.run(request())
+    assert started.wait(5)
+    thread.join()
+    assert limiter.stats()["background"] == 0
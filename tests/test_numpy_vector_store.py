@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from local_rag_chat.core.vector_stores.numpy_vector_store import NumpyVectorStore
+
+
+def _nodes(vectors, prefix):
+    return [TextNode(id_=f"{prefix}{i}", text="", embedding=vector.tolist()) for i, vector in enumerate(vectors)]
+
+
+def _recall(store, exact, queries, top_k=10):
+    hits = 0
+    for query in queries:
+        query = VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k)
+        hits += len(set(store.query(query).ids) & set(exact.query(query).ids))
+    return hits / (top_k * len(queries))
+
+
+def test_int8_codes_of_later_batches_are_not_clipped(tmp_path):
+    rng = np.random.default_rng(0)
+    first = rng.standard_normal((2000, 64))
+    # concentrated on a few components, far outside the range of the first batch
+    later = rng.standard_normal((2000, 64))
+    later[:, :4] *= 12
+    exact = NumpyVectorStore()
+    store = NumpyVectorStore(compression="int8", rescore_factor=1, vectors_dir=str(tmp_path))
+    for vectors, prefix in [(first, "a"), (later, "b")]:
+        exact.add(_nodes(vectors, prefix))
+        store.add(_nodes(vectors, prefix))
+    queries = later[rng.choice(len(later), 50)] + 0.5 * rng.standard_normal((50, 64))
+    # the coarse int8 scores alone rank the results, without a larger shortlist to rescore
+    assert _recall(store, exact, queries) >= 0.95
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf"])
+@pytest.mark.parametrize("compression, tolerance", [("int8", 0.02), ("binary", 0.06)])
+def test_quantized_recall_is_close_to_f32(tmp_path, index_type, compression, tolerance):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 128))
+    vectors = centers[rng.integers(0, len(centers), 5000)] + rng.standard_normal((5000, 128))
+    queries = vectors[rng.choice(len(vectors), 50)] + 0.3 * rng.standard_normal((50, 128))
+    exact = NumpyVectorStore()
+    f32 = NumpyVectorStore(index_type=index_type, ivf_min_vectors=1000)
+    store = NumpyVectorStore(
+        index_type=index_type, ivf_min_vectors=1000, compression=compression, vectors_dir=str(tmp_path)
+    )
+    for vector_store in (exact, f32, store):
+        vector_store.add(_nodes(vectors, "n"))
+    assert _recall(store, exact, queries) >= _recall(f32, exact, queries) - tolerance
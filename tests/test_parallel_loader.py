@@ -0,0 +1,25 @@
+import fitz
+
+from local_rag_chat.core.loaders.parallel_loader import ParallelLoader
+
+
+def _make_pdf(path, num_pages):
+    with fitz.open() as pdf:
+        for i in range(num_pages):
+            page = pdf.new_page()
+            page.insert_text((72, 72), f"Page {i} of the parallel loader test.")
+        pdf.save(path)
+
+
+def test_iter_file_pages_spawns_workers_for_large_files(tmp_path):
+    # more pages than one shard, so the pages are extracted by the spawned process pool
+    path = str(tmp_path / "large.pdf")
+    _make_pdf(path, 40)
+    loader = ParallelLoader(max_workers=2, pages_per_shard=16)
+    try:
+        pages = list(loader.iter_file_pages([path]))
+    finally:
+        loader.close()
+    assert [page_num for _, page_num, _ in pages] == list(range(40))
+    assert all(file == path for file, _, _ in pages)
+    assert all(f"Page {page_num} of" in text for _, page_num, text in pages)
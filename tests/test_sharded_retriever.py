@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import NodeRelationship, QueryBundle, RelatedNodeInfo, TextNode
+
+from local_rag_chat.core.retrievers.hybrid_retriever import HybridRetriever
+from local_rag_chat.core.retrievers.sharded_retriever import ShardedRetriever
+from local_rag_chat.core.vector_stores.numpy_vector_store import NumpyVectorStore
+
+WORDS = [f"word{i}" for i in range(2000)]
+DIM = 64
+
+
+def _documents(rng, n_docs=4, n_chunks=150):
+    nodes = []
+    for doc in range(n_docs):
+        for i in range(n_chunks):
+            node = TextNode(
+                id_=f"doc{doc}-{i}", text=" ".join(rng.choice(WORDS, 40)), embedding=rng.standard_normal(DIM).tolist()
+            )
+            node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=f"doc{doc}")
+            nodes.append(node)
+    return nodes
+
+
+def _scores(retriever, queries):
+    return [[(hit.node.node_id, round(hit.score, 6)) for hit in retriever.retrieve(query)] for query in queries]
+
+
+@pytest.mark.parametrize("shard_max_nodes", [None, 250])
+def test_sharded_scores_equal_single_index_after_evict_and_reload(tmp_path, shard_max_nodes):
+    rng = np.random.default_rng(0)
+    nodes = _documents(rng)
+    embed_model = MockEmbedding(embed_dim=DIM)
+    single = HybridRetriever(nodes, embed_model, top_k=5, vector_store=NumpyVectorStore())
+    # every shard but the last used one is written to disk and dropped from memory
+    sharded = ShardedRetriever(
+        None, embed_model, top_k=5, storage_dir=str(tmp_path), memory_budget=1, shard_max_nodes=shard_max_nodes
+    )
+    for start in range(0, len(nodes), 32):
+        sharded.add_nodes(nodes[start:start + 32])
+    sharded.flush()
+    single.delete_document("doc1")
+    sharded.delete_document("doc1")
+    assert sharded.stats()["loaded"] == 1 < sharded.num_shards
+
+    queries = [
+        QueryBundle(" ".join(rng.choice(WORDS, 6)), embedding=rng.standard_normal(DIM).tolist()) for _ in range(20)
+    ]
+    assert _scores(sharded, queries) == _scores(single, queries)
+    assert sharded.stats()["loaded"] == 1
@@ -0,0 +1,29 @@
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+
+from local_rag_chat.core.retrievers.summary_retriever import SummaryTreeRetriever
+
+
+def _chunk(doc_id, page, file_name):
+    node = TextNode(id_=f"{doc_id}-{page}", text=f"page {page}", metadata={"file_name": file_name, "page_label": str(page)})
+    node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+    return node
+
+
+def test_filters_select_documents_with_a_matching_chunk():
+    retriever = SummaryTreeRetriever(llm=MockLLM())
+    retriever.add_nodes([_chunk("a", page, "a.pdf") for page in range(1, 4)])
+    retriever.add_nodes([_chunk("b", page, "b.pdf") for page in range(1, 10)])
+    retriever.add_nodes([_chunk("c", 1, "c.pdf")])
+
+    by_file = MetadataFilters(filters=[MetadataFilter(key="file_name", value="b.pdf")])
+    late_pages = MetadataFilters(filters=[MetadataFilter(key="page_label", value=3, operator=FilterOperator.GTE)])
+    assert retriever._select_documents(None, by_file) == ["b"]
+    assert retriever._select_documents(None, late_pages) == ["a", "b"]
+    assert retriever._select_documents({"b", "c"}, late_pages) == ["b"]
+    assert retriever._select_documents({"c", "a"}, None) == ["a", "c"]
+
+    retriever.delete_document("b")
+    assert retriever._select_documents(None, by_file) == []
+    assert retriever._select_documents(None, late_pages) == ["a"]